@@ -0,0 +1,235 @@
+"""Admission control for CPU-heavy endpoints.
+
+Each endpoint class (for example ``image`` for the routes that run the
+segmenter) gets an :class:`AdmissionController`. It allows a fixed number of
+concurrent segmentations and a bounded queue of waiters. A request that finds
+the queue full, or that waits longer than the configured maximum, raises
+:class:`Overloaded`. The app turns that into a ``503`` with ``Retry-After``.
+Overflow is therefore rejected quickly instead of piling up behind the
+segmenter until every request times out.
+"""
+
+import contextlib
+import contextvars
+import math
+import os
+import threading
+import time
+from typing import Optional
+
+from metrics import Counter, Gauge, Histogram, stage
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "wardrobe_admission_queue_depth", "Requests waiting for a slot per endpoint class", ["class"]
+)
+ADMISSION_ACTIVE = Gauge(
+    "wardrobe_admission_active", "Requests holding a slot per endpoint class", ["class"]
+)
+ADMISSION_REJECTED = Counter(
+    "wardrobe_admission_rejected_total",
+    "Requests shed per endpoint class and reason (queue_full or timeout)",
+    ["class", "reason"],
+)
+ADMISSION_WAIT = Histogram(
+    "wardrobe_admission_wait_seconds", "Time spent waiting for a slot per endpoint class", ["class"]
+)
+DEGRADATION_LEVEL = Gauge(
+    "wardrobe_segmentation_degradation_level",
+    "Segmentation tiers skipped because queue latency misses its target (0 is none)",
+)
+
+#: Weight of the newest sample in the service and wait time averages
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    """Raised when a request can't be admitted; carries a ``Retry-After`` hint."""
+
+    def __init__(self, name: str, reason: str, retry_after: int):
+        super().__init__(f"{name} endpoints overloaded ({reason})")
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded, time-limited wait queue.
+
+    Parameters
+    ----------
+    name : str
+        Endpoint class, used as the metrics label.
+    max_concurrency : int
+        Work items allowed to run at once.
+    max_queue : int
+        Requests allowed to wait for a slot; more are rejected at once.
+    max_wait : float
+        Seconds a request may wait before it is rejected.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.service_time: Optional[float] = None
+        self.wait_time: Optional[float] = None
+        self._cond = threading.Condition()
+
+    def _observe_wait(self, seconds: float) -> None:
+        if self.wait_time is None:
+            self.wait_time = seconds
+        else:
+            self.wait_time += SERVICE_TIME_SMOOTHING * (seconds - self.wait_time)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free, estimated from recent service times."""
+        per_item = self.service_time or self.max_wait or 1.0
+        return max(1, math.ceil(per_item * (self.waiting + 1) / self.max_concurrency))
+
+    def _reject(self, reason: str):
+        # A shed request would have waited at least the maximum
+        self._observe_wait(self.max_wait)
+        ADMISSION_REJECTED.inc(**{"class": self.name, "reason": reason})
+        raise Overloaded(self.name, reason, self.retry_after())
+
+    def check(self) -> None:
+        """Reject right away when no slot is free and the queue is full."""
+        with self._cond:
+            if self.active >= self.max_concurrency and self.waiting >= self.max_queue:
+                self._reject("queue_full")
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one slot for the duration of the ``with`` block."""
+        start = time.monotonic()
+        with stage("queue"), self._cond:
+            if self.active >= self.max_concurrency or self.waiting:
+                if self.waiting >= self.max_queue:
+                    self._reject("queue_full")
+                self.waiting += 1
+                ADMISSION_QUEUE_DEPTH.inc(**{"class": self.name})
+                try:
+                    while self.active >= self.max_concurrency:
+                        remaining = start + self.max_wait - time.monotonic()
+                        if remaining <= 0:
+                            self._reject("timeout")
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                    ADMISSION_QUEUE_DEPTH.dec(**{"class": self.name})
+            self.active += 1
+            ADMISSION_ACTIVE.inc(**{"class": self.name})
+            waited = time.monotonic() - start
+            self._observe_wait(waited)
+        ADMISSION_WAIT.observe(waited, **{"class": self.name})
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self.active -= 1
+                ADMISSION_ACTIVE.dec(**{"class": self.name})
+                if self.service_time is None:
+                    self.service_time = elapsed
+                else:
+                    self.service_time += SERVICE_TIME_SMOOTHING * (elapsed - self.service_time)
+                self._cond.notify()
+
+
+class TierGovernor:
+    """Choose how many segmentation tiers to skip from observed queue latency.
+
+    While the controller's average queue wait exceeds ``target`` the
+    governor steps down one tier per ``cooldown`` seconds. Once the wait
+    falls below ``target * recover_ratio`` it steps back up at the same pace.
+    The gap between the two thresholds keeps it from flapping.
+
+    Parameters
+    ----------
+    controller : AdmissionController
+        Source of the queue latency.
+    target : float
+        Queue wait in seconds that segmentation should stay under.
+    cooldown : float
+        Minimum seconds between two level changes.
+    recover_ratio : float
+        Fraction of ``target`` the wait must fall below to step back up.
+    """
+
+    def __init__(self, controller: AdmissionController, target: float, cooldown: float = 10.0,
+                 recover_ratio: float = 0.5):
+        self.controller = controller
+        self.target = target
+        self.cooldown = cooldown
+        self.recover_ratio = recover_ratio
+        self.current = 0
+        self._changed = time.monotonic() - cooldown
+        self._lock = threading.Lock()
+
+    def level(self, tiers: int) -> int:
+        """Return how many of ``tiers`` available tiers (best first) to skip."""
+        now = time.monotonic()
+        latency = self.controller.wait_time or 0.0
+        with self._lock:
+            if now - self._changed >= self.cooldown:
+                if latency > self.target and self.current < tiers - 1:
+                    self.current += 1
+                    self._changed = now
+                elif latency < self.target * self.recover_ratio and self.current > 0:
+                    self.current -= 1
+                    self._changed = now
+                DEGRADATION_LEVEL.set(self.current)
+            return min(self.current, tiers - 1)
+
+
+def governor_from_env(controller: AdmissionController) -> Optional[TierGovernor]:
+    """Return a :class:`TierGovernor` when ``SEGMENTATION_SLO_MS`` is set."""
+    target_ms = os.getenv("SEGMENTATION_SLO_MS")
+    if not target_ms:
+        return None
+    return TierGovernor(
+        controller,
+        target=float(target_ms) / 1000,
+        cooldown=float(os.getenv("SEGMENTATION_SLO_COOLDOWN", "10")),
+    )
+
+
+def controller_from_env(name: str) -> AdmissionController:
+    """Build a controller configured by ``ADMISSION_<NAME>_*`` variables.
+
+    ``CONCURRENCY`` defaults to this process's share of the CPUs, the CPU
+    count divided by ``SERVER_WORKERS`` (set by ``serve.py``). ``QUEUE``
+    defaults to twice the concurrency and ``MAX_WAIT`` to 5 seconds.
+    """
+    prefix = f"ADMISSION_{name.upper()}_"
+    workers = max(1, int(os.getenv("SERVER_WORKERS", "1")))
+    concurrency = int(os.getenv(prefix + "CONCURRENCY", max(1, (os.cpu_count() or 1) // workers)))
+    return AdmissionController(
+        name,
+        max_concurrency=concurrency,
+        max_queue=int(os.getenv(prefix + "QUEUE", 2 * concurrency)),
+        max_wait=float(os.getenv(prefix + "MAX_WAIT", "5")),
+    )
+
+
+_current_controller: contextvars.ContextVar = contextvars.ContextVar("wardrobe_admission", default=None)
+
+
+def current_controller() -> Optional[AdmissionController]:
+    """Return the controller of the endpoint class handling this request."""
+    return _current_controller.get()
+
+
+@contextlib.contextmanager
+def admitted(controller: AdmissionController):
+    """Check ``controller`` and make it current for the rest of the request."""
+    token = _current_controller.set(controller)
+    try:
+        controller.check()
+        yield controller
+    finally:
+        _current_controller.reset(token)
@@ -1,27 +1,49 @@
 import os
+import json
+import contextlib
+import contextvars
+import functools
+import hashlib
 import logging
-import imghdr
 try:
     from flask import Flask, request, render_template, jsonify
 except Exception:  # pragma: no cover - fallback when Flask isn't installed
     # The stub is only used for running the test suite without real Flask
     from flask_stub import Flask, request, render_template, jsonify
-from clothseg import ClothSegmenter
+from assets import Asset, OffsetMismatch, StagingFull, store_from_env as asset_store_from_env
+from admission import Overloaded, admitted, controller_from_env, current_controller, governor_from_env
+from clothseg import MAX_IMAGE_PIXELS, ClothSegmenter, ImageTooLarge, decode_reduction
+from deadlines import DeadlineExceeded, check_deadline, deadline_exceeded, deadline_from_headers, deadline_scope
+from deadlines import remaining
+from encoding import compress_response, json_provider
+from idempotency import IDEMPOTENT_REQUESTS, KeyConflict, store_from_env as idempotency_store_from_env
+import imageprobe
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as METRICS_REGISTRY
+from metrics import Counter, current_request, current_route, instrument_route, stage
+from metrics import format_server_timing, timing_breakdown
+from outfits import rank_outfits
+import prompts
+from profiling import resolve_format as resolve_profile_format, store_from_env as profile_store_from_env, track_thread
+from similarity import SimilarityIndexStore, index_directory_for, item_features
+from uploads import spooling_request
 from werkzeug.utils import secure_filename # Added for secure filenames
 from werkzeug.security import generate_password_hash, check_password_hash
 try:
-    from sqlalchemy import Column, Integer, String, create_engine
+    from sqlalchemy import Column, ForeignKey, Integer, String, create_engine
     from sqlalchemy.orm import declarative_base, sessionmaker
 except Exception:  # pragma: no cover - fallback when SQLAlchemy isn't installed
     # These stubs allow tests to run without the real dependency
-    from sqlalchemy_stub import Column, Integer, String, create_engine
+    from sqlalchemy_stub import Column, ForeignKey, Integer, String, create_engine
     from sqlalchemy_stub import declarative_base, sessionmaker
 try:
     import openai  # type: ignore
 except Exception:  # pragma: no cover - fallback when OpenAI package is missing
     # Test environments use a lightweight OpenAI stub
     import openai_stub as openai
+import concurrent.futures
 import tempfile
+import time
+import uuid
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 if openai.api_key is None and getattr(openai, "__name__", "") != "openai_stub":
@@ -31,6 +53,239 @@ app = Flask(__name__)
 logger = logging.getLogger(__name__)
 cloth_segmenter = ClothSegmenter()
 
+# Executor for CPU-bound segmentation. ``None`` runs work inline; the async
+# serving mode in serve.py installs a thread pool so network waits in other
+# requests keep making progress while an image is being segmented.
+cpu_executor = None
+
+
+def _run_cpu(func, *args):
+    """Run CPU-bound ``func`` on :data:`cpu_executor` when one is installed.
+
+    Inside an admission-controlled request the work first waits for a slot
+    of that endpoint class and may raise :class:`admission.Overloaded`. Work
+    is not started once the request's deadline has passed. Queued work whose
+    request runs out of time while waiting for the executor is cancelled.
+    """
+    controller = current_controller()
+    with controller.slot() if controller is not None else contextlib.nullcontext():
+        check_deadline(getattr(func, '__name__', 'cpu'))
+        if cpu_executor is None:
+            return func(*args)
+        # Carry the request context over so stages are attributed to this route
+        context = contextvars.copy_context()
+        future = cpu_executor.submit(context.run, track_thread(func), *args)
+        try:
+            return future.result(timeout=remaining())
+        except concurrent.futures.TimeoutError:
+            # Running work stops at its next deadline check. The wait only times
+            # out at the deadline, even if the clock doesn't show it passed yet.
+            future.cancel()
+            raise deadline_exceeded(getattr(func, '__name__', 'cpu')) from None
+
+
+#: Admission control for the endpoints that run the segmenter
+image_admission = controller_from_env('image')
+cloth_segmenter.governor = governor_from_env(image_admission)
+
+
+def admit(controller):
+    """Shed requests to ``view`` with ``503`` when ``controller`` is saturated."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                with admitted(controller):
+                    return view(*args, **kwargs)
+            except Overloaded as e:
+                return (
+                    jsonify({'error': 'Server busy, please retry later'}),
+                    503,
+                    {'Retry-After': str(e.retry_after)},
+                )
+        return wrapper
+    return decorator
+
+
+def with_deadline(view):
+    """Give each request to ``view`` a deadline and answer ``504`` once it passes.
+
+    See :mod:`deadlines` for how the deadline is chosen and enforced.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            with deadline_scope(deadline_from_headers(request.headers)):
+                return view(*args, **kwargs)
+        except DeadlineExceeded:
+            return jsonify({'error': 'Request deadline exceeded'}), 504
+    return wrapper
+
+
+idempotency_store = idempotency_store_from_env()
+
+
+def _multi_items(mapping):
+    """Return every ``(key, value)`` pair of a form or files mapping."""
+    if hasattr(mapping, 'getlist'):
+        return [(key, value) for key in mapping for value in mapping.getlist(key)]
+    return list(mapping.items())
+
+
+def _request_fingerprint() -> str:
+    """Return a hash of the current request's form fields and file contents."""
+    digest = hashlib.sha256()
+    for name, value in sorted((name, str(value)) for name, value in _multi_items(request.form)):
+        digest.update(f"{name}={value}\0".encode())
+    # Sorted by field name only, so repeated files keep the order they were sent in
+    for name, file in sorted(_multi_items(request.files), key=lambda item: item[0]):
+        digest.update(f"{name}:{file.filename}:{_hash_upload(file)}\0".encode())
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """Run ``view`` once per ``Idempotency-Key`` and replay its response.
+
+    A repeat with the same key and the same form fields and files gets the
+    first response, marked with ``Idempotent-Replayed: true``. It waits for
+    that response while the first request is still running. Reusing a key
+    for a different request answers ``422``. See :mod:`idempotency`.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key too long'}), 400
+        route = current_route()
+
+        def call():
+            body, status, headers = _split_response(view(*args, **kwargs))
+            return (body.get_json() if hasattr(body, 'get_json') else body), status, headers
+
+        try:
+            (data, status, headers), outcome = idempotency_store.run(
+                (route, key), _request_fingerprint(), call,
+                keep=lambda response: response[1] < 500, timeout=remaining(),
+            )
+        except KeyConflict:
+            IDEMPOTENT_REQUESTS.inc(route=route, outcome='conflict')
+            return jsonify({'error': 'Idempotency-Key was used for a different request'}), 422
+        except TimeoutError:
+            check_deadline('idempotency')
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+        IDEMPOTENT_REQUESTS.inc(route=route, outcome=outcome)
+        headers = dict(headers)
+        if outcome != 'executed':
+            headers['Idempotent-Replayed'] = 'true'
+        return (jsonify(data) if isinstance(data, (dict, list)) else data), status, headers
+    return wrapper
+
+
+def _split_response(rv):
+    """Return a view's return value as ``(body, status, headers)``."""
+    if isinstance(rv, tuple):
+        return rv[0], rv[1], dict(rv[2]) if len(rv) > 2 else {}
+    return rv, getattr(rv, 'status_code', 200), {}
+
+
+def _wants_timing_debug() -> bool:
+    flag = request.headers.get('X-Debug-Timing') or request.args.get('debug')
+    return str(flag).lower() in {'1', 'true', 'timing'}
+
+
+def server_timing(view):
+    """Report the request's stage durations with the response of ``view``.
+
+    Durations are sent in a ``Server-Timing`` header, which browser developer
+    tools display next to the request. Clients that send
+    ``X-Debug-Timing: 1`` (or ``?debug=timing``) also get them in a ``debug``
+    field of the JSON body. Responses that ran segmentation name the tiers
+    used in ``X-Segmentation-Tier``.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        rv = view(*args, **kwargs)
+        timings = current_request()
+        breakdown = timing_breakdown(timings, time.perf_counter() - start)
+        tiers = list(dict.fromkeys(timings.tiers)) if timings is not None else []
+        body, status, headers = _split_response(rv)
+        if _wants_timing_debug():
+            data = body.get_json() if hasattr(body, 'get_json') else body
+            if isinstance(data, dict):
+                debug = {'timings_ms': breakdown}
+                if tiers:
+                    debug['segmentation_tiers'] = timings.tiers
+                body = jsonify({**data, 'debug': debug})
+        headers['Server-Timing'] = format_server_timing(breakdown)
+        if tiers:
+            headers['X-Segmentation-Tier'] = ', '.join(tiers)
+        return body, status, headers
+    return wrapper
+
+
+profile_store = profile_store_from_env()
+asset_store = asset_store_from_env()
+
+
+def profiled(view):
+    """Profile ``view`` when the request carries the ``PROFILE_TOKEN``.
+
+    The token is only accepted in an ``X-Profile`` header, so it stays out of
+    access logs; ``X-Profile-Format`` (or ``?profile_format=``) picks ``collapsed`` or
+    ``pstats``. The response reports the outcome in ``X-Profile-Status``, and
+    the id and format of the stored profile in ``X-Profile-Id`` and
+    ``X-Profile-Format``.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        supplied = request.headers.get('X-Profile')
+        if not supplied:
+            return view(*args, **kwargs)
+        status = profile_store.check(supplied)
+        if status != 'ok':
+            body, code, headers = _split_response(view(*args, **kwargs))
+            headers['X-Profile-Status'] = status
+            return body, code, headers
+        fmt = resolve_profile_format(request.headers.get('X-Profile-Format') or request.args.get('profile_format'))
+        rv, profile_id = profile_store.run(
+            functools.partial(view, *args, **kwargs), fmt, label=current_route()
+        )
+        body, code, headers = _split_response(rv)
+        headers.update({'X-Profile-Status': 'ok', 'X-Profile-Id': profile_id, 'X-Profile-Format': fmt})
+        return body, code, headers
+    return wrapper
+
+
+OPENAI_ERRORS = Counter(
+    "wardrobe_openai_errors_total", "Failed OpenAI calls per route and API", ["route", "api"]
+)
+
+
+def _openai_call(api, func, **kwargs):
+    """Call an OpenAI client function, timing it as a stage and counting errors.
+
+    ``api`` is ``'chat'`` (recorded as the ``llm`` stage) or ``'image'``.
+    Within a request deadline the call is given the remaining time as its
+    ``request_timeout``. A call that fails because the deadline passed raises
+    :class:`deadlines.DeadlineExceeded`.
+    """
+    name = 'llm' if api == 'chat' else 'image'
+    check_deadline(name)
+    prompts.observe(api, kwargs)
+    left = remaining()
+    if left is not None:
+        kwargs['request_timeout'] = left
+    with stage(name):
+        try:
+            return func(**kwargs)
+        except openai.error.OpenAIError:
+            OPENAI_ERRORS.inc(route=current_route(), api=api)
+            check_deadline(name)
+            raise
+
 # Database setup
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///:memory:")
 engine = create_engine(DATABASE_URL, echo=False, future=True)
@@ -46,29 +301,122 @@ class User(Base):
     password = Column(String)
 
 
+class WardrobeItem(Base):
+    """An analyzed clothing item remembered for a user.
+
+    Items are keyed by the SHA-256 of the uploaded image so sending the same
+    garment again reuses the stored attributes instead of re-segmenting it.
+    """
+    __tablename__ = "wardrobe_items"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    image_hash = Column(String, nullable=False)
+    category = Column(String)
+    color = Column(String)
+    box = Column(String)  # JSON encoded [x1, y1, x2, y2] of the garment
+
+
+class RefineSession(Base):
+    """The context of a /refine_outfit_suggestion conversation.
+
+    Created by the first request of a conversation. Later requests send only
+    its ``public_id`` and the new query. Turns are kept in
+    :class:`RefineTurn`, so neither table is ever updated in place. A session
+    was last used when its newest turn was answered, and is deleted with its
+    turns ``REFINE_SESSION_TTL`` seconds after that.
+    """
+    __tablename__ = "refine_sessions"
+    id = Column(Integer, primary_key=True)
+    public_id = Column(String, unique=True, nullable=False)
+    original_suggestion = Column(String, nullable=False)
+    items = Column(String, nullable=False)  # JSON encoded list of item attribute dicts
+
+
+class RefineTurn(Base):
+    """One answered query of a refinement conversation."""
+    __tablename__ = "refine_turns"
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("refine_sessions.id"), nullable=False)
+    user_query = Column(String, nullable=False)
+    response = Column(String, nullable=False)
+    created = Column(Integer)  # Unix time the turn was answered
+
+
 Base.metadata.create_all(engine)
 
+# Per-user nearest-neighbour indexes over wardrobe items, stored next to the database
+similarity_store = SimilarityIndexStore(
+    os.getenv("SIMILARITY_INDEX_DIR") or index_directory_for(DATABASE_URL),
+    backend=os.getenv("SIMILARITY_BACKEND", "brute"),
+)
+
 # Allowed upload types
 ALLOWED_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
 ALLOWED_MIME_TYPES = {'image/png', 'image/jpeg'}
-MAX_IMAGE_SIZE = 2 * 1024 * 1024  # 2 MB limit
+ALLOWED_FORMATS = {'png', 'jpeg'}  # as reported by imageprobe
+MAX_IMAGE_SIZE = int(os.getenv("MAX_IMAGE_SIZE", str(2 * 1024 * 1024)))  # 2 MB default limit
+# Whole request bodies over this are refused with 413 before they are read
+MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_SIZE", str(16 * MAX_IMAGE_SIZE)))
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_SIZE
+if hasattr(app, 'request_class'):  # the test stub has no request objects to extend
+    # Uploads are validated and spooled as they arrive, see uploads.py
+    app.request_class = spooling_request(
+        app.request_class, MAX_IMAGE_SIZE, ALLOWED_FORMATS, raw_paths={'/assets/uploads/chunk'}
+    )
+if hasattr(app, 'json'):
+    # Compact JSON from the fastest available encoder, see encoding.py
+    app.json = json_provider(type(app.json))(app)
+if hasattr(app, 'after_request'):
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, request.headers.get('Accept-Encoding', ''))
+
+# Longest side browsers downscale photos to before uploading, see /config. Without
+# UPLOAD_MAX_DIMENSION the segmenter's working resolution is used, or this default.
+DEFAULT_UPLOAD_DIMENSION = 2048
+# JPEG quality browsers re-encode downscaled photos at
+UPLOAD_JPEG_QUALITY = float(os.getenv("UPLOAD_JPEG_QUALITY", "0.9"))
+
+# Number of locally ranked outfit candidates sent to the LLM by /upload
+OUTFIT_CANDIDATE_LIMIT = int(os.getenv("OUTFIT_CANDIDATE_LIMIT", "3"))
+
+# Refinement conversations without a new turn for this many seconds are deleted
+REFINE_SESSION_TTL = float(os.getenv("REFINE_SESSION_TTL", "86400"))
+_refine_pruned = 0.0
 
 
+@stage('validate')
 def _is_allowed_image(file) -> bool:
     """Return True if ``file`` appears to be an allowed image.
 
     The check verifies the file extension or MIME type, ensures the
-    content looks like an actual image using ``imghdr``, and enforces a
-    small size limit. The original file pointer is restored before
-    returning.
+    header is that of an allowed format using :mod:`imageprobe`, and
+    enforces a small size limit. The dimensions in the header must also fit the
+    decoder's pixel budget, since a small compressed file can still decode
+    to gigabytes. Uploads that :mod:`uploads` already refused while they
+    were being received are rejected without reading them. The original file
+    pointer is restored before returning. Stored assets were checked when
+    they were uploaded and pass.
     """
 
+    if isinstance(file, Asset):
+        return True
     ext = os.path.splitext(getattr(file, "filename", ""))[1].lower()
     mime = getattr(file, "mimetype", None)
     if ext not in ALLOWED_EXTENSIONS and mime not in ALLOWED_MIME_TYPES:
         return False
+    return _is_allowed_content(getattr(file, "stream", file), getattr(file, "filename", ""))
 
-    f = getattr(file, "stream", file)
+
+def _is_allowed_content(f, name='') -> bool:
+    """Check the size and header of the open binary file ``f``.
+
+    This is the content half of :func:`_is_allowed_image`, also used for
+    finished chunked uploads. ``name`` is only used for logging.
+    """
+    if getattr(f, "rejected", None):
+        return False
     try:
         pos = f.tell()
     except Exception:  # pragma: no cover - file lacks tell/seek
@@ -87,16 +435,19 @@ def _is_allowed_image(file) -> bool:
         return False
 
     try:
-        sample = f.read(512)
-        f.seek(0)
-        kind = imghdr.what(None, sample)
         if size > 0:
-            if kind == "jpeg":
-                kind = "jpg"
-            if kind not in {"png", "jpg"}:
+            info = imageprobe.probe_file(f)
+            f.seek(0)
+            if info.format not in ALLOWED_FORMATS or not info.width or not info.height:
                 if pos is not None:
                     f.seek(pos)
                 return False
+            decode_reduction(info.format, info.width, info.height)
+    except ImageTooLarge as e:
+        logger.info("Rejected upload %s: %s", name, e)
+        if pos is not None:
+            f.seek(pos)
+        return False
     except Exception:
         if pos is not None:
             f.seek(pos)
@@ -107,15 +458,209 @@ def _is_allowed_image(file) -> bool:
     return True
 
 
+def _get_file_list(name):
+    """Return all uploaded files sent under ``name``.
+
+    Falls back to collecting ``name``-prefixed keys when the request's file
+    mapping doesn't support ``getlist`` (e.g. the test stub).
+    """
+    if hasattr(request.files, 'getlist'):
+        return request.files.getlist(name)
+    return [value for key, value in request.files.items() if key.startswith(name)]
+
+
+def _get_upload(name, asset_field):
+    """Return the file part ``name``, or the asset named by form field ``asset_field``.
+
+    Raises :class:`LookupError` when the asset id is unknown or expired.
+    """
+    file = request.files.get(name)
+    asset_id = request.form.get(asset_field)
+    if (file is None or file.filename == '') and asset_id:
+        return _get_asset(asset_id)
+    return file
+
+
+def _get_asset(asset_id):
+    asset = asset_store.get(asset_id)
+    if asset is None:
+        raise LookupError(asset_id)
+    return asset
+
+
+def _upload_label(upload) -> str:
+    """Return the name ``upload`` was sent under; an asset's id is never used."""
+    if isinstance(upload, Asset):
+        return upload.label
+    return upload.filename or ''
+
+
+@contextlib.contextmanager
+def _upload_path(upload, suffix=''):
+    """Yield a local path holding the content of ``upload``.
+
+    A stored asset is used in place. A file part is saved to a temporary
+    file that is removed afterwards.
+    """
+    if isinstance(upload, Asset):
+        yield upload.path
+        return
+    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    temp_path = tmp.name
+    tmp.close()
+    try:
+        with stage('save'):
+            upload.save(temp_path)
+        yield temp_path
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _get_list_field(name, source=None):
+    """Return the values of form field ``name`` as a flat list of strings.
+
+    Repeated fields and comma separated values are both accepted.
+    """
+    source = request.form if source is None else source
+    if hasattr(source, 'getlist'):
+        raw = source.getlist(name)
+    else:
+        value = source.get(name)
+        raw = value if isinstance(value, list) else ([value] if value is not None else [])
+    values = []
+    for entry in raw:
+        values.extend(v.strip() for v in str(entry).split(',') if v.strip())
+    return values
+
+
+def _hash_upload(file) -> str:
+    """Return the SHA-256 hex digest of an uploaded file's content.
+
+    The stream position is restored before returning. A stored asset's id
+    already is that digest.
+    """
+    if isinstance(file, Asset):
+        return file.asset_id
+    f = getattr(file, "stream", file)
+    pos = f.tell()
+    f.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(64 * 1024), b""):
+        digest.update(chunk)
+    f.seek(pos)
+    return digest.hexdigest()
+
+
+def _compact_box(parts):
+    """Return the ``[x1, y1, x2, y2]`` box of the ``full_body`` part.
+
+    Coarse parsers already return a box; model masks are reduced to the
+    bounding box of their non-zero pixels. ``None`` is returned when nothing
+    was segmented.
+    """
+    full = (parts or {}).get('full_body')
+    if not full:
+        return None
+    first = full[0]
+    if len(full) == 1 and isinstance(first, (list, tuple)) and len(first) == 4:
+        return [int(v) for v in first]
+    rows = [y for y, row in enumerate(full) if isinstance(row, (list, tuple)) and any(row)]
+    if not rows:
+        return None
+    cols = [x for row in full if isinstance(row, (list, tuple)) for x, v in enumerate(row) if v]
+    return [min(cols), rows[0], max(cols), rows[-1]]
+
+
+def _wardrobe_item_dict(item):
+    """Serialize a :class:`WardrobeItem` for API responses and prompts."""
+    return {
+        'id': item.id,
+        'category': item.category,
+        'color': item.color,
+        'box': json.loads(item.box) if item.box else None,
+    }
+
+
+def _wardrobe_vectors(user_id):
+    """Return a loader yielding ``(item_id, vector)`` for a user's stored items."""
+    def loader():
+        with SessionLocal() as session:
+            items = session.query(WardrobeItem).filter_by(user_id=user_id).all()
+            return [(item.id, item_features({'category': item.category, 'color': item.color})) for item in items]
+    return loader
+
+
+def _load_wardrobe_items(session, user, item_ids):
+    """Return the user's wardrobe items for ``item_ids`` in request order.
+
+    Raises ``LookupError`` naming the first id that doesn't belong to ``user``.
+    """
+    items = []
+    for raw_id in item_ids:
+        try:
+            item_id = int(raw_id)
+        except ValueError:
+            raise LookupError(raw_id)
+        item = session.query(WardrobeItem).filter_by(id=item_id, user_id=user.id).first()
+        if item is None:
+            raise LookupError(raw_id)
+        items.append(item)
+    return items
+
+
 @app.route('/')
+@instrument_route('/')
 def index():
     return render_template('index.html')
 
+
+@app.route('/config')
+@instrument_route('/config')
+def client_config():
+    """Tell the browser how to prepare photos before uploading them.
+
+    ``static/main.js`` downscales images whose longest side exceeds
+    ``max_dimension`` and re-encodes them as JPEG at ``jpeg_quality``,
+    lowering the quality until the file fits in ``max_bytes``.
+    """
+    working_resolution = cloth_segmenter.settings.get('working_resolution')
+    max_dimension = int(os.getenv('UPLOAD_MAX_DIMENSION') or working_resolution or DEFAULT_UPLOAD_DIMENSION)
+    config = {
+        'upload': {
+            'max_bytes': MAX_IMAGE_SIZE,
+            'max_dimension': max_dimension,
+            'max_pixels': MAX_IMAGE_PIXELS,
+            'mime_types': sorted(ALLOWED_MIME_TYPES),
+            'jpeg_quality': UPLOAD_JPEG_QUALITY,
+        },
+        'segmentation': {'working_resolution': working_resolution},
+    }
+    return jsonify(config), 200, {'Cache-Control': 'public, max-age=300'}
+
+
+@app.route('/metrics')
+def metrics():
+    """Expose request, stage and segmentation metrics for Prometheus."""
+    return METRICS_REGISTRY.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
 @app.route('/upload', methods=['POST'])
+@instrument_route('/upload')
+@server_timing
+@profiled
+@with_deadline
+@idempotent
+@admit(image_admission)
 def upload():
     try:
-        full_body_image = request.files.get('full_body_image')
-        clothing_item_images = request.files.getlist('clothing_item_images')
+        try:
+            full_body_image = _get_upload('full_body_image', 'full_body_image_asset_id')
+            clothing_item_images = _get_file_list('clothing_item_images')
+            clothing_item_images += [_get_asset(a) for a in _get_list_field('clothing_item_asset_ids')]
+        except LookupError as e:
+            return jsonify({'error': f'Unknown asset id: {e.args[0]}'}), 404
+        identifier = request.form.get('identifier')
+        clothing_item_ids = _get_list_field('clothing_item_ids')
 
         # Validate full_body_image
         if full_body_image is None or full_body_image.filename == '':
@@ -123,81 +668,130 @@ def upload():
         if not _is_allowed_image(full_body_image):
             return jsonify({'error': 'Invalid file type or size for full body image'}), 400
 
-        # Validate clothing_item_images
-        if not clothing_item_images or all(not item.filename for item in clothing_item_images):
+        # Validate clothing_item_images, which may be replaced by stored wardrobe item ids
+        has_files = clothing_item_images and any(item.filename for item in clothing_item_images)
+        if not has_files and not clothing_item_ids:
             return jsonify({'error': 'At least one clothing item image is required'}), 400
+        if clothing_item_ids and not identifier:
+            return jsonify({'error': 'identifier required when using clothing_item_ids'}), 400
 
         clothing_attributes_list = []
+        wardrobe_item_ids = []
 
-        for idx, item_image in enumerate(clothing_item_images):
-            if item_image.filename == '':
-                # This case might occur if multiple file inputs are used and some are left empty.
-                # Depending on strictness, we can ignore or error.
-                # For now, let's assume getlist filters out ones with no actual file selected by user.
-                # If an empty filename string IS passed for a selected file, it's an issue.
-                logger.warning(f"Skipping clothing item at index {idx} due to empty filename.")
-                continue # Or return error: jsonify({'error': f'Clothing item {idx+1} has no filename'}), 400
-
-            if not _is_allowed_image(item_image):
-                return jsonify({'error': f'Invalid file type or size for clothing item: {secure_filename(item_image.filename)}'}), 400
+        with SessionLocal() as session:
+            user = None
+            if identifier:
+                user = session.query(User).filter_by(identifier=identifier).first()
+                if user is None:
+                    return jsonify({'error': 'User not found'}), 404
 
-            temp_path = ""
             try:
-                # Secure the filename before using it in NamedTemporaryFile's suffix
-                s_filename = secure_filename(item_image.filename)
-                # Ensure suffix starts with a dot if that's what NamedTemporaryFile expects, or handle it if it adds one.
-                # os.path.splitext can give the extension directly.
-                _, ext = os.path.splitext(s_filename)
-                tmp = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-                temp_path = tmp.name
-                tmp.close() # Close before saving to it
-                item_image.save(temp_path)
-                
-                # Use cloth_segmenter.analyze to get attributes
-                analysis_result = cloth_segmenter.analyze(temp_path)
-                # Ensure 'attributes' key exists, default to empty dict if not
-                item_attributes = analysis_result.get('attributes', {})
-                if not item_attributes and 'parts' in analysis_result : # If attributes is empty but parts exist, maybe log or use parts as fallback
-                    logger.info(f"Clothing item {s_filename} yielded no specific attributes, but parts were segmented.")
-
-                clothing_attributes_list.append(item_attributes)
-
-            except Exception as e: # More specific exception handling can be added if needed
-                logger.error(f"Error processing clothing item {secure_filename(item_image.filename)}: {e}")
-                # Decide if one failed item should halt the whole request
-                return jsonify({'error': f'Error processing clothing item: {secure_filename(item_image.filename)}'}), 500
-            finally:
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
-        
+                known_items = _load_wardrobe_items(session, user, clothing_item_ids) if clothing_item_ids else []
+            except LookupError as e:
+                return jsonify({'error': f'Unknown clothing item id: {e.args[0]}'}), 404
+            for item in known_items:
+                clothing_attributes_list.append({'category': item.category, 'color': item.color})
+                wardrobe_item_ids.append(item.id)
+
+            for idx, item_image in enumerate(clothing_item_images):
+                if item_image.filename == '':
+                    # This case might occur if multiple file inputs are used and some are left empty.
+                    # Depending on strictness, we can ignore or error.
+                    # For now, let's assume getlist filters out ones with no actual file selected by user.
+                    # If an empty filename string IS passed for a selected file, it's an issue.
+                    logger.warning(f"Skipping clothing item at index {idx} due to empty filename.")
+                    continue # Or return error: jsonify({'error': f'Clothing item {idx+1} has no filename'}), 400
+
+                if not _is_allowed_image(item_image):
+                    return jsonify({'error': f'Invalid file type or size for clothing item: {secure_filename(item_image.filename)}'}), 400
+
+                image_hash = None
+                if user is not None:
+                    # Garments the user already sent are served from the wardrobe without re-segmentation
+                    image_hash = _hash_upload(item_image)
+                    known = session.query(WardrobeItem).filter_by(user_id=user.id, image_hash=image_hash).first()
+                    if known is not None:
+                        clothing_attributes_list.append({'category': known.category, 'color': known.color})
+                        wardrobe_item_ids.append(known.id)
+                        continue
+
+                try:
+                    # Secure the filename before using it in NamedTemporaryFile's suffix
+                    s_filename = secure_filename(item_image.filename)
+                    # os.path.splitext can give the extension directly.
+                    _, ext = os.path.splitext(s_filename)
+                    with _upload_path(item_image, suffix=ext) as temp_path:
+                        # Use cloth_segmenter.analyze to get attributes
+                        analysis_result = _run_cpu(cloth_segmenter.analyze, temp_path)
+                    # Ensure 'attributes' key exists, default to empty dict if not
+                    item_attributes = analysis_result.get('attributes', {})
+                    if not item_attributes and 'parts' in analysis_result : # If attributes is empty but parts exist, maybe log or use parts as fallback
+                        logger.info(f"Clothing item {s_filename} yielded no specific attributes, but parts were segmented.")
+
+                    clothing_attributes_list.append(item_attributes)
+
+                except (Overloaded, DeadlineExceeded):
+                    raise
+                except Exception as e: # More specific exception handling can be added if needed
+                    logger.error(f"Error processing clothing item {secure_filename(item_image.filename)}: {e}")
+                    # Decide if one failed item should halt the whole request
+                    return jsonify({'error': f'Error processing clothing item: {secure_filename(item_image.filename)}'}), 500
+
+                if user is not None:
+                    box = _compact_box(analysis_result.get('parts'))
+                    item = WardrobeItem(
+                        user_id=user.id,
+                        image_hash=image_hash,
+                        category=item_attributes.get('category'),
+                        color=item_attributes.get('color'),
+                        box=json.dumps(box) if box is not None else None,
+                    )
+                    session.add(item)
+                    session.commit()
+                    wardrobe_item_ids.append(item.id)
+                    similarity_store.add(user.id, item.id, item_features(item_attributes), loader=_wardrobe_vectors(user.id))
+
         # Placeholder for full body image processing (if any needed beyond validation)
         # For now, we just acknowledge its receipt.
 
+        # Rank outfit candidates locally so only the best few reach the LLM
+        outfit_candidates = rank_outfits(clothing_attributes_list, OUTFIT_CANDIDATE_LIMIT)
+
         # Construct prompt for OpenAI
-        prompt_items_list = []
         if not clothing_attributes_list:
             suggestion_text = "No clothing items were provided to suggest an outfit."
         else:
-            for i, attributes in enumerate(clothing_attributes_list):
-                category = attributes.get('category', 'item')
-                color = attributes.get('color', '')
-                description = f"Item {i+1}: A "
-                if color and color.lower() != 'unknown':
-                    description += f"{color} "
-                description += category
-                prompt_items_list.append(description)
-
-            formatted_items = "\n".join(prompt_items_list)
-            prompt = (
-                "You are a fashion assistant. Based on the following available clothing items, please suggest 2-3 distinct outfits:\n\n"
-                "Available items:\n"
-                f"{formatted_items}\n\n"
-                "For each outfit, please describe which items are used and why they form a good combination. "
-                "Focus on color coordination and general style compatibility."
-            )
+            if outfit_candidates:
+                prompt_indexes = sorted({i for candidate in outfit_candidates for i in candidate['items']})
+            else:
+                prompt_indexes = range(len(clothing_attributes_list))
+            formatted_items = prompts.format_items(clothing_attributes_list, prompt_indexes, prompts.budget('upload'))
+            if outfit_candidates:
+                formatted_candidates = "\n".join(
+                    f"Outfit {n+1}: " + " + ".join(f"Item {i+1}" for i in candidate['items'])
+                    for n, candidate in enumerate(outfit_candidates)
+                )
+                prompt = (
+                    "You are a fashion assistant. The following outfits were pre-selected from the user's clothing items:\n\n"
+                    "Items:\n"
+                    f"{formatted_items}\n\n"
+                    "Candidate outfits:\n"
+                    f"{formatted_candidates}\n\n"
+                    "For each outfit, please describe which items are used and why they form a good combination. "
+                    "Focus on color coordination and general style compatibility."
+                )
+            else:
+                prompt = (
+                    "You are a fashion assistant. Based on the following available clothing items, please suggest 2-3 distinct outfits:\n\n"
+                    "Available items:\n"
+                    f"{formatted_items}\n\n"
+                    "For each outfit, please describe which items are used and why they form a good combination. "
+                    "Focus on color coordination and general style compatibility."
+                )
 
             try:
-                chat_completion = openai.ChatCompletion.create(
+                chat_completion = _openai_call(
+                    'chat', openai.ChatCompletion.create,
                     model="gpt-3.5-turbo",
                     messages=[{"role": "user", "content": prompt}]
                 )
@@ -213,26 +807,24 @@ def upload():
 
         # Attempt to generate an image if clothing items were processed
         if clothing_attributes_list:
-            item_descriptions_for_image = []
-            for attributes in clothing_attributes_list:
-                category = attributes.get('category', 'item')
-                color = attributes.get('color', '')
-                desc_part = ""
-                if color and color.lower() != 'unknown':
-                    desc_part += f"{color} "
-                desc_part += category
-                if desc_part: # Avoid adding empty strings if both are unknown/empty
-                    item_descriptions_for_image.append(desc_part)
-            
-            if item_descriptions_for_image:
-                item_descriptions_string = ", ".join(item_descriptions_for_image)
+            # Picture the best ranked outfit rather than the whole wardrobe
+            if outfit_candidates:
+                image_items = [clothing_attributes_list[i] for i in outfit_candidates[0]['items']]
+            else:
+                image_items = clothing_attributes_list
+            item_descriptions_string = prompts.join_descriptions(
+                (prompts.describe_item(attributes) for attributes in image_items), prompts.budget('image')
+            )
+
+            if item_descriptions_string:
                 image_prompt = (
                     f"Generate a realistic image of a person wearing a stylish, coordinated outfit composed from some or all of the "
                     f"following items: {item_descriptions_string}. Show a full-body view of the person. The background should be simple and neutral, "
                     "making the outfit the main focus."
                 )
                 try:
-                    image_response = openai.Image.create(
+                    image_response = _openai_call(
+                        'image', openai.Image.create,
                         prompt=image_prompt,
                         n=1,
                         size="512x512" 
@@ -254,77 +846,208 @@ def upload():
         response_data = {
             'message': final_message,
             'clothing_items_attributes': clothing_attributes_list,
-            'user_image_info': {'filename': secure_filename(full_body_image.filename)},
+            'user_image_info': {'filename': secure_filename(_upload_label(full_body_image))},
             'outfit_suggestions_text': suggestion_text,
-            'generated_outfit_image_url': generated_outfit_image_url
+            'generated_outfit_image_url': generated_outfit_image_url,
+            'outfit_candidates': outfit_candidates
         }
+        if identifier:
+            response_data['wardrobe_item_ids'] = wardrobe_item_ids
         if image_generation_error:
             response_data['image_generation_error'] = image_generation_error
         
         return jsonify(response_data), 200
 
+    except (Overloaded, DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error(f"Error in /upload endpoint: {e}")
         return jsonify({'error': 'Error processing images'}), 500
 
 
+@app.route('/assets', methods=['POST'])
+@instrument_route('/assets')
+@server_timing
+def store_asset():
+    """Store an image once so later requests can refer to it by id.
+
+    The image endpoints accept the returned ``asset_id`` in place of the
+    file part (for example ``image_asset_id`` instead of ``image``). The
+    file name, or a ``label`` field, is kept as the asset's name in prompts.
+    """
+    file = request.files.get('image')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file provided'}), 400
+    if not _is_allowed_image(file):
+        return jsonify({'error': 'Invalid file type'}), 400
+    f = getattr(file, 'stream', file)
+    f.seek(0)
+    with stage('save'):
+        asset_id = asset_store.put(f, request.form.get('label') or file.filename)
+    return jsonify({'asset_id': asset_id, 'expires_in': asset_store.ttl}), 201
+
+
+def _staged_upload_state(upload):
+    return {'upload_id': upload.upload_id, 'offset': upload.offset, 'length': upload.length}
+
+
+@app.route('/assets/uploads', methods=['POST'])
+@instrument_route('/assets/uploads')
+def start_chunked_upload():
+    """Stage a resumable upload of ``length`` bytes.
+
+    The client sends the image in pieces to ``/assets/uploads/chunk`` and
+    then calls ``/assets/uploads/finalize`` to turn it into an asset. While
+    too many uploads are staged the answer is ``429``, and ``507`` while
+    they hold too many bytes.
+    """
+    try:
+        length = int(request.form.get('length', ''))
+    except ValueError:
+        return jsonify({'error': 'length required'}), 400
+    if not 0 < length <= MAX_IMAGE_SIZE:
+        return jsonify({'error': 'Invalid file size'}), 400
+    try:
+        upload = asset_store.start_upload(length)
+    except StagingFull as e:
+        if e.reason == 'count':
+            return jsonify({'error': 'Too many uploads in progress'}), 429, {'Retry-After': '60'}
+        return jsonify({'error': 'Not enough space for the upload'}), 507
+    return jsonify(_staged_upload_state(upload)), 201
+
+
+@app.route('/assets/uploads', methods=['GET'])
+@instrument_route('/assets/uploads')
+def chunked_upload_status():
+    """Report how many bytes of a staged upload have arrived, to resume it."""
+    upload = asset_store.staged(request.args.get('upload_id'))
+    if upload is None:
+        return jsonify({'error': 'Unknown upload id'}), 404
+    return jsonify(_staged_upload_state(upload))
+
+
+@app.route('/assets/uploads/chunk', methods=['POST'])
+@instrument_route('/assets/uploads/chunk')
+@server_timing
+def append_upload_chunk():
+    """Write the file part ``chunk`` at ``offset`` of a staged upload.
+
+    A chunk that doesn't start where the staged data ends gets a ``409``
+    with the offset to continue from.
+    """
+    upload = asset_store.staged(request.form.get('upload_id'))
+    if upload is None:
+        return jsonify({'error': 'Unknown upload id'}), 404
+    chunk = request.files.get('chunk')
+    try:
+        offset = int(request.form.get('offset', ''))
+    except ValueError:
+        return jsonify({'error': 'offset required'}), 400
+    if chunk is None:
+        return jsonify({'error': 'No chunk provided'}), 400
+    if getattr(getattr(chunk, 'stream', chunk), 'rejected', None):
+        return jsonify({'error': 'Invalid file size'}), 400
+    try:
+        with stage('save'):
+            offset = asset_store.append(upload, offset, getattr(chunk, 'stream', chunk))
+    except OffsetMismatch as e:
+        return jsonify({'error': 'Offset mismatch', 'upload_id': upload.upload_id, 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'upload_id': upload.upload_id, 'offset': offset, 'length': upload.length})
+
+
+@app.route('/assets/uploads/finalize', methods=['POST'])
+@instrument_route('/assets/uploads/finalize')
+@server_timing
+def finalize_chunked_upload():
+    """Validate a fully received upload and store it as an asset named by the optional ``label``."""
+    upload = asset_store.staged(request.form.get('upload_id'))
+    if upload is None:
+        return jsonify({'error': 'Unknown upload id'}), 404
+    if upload.offset != upload.length:
+        return jsonify({'error': 'Upload incomplete', **_staged_upload_state(upload)}), 409
+    with stage('validate'), open(upload.path, 'rb') as f:
+        allowed = _is_allowed_content(f, upload.upload_id)
+    if not allowed:
+        asset_store.discard(upload)
+        return jsonify({'error': 'Invalid file type'}), 400
+    with stage('save'):
+        asset_id = asset_store.complete(upload, request.form.get('label', ''))
+    return jsonify({'asset_id': asset_id, 'expires_in': asset_store.ttl}), 201
+
+
 @app.route('/parse', methods=['POST'])
+@instrument_route('/parse')
+@server_timing
+@profiled
+@with_deadline
+@admit(image_admission)
 def parse_image():
-    file = request.files.get('image')
+    try:
+        file = _get_upload('image', 'image_asset_id')
+    except LookupError as e:
+        return jsonify({'error': f'Unknown asset id: {e.args[0]}'}), 404
     if file is None or file.filename == '':
         return jsonify({'error': 'No file provided'}), 400
     if not _is_allowed_image(file):
         return jsonify({'error': 'Invalid file type'}), 400
 
-    # Save the file temporarily to parse using a unique path.
-    tmp = tempfile.NamedTemporaryFile(delete=False)
-    temp_path = tmp.name
-    tmp.close()
-    file.save(temp_path)
+    # Parse the stored asset, or a temporary copy of the upload at a unique path.
     try:
-        parts = cloth_segmenter.parse(temp_path)
+        with _upload_path(file) as temp_path:
+            parts = _run_cpu(cloth_segmenter.parse, temp_path)
+    except (Overloaded, DeadlineExceeded):
+        raise
     except Exception:
         return jsonify({'error': 'Segmentation failed'}), 500
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
     return jsonify({'parts': parts})
 
 
 @app.route('/analyze', methods=['POST'])
+@instrument_route('/analyze')
+@server_timing
+@profiled
+@with_deadline
+@admit(image_admission)
 def analyze_image():
     """Return segmentation parts and simple classification."""
-    file = request.files.get('image')
+    try:
+        file = _get_upload('image', 'image_asset_id')
+    except LookupError as e:
+        return jsonify({'error': f'Unknown asset id: {e.args[0]}'}), 404
     if file is None or file.filename == '':
         return jsonify({'error': 'No file provided'}), 400
     if not _is_allowed_image(file):
         return jsonify({'error': 'Invalid file type'}), 400
 
-    tmp = tempfile.NamedTemporaryFile(delete=False)
-    temp_path = tmp.name
-    tmp.close()
-    file.save(temp_path)
     try:
-        parts = cloth_segmenter.parse(temp_path)
-        attributes = cloth_segmenter.classify(temp_path, parts)
+        with _upload_path(file) as temp_path:
+            parts = _run_cpu(cloth_segmenter.parse, temp_path)
+            attributes = _run_cpu(cloth_segmenter.classify, temp_path, parts)
+    except (Overloaded, DeadlineExceeded):
+        raise
     except Exception:
         return jsonify({'error': 'Segmentation failed'}), 500
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
     return jsonify({'parts': parts, 'attributes': attributes})
 
 @app.route('/suggest', methods=['POST'])
+@instrument_route('/suggest')
+@server_timing
+@profiled
+@with_deadline
+@idempotent
 def suggest():
     description = request.form.get('description', '')
-    prompt = f"Suggest an outfit for: {description}"
+    prompt = f"Suggest an outfit for: {prompts.clip(description, prompts.budget('suggest'), 'description')}"
     try:
-        chat = openai.ChatCompletion.create(
+        chat = _openai_call(
+            'chat', openai.ChatCompletion.create,
             messages=[{"role": "user", "content": prompt}],
             model="gpt-3.5-turbo",
         )
         suggestion_text = chat["choices"][0]["message"]["content"]
-        image = openai.Image.create(prompt=prompt)
+        image = _openai_call('image', openai.Image.create, prompt=prompt)
         image_url = image["data"][0]["url"]
     except openai.error.OpenAIError:
         logger.exception("OpenAI request failed")
@@ -334,6 +1057,12 @@ def suggest():
 
 
 @app.route('/compose', methods=['POST'])
+@instrument_route('/compose')
+@server_timing
+@profiled
+@with_deadline
+@idempotent
+@admit(image_admission)
 def compose():
     """Combine a user photo with selected clothing images."""
     # TODO: This endpoint currently uses OpenAI's general image generation based on a text prompt
@@ -343,14 +1072,12 @@ def compose():
     # significant image processing (segmentation, pose estimation) for both the user image
     # and the clothing items, and then feeding this data to the specialized model.
     # See VIRTUAL_TRY_ON.md for more details on this advanced feature.
-    body = request.files.get('body')
-    clothes = []
-    if hasattr(request.files, 'getlist'):
-        clothes = request.files.getlist('clothes')
-    else:
-        for key, value in request.files.items():
-            if key.startswith('clothes'):
-                clothes.append(value)
+    try:
+        body = _get_upload('body', 'body_asset_id')
+        clothes = [c for c in _get_file_list('clothes') if c.filename]
+        clothes += [_get_asset(asset_id) for asset_id in _get_list_field('clothes_asset_ids')]
+    except LookupError as e:
+        return jsonify({'error': f'Unknown asset id: {e.args[0]}'}), 404
 
     if body is None or body.filename == '':
         return jsonify({'error': 'No body provided'}), 400
@@ -363,29 +1090,24 @@ def compose():
         if not _is_allowed_image(c):
             return jsonify({'error': 'Invalid file type'}), 400
 
-    tmp = tempfile.NamedTemporaryFile(delete=False)
-    temp_path = tmp.name
-    tmp.close()
-    body.save(temp_path)
-
-    try:
-        parts = cloth_segmenter.parse(temp_path)
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+    with _upload_path(body) as temp_path:
+        parts = _run_cpu(cloth_segmenter.parse, temp_path)
 
     part_names = ", ".join(parts.keys()) if parts else "unknown parts"
-    clothing_names = ", ".join(os.path.splitext(c.filename)[0] for c in clothes)
+    clothing_names = prompts.join_descriptions(
+        (os.path.splitext(_upload_label(c))[0] for c in clothes), prompts.budget('compose'), 'clothes'
+    ) or f"{len(clothes)} unnamed items"
     prompt = (
         f"Combine body parts {part_names} with clothing items: {clothing_names}"
     )
     try:
-        chat = openai.ChatCompletion.create(
+        chat = _openai_call(
+            'chat', openai.ChatCompletion.create,
             messages=[{"role": "user", "content": prompt}],
             model="gpt-3.5-turbo",
         )
         suggestion_text = chat["choices"][0]["message"]["content"]
-        image = openai.Image.create(prompt=prompt)
+        image = _openai_call('image', openai.Image.create, prompt=prompt)
         image_url = image["data"][0]["url"]
     except openai.error.OpenAIError:
         logger.exception("OpenAI request failed")
@@ -395,6 +1117,7 @@ def compose():
 
 
 @app.route('/register/email', methods=['POST'])
+@instrument_route('/register/email')
 def register_email():
     email = request.form.get('email')
     password = request.form.get('password')
@@ -410,6 +1133,7 @@ def register_email():
 
 
 @app.route('/register/phone', methods=['POST'])
+@instrument_route('/register/phone')
 def register_phone():
     phone = request.form.get('phone')
     if not phone:
@@ -423,6 +1147,7 @@ def register_phone():
 
 
 @app.route('/register/google', methods=['POST'])
+@instrument_route('/register/google')
 def register_google():
     token = request.form.get('token')
     if not token:
@@ -436,6 +1161,7 @@ def register_google():
 
 
 @app.route('/register/facebook', methods=['POST'])
+@instrument_route('/register/facebook')
 def register_facebook():
     token = request.form.get('token')
     if not token:
@@ -449,6 +1175,7 @@ def register_facebook():
 
 
 @app.route('/get_user', methods=['POST'])
+@instrument_route('/get_user')
 def get_user():
     """Return basic user info for testing purposes."""
     identifier = request.form.get('identifier')
@@ -460,13 +1187,90 @@ def get_user():
             return jsonify({'error': 'User not found'}), 404
         return jsonify({'identifier': user.identifier, 'method': user.method})
 
-if __name__ == '__main__':
-    flag = os.getenv('FLASK_DEBUG')
-    debug_mode = flag.lower() in {'1', 'true', 'yes'} if flag is not None else False
-    app.run(debug=debug_mode)
+
+@app.route('/wardrobe', methods=['POST'])
+@instrument_route('/wardrobe')
+def wardrobe():
+    """Return the analyzed clothing items stored for a user."""
+    identifier = request.form.get('identifier')
+    if not identifier:
+        return jsonify({'error': 'identifier required'}), 400
+    with SessionLocal() as session:
+        user = session.query(User).filter_by(identifier=identifier).first()
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        items = session.query(WardrobeItem).filter_by(user_id=user.id).all()
+        return jsonify({'items': [_wardrobe_item_dict(item) for item in items]})
+
+
+@app.route('/similar', methods=['POST'])
+@instrument_route('/similar')
+def similar():
+    """Return the wardrobe items most similar to ``item_id``."""
+    identifier = request.form.get('identifier')
+    item_id = request.form.get('item_id')
+    if not identifier or not item_id:
+        return jsonify({'error': 'identifier and item_id required'}), 400
+    try:
+        item_id = int(item_id)
+        k = int(request.form.get('k', 5))
+    except ValueError:
+        return jsonify({'error': 'item_id and k must be integers'}), 400
+    if k < 1:
+        return jsonify({'error': 'k must be positive'}), 400
+
+    with SessionLocal() as session:
+        user = session.query(User).filter_by(identifier=identifier).first()
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        item = session.query(WardrobeItem).filter_by(id=item_id, user_id=user.id).first()
+        if item is None:
+            return jsonify({'error': f'Unknown clothing item id: {item_id}'}), 404
+
+        loader = _wardrobe_vectors(user.id)
+        vector = similarity_store.get(user.id, loader=loader).vector(item_id)
+        if vector is None:
+            vector = item_features({'category': item.category, 'color': item.color})
+            similarity_store.add(user.id, item_id, vector, loader=loader)
+        results = []
+        for neighbour_id, distance in similarity_store.query(user.id, vector, k, exclude=item_id, loader=loader):
+            neighbour = session.query(WardrobeItem).filter_by(id=neighbour_id, user_id=user.id).first()
+            if neighbour is None:
+                continue
+            entry = _wardrobe_item_dict(neighbour)
+            entry['distance'] = distance
+            results.append(entry)
+    return jsonify({'item_id': item_id, 'similar': results})
+
+def _refine_last_used(turns):
+    """Return the Unix time the newest of ``turns`` was answered, ``0`` if unknown."""
+    return max((turn.created or 0 for turn in turns), default=0)
+
+
+def _prune_refine_sessions(session, now):
+    """Delete conversations idle for ``REFINE_SESSION_TTL`` seconds, with their turns."""
+    global _refine_pruned
+    # A full scan at most ten times per TTL
+    if now - _refine_pruned < REFINE_SESSION_TTL / 10:
+        return
+    _refine_pruned = now
+    turns = {}
+    for turn in session.query(RefineTurn).all():
+        turns.setdefault(turn.session_id, []).append(turn)
+    for conversation in session.query(RefineSession).all():
+        stale = turns.get(conversation.id, [])
+        if now - _refine_last_used(stale) > REFINE_SESSION_TTL:
+            for turn in stale:
+                session.delete(turn)
+            session.delete(conversation)
+    session.commit()
 
 
 @app.route('/refine_outfit_suggestion', methods=['POST'])
+@instrument_route('/refine_outfit_suggestion')
+@server_timing
+@profiled
+@with_deadline
 def refine_outfit_suggestion():
     try:
         data = request.get_json()
@@ -476,6 +1280,43 @@ def refine_outfit_suggestion():
         original_suggestion = data.get('original_suggestion')
         available_clothing_items = data.get('available_clothing_items')
         user_query = data.get('user_query')
+        clothing_item_ids = data.get('clothing_item_ids')
+        session_id = data.get('session_id')
+        conversation = None
+        turns = []
+
+        # A session id replaces the context sent with the first request
+        if session_id is not None:
+            with SessionLocal() as session:
+                conversation = session.query(RefineSession).filter_by(public_id=str(session_id)).first()
+                if conversation is not None:
+                    turns = sorted(session.query(RefineTurn).filter_by(session_id=conversation.id).all(),
+                                   key=lambda turn: turn.id)
+            # An expired session is unknown even before it is pruned
+            if conversation is None or time.time() - _refine_last_used(turns) > REFINE_SESSION_TTL:
+                return jsonify({'error': 'Unknown session_id'}), 404
+            original_suggestion = conversation.original_suggestion
+            available_clothing_items = json.loads(conversation.items)
+        # Stored wardrobe items can stand in for the full attribute list
+        elif clothing_item_ids is not None:
+            if not isinstance(clothing_item_ids, list):
+                return jsonify({'error': 'Invalid type for clothing_item_ids, expected list'}), 400
+            identifier = data.get('identifier')
+            if not identifier:
+                return jsonify({'error': 'identifier required when using clothing_item_ids'}), 400
+            with SessionLocal() as session:
+                user = session.query(User).filter_by(identifier=identifier).first()
+                if user is None:
+                    return jsonify({'error': 'User not found'}), 404
+                try:
+                    stored_items = _load_wardrobe_items(session, user, [str(i) for i in clothing_item_ids])
+                except LookupError as e:
+                    return jsonify({'error': f'Unknown clothing item id: {e.args[0]}'}), 404
+                stored_attributes = [{'category': i.category, 'color': i.color} for i in stored_items]
+            if available_clothing_items is None:
+                available_clothing_items = []
+            if isinstance(available_clothing_items, list):
+                available_clothing_items = available_clothing_items + stored_attributes
 
         missing_fields = []
         if original_suggestion is None: # Allow empty string, but not None
@@ -499,20 +1340,35 @@ def refine_outfit_suggestion():
             if not isinstance(item, dict):
                 return jsonify({'error': 'Invalid item in available_clothing_items, expected list of dictionaries'}), 400
 
+        # One budget covers everything the client or the conversation can grow: the
+        # suggestion and query are clipped first, and items and history share the rest
+        total = prompts.budget('refine')
+        item_list = prompts.format_items(available_clothing_items)
+        history_tokens = prompts.estimate_tokens(prompts.format_history(turns)) if turns else 0
+        shares = prompts.allocate(total, {
+            'suggestion': prompts.estimate_tokens(original_suggestion),
+            'query': prompts.estimate_tokens(user_query),
+            'context': prompts.estimate_tokens(item_list) + history_tokens,
+        })
+        prompt_suggestion = prompts.clip(original_suggestion, shares['suggestion'], 'suggestion')
+        prompt_query = prompts.clip(user_query, shares['query'], 'query')
+        left = total - prompts.estimate_tokens(prompt_suggestion) - prompts.estimate_tokens(prompt_query)
+        shares = prompts.allocate(max(0, left), {
+            'items': prompts.estimate_tokens(item_list),
+            'history': history_tokens,
+        })
+
         # Format available_clothing_items
-        formatted_available_items_list = []
         if not available_clothing_items:
             formatted_available_items = "No specific clothing items were listed as available by the user."
         else:
-            for i, item_attrs in enumerate(available_clothing_items):
-                category = item_attrs.get('category', 'item')
-                color = item_attrs.get('color', '')
-                description = f"Item {i+1}: A "
-                if color and color.lower() != 'unknown':
-                    description += f"{color} "
-                description += category
-                formatted_available_items_list.append(description)
-            formatted_available_items = "\n".join(formatted_available_items_list)
+            formatted_available_items = prompts.format_items(available_clothing_items, tokens=shares['items'])
+
+        # Earlier turns of the conversation
+        history_section = ""
+        if turns:
+            history = prompts.format_history(turns, shares['history'])
+            history_section = f"Since then, the conversation went on:\n{history}\n\n"
 
         # Construct the refinement prompt
         refinement_prompt = (
@@ -520,9 +1376,10 @@ def refine_outfit_suggestion():
             "The user has the following clothing items available:\n"
             f"{formatted_available_items}\n\n"
             "Previously, you provided these outfit suggestions:\n"
-            f'"{original_suggestion}"\n\n'
+            f'"{prompt_suggestion}"\n\n'
+            f"{history_section}"
             "Now, the user has a follow-up request:\n"
-            f'"{user_query}"\n\n'
+            f'"{prompt_query}"\n\n'
             "Please provide a new set of outfit suggestions or modifications based on the user's request, "
             "keeping in mind the available items. If the request involves items not explicitly listed as available "
             "(e.g., user mentions 'if I had white sneakers'), acknowledge this and provide advice accordingly, "
@@ -531,7 +1388,8 @@ def refine_outfit_suggestion():
 
         # Call OpenAI ChatCompletion API
         try:
-            chat_completion = openai.ChatCompletion.create(
+            chat_completion = _openai_call(
+                'chat', openai.ChatCompletion.create,
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": refinement_prompt}]
             )
@@ -552,11 +1410,37 @@ def refine_outfit_suggestion():
                  refined_suggestion_text = "The AI did not provide a specific textual refinement."
 
 
+        # Remember the turn so the next request only needs the session id
+        with SessionLocal() as session:
+            now = time.time()
+            _prune_refine_sessions(session, now)
+            if conversation is None:
+                conversation = RefineSession(
+                    public_id=uuid.uuid4().hex,
+                    original_suggestion=original_suggestion,
+                    items=json.dumps(available_clothing_items),
+                )
+                session.add(conversation)
+                session.commit()
+            session.add(RefineTurn(session_id=conversation.id, user_query=user_query,
+                                   response=refined_suggestion_text, created=int(now)))
+            public_id = conversation.public_id
+            session.commit()
+
         return jsonify({
             "refined_suggestion_text": refined_suggestion_text,
-            "follow_up_image_prompt": follow_up_image_prompt
+            "follow_up_image_prompt": follow_up_image_prompt,
+            "session_id": public_id,
         }), 200
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error in /refine_outfit_suggestion endpoint: {e}")
         return jsonify({'error': 'An unexpected error occurred processing your request'}), 500
+
+
+if __name__ == '__main__':
+    flag = os.getenv('FLASK_DEBUG')
+    debug_mode = flag.lower() in {'1', 'true', 'yes'} if flag is not None else False
+    app.run(debug=debug_mode)
@@ -0,0 +1,299 @@
+"""Content-addressed store for uploaded images.
+
+``POST /assets`` stores an image once and returns its id, the SHA-256 of its
+content. The image endpoints then accept that id in place of a file part, so
+a photo used for several requests is only sent and parsed once. Each asset is
+kept as one file named by its id. The name it was uploaded under is kept
+next to it in ``<id>.label``, for places that show it to people, since the
+id itself means nothing there. An asset not used for ``ttl`` seconds expires,
+and expired files are removed as new assets are stored.
+
+Large photos can also be sent in chunks. :meth:`AssetStore.start_upload`
+stages an upload of known length, :meth:`AssetStore.append` writes each
+chunk at its offset straight into the staging file, and
+:meth:`AssetStore.complete` turns the finished file into an asset. The
+staging state lives on disk, so chunks may reach any worker process, and a
+client whose connection dropped resumes from the offset already stored.
+Staged uploads expire after ``staging_ttl`` seconds without a chunk, and
+their number and declared bytes are capped, so clients that never finish
+their uploads can't fill the disk.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+from metrics import Counter
+
+ASSET_LOOKUPS = Counter(
+    "wardrobe_asset_lookups_total", "Asset ids resolved by the image endpoints (hit or miss)", ["result"]
+)
+
+#: Shape of an asset id: a lowercase SHA-256 hex digest
+_ASSET_ID = re.compile(r"^[0-9a-f]{64}$")
+#: Shape of a staged upload id
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class OffsetMismatch(Exception):
+    """Raised when a chunk doesn't start where the staged data ends."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"upload continues at offset {offset}")
+        self.offset = offset
+
+
+#: Longest label kept for an asset
+MAX_LABEL_LENGTH = 255
+
+
+class StagingFull(Exception):
+    """Raised when another staged upload would exceed the staging limits.
+
+    ``reason`` is ``"count"`` or ``"bytes"``.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"too many staged uploads ({reason})")
+        self.reason = reason
+
+
+class Asset:
+    """A stored image, usable wherever an uploaded file is expected.
+
+    ``filename`` is the id, so checks for a missing file treat the asset as
+    present. ``label`` is the name it was uploaded under, ``""`` if unknown.
+    """
+
+    def __init__(self, asset_id: str, path: str, label: str = ""):
+        self.asset_id = asset_id
+        self.path = path
+        self.filename = asset_id
+        self.label = label
+
+
+class StagedUpload:
+    """A chunked upload in progress."""
+
+    def __init__(self, upload_id: str, path: str, length: int):
+        self.upload_id = upload_id
+        self.path = path
+        self.length = length
+
+    @property
+    def offset(self) -> int:
+        """Bytes received so far."""
+        return os.path.getsize(self.path)
+
+
+class AssetStore:
+    """Store images by content hash and expire them after a period of disuse.
+
+    Parameters
+    ----------
+    directory : str
+        Where assets are written.
+    ttl : float
+        Seconds an asset is kept after it was last stored or used.
+    staging_ttl : float
+        Seconds a staged upload is kept after its last chunk.
+    max_staged : int
+        Staged uploads allowed at once.
+    max_staged_bytes : int
+        Total declared length of the staged uploads allowed at once.
+    """
+
+    def __init__(self, directory: str, ttl: float = 86400.0, staging_ttl: float = 3600.0,
+                 max_staged: int = 100, max_staged_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.staging_ttl = staging_ttl
+        self.max_staged = max_staged
+        self.max_staged_bytes = max_staged_bytes
+        self._pruned = 0.0
+
+    @property
+    def staging(self) -> str:
+        return os.path.join(self.directory, ".staging")
+
+    def path_for(self, asset_id: str) -> str:
+        return os.path.join(self.directory, asset_id)
+
+    def put(self, stream, label: str = "") -> str:
+        """Copy the binary ``stream`` into the store and return its asset id.
+
+        ``label``, such as the uploaded file name, replaces any earlier label
+        of the same content.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.directory, prefix=".upload-", delete=False) as tmp:
+            for chunk in iter(lambda: stream.read(64 * 1024), b""):
+                digest.update(chunk)
+                tmp.write(chunk)
+        return self._adopt(tmp.name, digest.hexdigest(), label)
+
+    def _adopt(self, path: str, asset_id: str, label: str = "") -> str:
+        # Same content, same name: replacing an existing copy only refreshes it
+        os.replace(path, self.path_for(asset_id))
+        if label:
+            with tempfile.NamedTemporaryFile("w", dir=self.directory, prefix=".label-", delete=False) as tmp:
+                tmp.write(label[:MAX_LABEL_LENGTH])
+            os.replace(tmp.name, self.path_for(asset_id) + ".label")
+        self._prune()
+        return asset_id
+
+    def _label(self, path: str) -> str:
+        try:
+            with open(path + ".label") as f:
+                label = f.read()
+            os.utime(path + ".label")
+        except OSError:
+            return ""
+        return label
+
+    def get(self, asset_id: str) -> Optional[Asset]:
+        """Return the asset ``asset_id`` and restart its TTL, or ``None`` if unknown or expired."""
+        path = self.path_for(asset_id) if _ASSET_ID.match(asset_id or "") else None
+        try:
+            expired = path is None or time.time() - os.path.getmtime(path) > self.ttl
+            if not expired:
+                os.utime(path)
+        except OSError:
+            expired = True
+        ASSET_LOOKUPS.inc(result="miss" if expired else "hit")
+        return None if expired else Asset(asset_id, path, self._label(path))
+
+    def start_upload(self, length: int) -> StagedUpload:
+        """Stage a chunked upload of ``length`` bytes.
+
+        Expired staged uploads are removed first. Raises :class:`StagingFull`
+        if the upload would exceed ``max_staged`` or ``max_staged_bytes``.
+        """
+        os.makedirs(self.staging, exist_ok=True)
+        with open(os.path.join(self.staging, ".lock"), "a") as lock:
+            # Workers start uploads concurrently; count and create under one lock
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            lengths = self._prune_staging()
+            if len(lengths) >= self.max_staged:
+                raise StagingFull("count")
+            if sum(lengths) + length > self.max_staged_bytes:
+                raise StagingFull("bytes")
+            upload_id = uuid.uuid4().hex
+            path = os.path.join(self.staging, upload_id)
+            with open(path + ".json", "w") as f:
+                json.dump({"length": length}, f)
+            open(path, "wb").close()
+        return StagedUpload(upload_id, path, length)
+
+    def _prune_staging(self) -> list:
+        """Remove staged uploads idle for ``staging_ttl`` and return the others' lengths."""
+        now = time.time()
+        lengths = []
+        names = set(os.listdir(self.staging))
+        for name in names:
+            if not _UPLOAD_ID.match(name.partition(".")[0]):
+                continue
+            path = os.path.join(self.staging, name.partition(".")[0])
+            if name.endswith(".json"):
+                try:
+                    # The sidecar is touched by every chunk
+                    if now - os.path.getmtime(path + ".json") <= self.staging_ttl:
+                        with open(path + ".json") as f:
+                            lengths.append(json.load(f)["length"])
+                        continue
+                except (OSError, ValueError, KeyError):
+                    pass
+                self.discard(StagedUpload(name.partition(".")[0], path, 0))
+            elif name + ".json" not in names:
+                # Data left without its sidecar by an interrupted discard
+                self.discard(StagedUpload(name, path, 0))
+        return lengths
+
+    def staged(self, upload_id: str) -> Optional[StagedUpload]:
+        """Return the staged upload ``upload_id``, or ``None`` if unknown or expired."""
+        if not _UPLOAD_ID.match(upload_id or ""):
+            return None
+        path = os.path.join(self.staging, upload_id)
+        try:
+            with open(path + ".json") as f:
+                length = json.load(f)["length"]
+            if time.time() - os.path.getmtime(path + ".json") > self.staging_ttl:
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return StagedUpload(upload_id, path, length)
+
+    def append(self, upload: StagedUpload, offset: int, stream) -> int:
+        """Write ``stream`` at ``offset`` of ``upload`` and return the new offset.
+
+        Raises :class:`OffsetMismatch` unless ``offset`` is where the staged
+        data ends, and :class:`ValueError` if the chunk would run past the
+        declared length. In both cases nothing is written.
+        """
+        with open(upload.path, "r+b") as f:
+            # Workers may receive retries of the same chunk at once
+            fcntl.flock(f, fcntl.LOCK_EX)
+            end = f.seek(0, os.SEEK_END)
+            if offset != end:
+                raise OffsetMismatch(end)
+            shutil.copyfileobj(stream, f, 64 * 1024)
+            written = f.tell()
+            if written > upload.length:
+                f.truncate(end)
+                raise ValueError(f"chunk runs past the declared length of {upload.length} bytes")
+        # Keep the length next to the data it describes until pruning
+        os.utime(upload.path + ".json")
+        return written
+
+    def complete(self, upload: StagedUpload, label: str = "") -> str:
+        """Move the finished ``upload`` into the store and return its asset id."""
+        digest = hashlib.sha256()
+        with open(upload.path, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(chunk)
+        asset_id = self._adopt(upload.path, digest.hexdigest(), label)
+        self.discard(upload)
+        return asset_id
+
+    def discard(self, upload: StagedUpload) -> None:
+        """Remove what is staged for ``upload``."""
+        for path in (upload.path, upload.path + ".json"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _prune(self) -> None:
+        now = time.time()
+        # A full scan at most ten times per TTL
+        if now - self._pruned < self.ttl / 10:
+            return
+        self._pruned = now
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.isfile(path) and now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:  # pragma: no cover - removed concurrently
+                pass
+        if os.path.isdir(self.staging):
+            self._prune_staging()
+
+
+def store_from_env() -> AssetStore:
+    """Build the :class:`AssetStore` configured through ``ASSET_*`` variables."""
+    return AssetStore(
+        os.getenv("ASSET_DIR") or os.path.join(tempfile.gettempdir(), "wardrobe-assets"),
+        ttl=float(os.getenv("ASSET_TTL", "86400")),
+        staging_ttl=float(os.getenv("ASSET_STAGING_TTL", "3600")),
+        max_staged=int(os.getenv("ASSET_MAX_STAGED", "100")),
+        max_staged_bytes=int(os.getenv("ASSET_MAX_STAGED_BYTES", str(256 * 1024 * 1024))),
+    )
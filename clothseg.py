@@ -1,8 +1,16 @@
 """U\u00b2-Net-based cloth segmentation utilities."""
 
+import json
+import logging
+import math
 import os
-from typing import Dict, List
-import struct
+from typing import Dict, List, Optional
+import time
+
+import imageprobe
+from deadlines import DeadlineExceeded, check_deadline, remaining
+from imageprobe import ImageInfo
+from metrics import Counter, current_request, stage
 
 try:
     import cv2
@@ -10,13 +18,90 @@ except Exception:  # pragma: no cover - optional dependency
     cv2 = None
 
 try:
-    import torch
-    from PIL import Image
     import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    import torch
+    from PIL import Image, ImageOps
 except ImportError:  # pragma: no cover - optional dependencies
     torch = None
 
 
+logger = logging.getLogger(__name__)
+
+#: Settings used when no tuned config exists; ``clothseg.py bench`` writes tuned ones
+DEFAULT_SETTINGS = {"threads": None, "batch_size": 1, "working_resolution": None}
+
+#: Weight of the newest sample in the per-tier time averages used against deadlines
+TIER_TIME_SMOOTHING = 0.2
+
+#: GrabCut iterations; the deadline is checked between them
+GRABCUT_ITERATIONS = 5
+
+#: Square input size used for batched model inference without a working resolution
+BATCH_RESOLUTION = 320
+
+#: Most pixels an image may decode to (``MAX_IMAGE_PIXELS``); 40 MP is about 120 MB as BGR
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+
+#: ``reject`` images over the budget, or ``reduce`` JPEGs while decoding (``OVERSIZE_IMAGES``)
+OVERSIZE_POLICY = os.getenv("OVERSIZE_IMAGES", "reject")
+
+#: Scale denominators a JPEG decoder can apply in the DCT domain
+JPEG_REDUCTIONS = (2, 4, 8)
+
+#: Longest side :meth:`ClothSegmenter.classify` decodes at; enough for a colour average
+CLASSIFY_RESOLUTION = 256
+
+SEGMENTATION_TIER = Counter(
+    "wardrobe_segmentation_tier_total",
+    "Segmentations served by each tier (torchscript, grabcut or header_split)",
+    ["tier"],
+)
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image would decode to more than :data:`MAX_IMAGE_PIXELS`."""
+
+    def __init__(self, width: int, height: int):
+        super().__init__(f"{width}x{height} image exceeds the {MAX_IMAGE_PIXELS} pixel budget")
+        self.width = width
+        self.height = height
+
+
+def decode_reduction(fmt: str | None, width: int, height: int, target: int | None = None) -> int:
+    """Return the factor an image should be shrunk by while decoding.
+
+    ``1`` means the image fits :data:`MAX_IMAGE_PIXELS` at full size. With
+    the ``reduce`` policy a larger JPEG gets the smallest of
+    :data:`JPEG_REDUCTIONS` that fits. Anything else over the budget raises
+    :class:`ImageTooLarge`, so it is never decoded. A size of ``0`` means the
+    header couldn't be read. The decoder is then left to reject the file; the
+    app never accepts such uploads.
+
+    ``target`` is the longest side the caller needs. A JPEG is then decoded
+    at the largest reduction that still provides it.
+    """
+    reduction = 1
+    if width * height > MAX_IMAGE_PIXELS:
+        if OVERSIZE_POLICY != "reduce" or fmt != "jpeg":
+            raise ImageTooLarge(width, height)
+        reduction = next(
+            (f for f in JPEG_REDUCTIONS
+             if math.ceil(width / f) * math.ceil(height / f) <= MAX_IMAGE_PIXELS),
+            None,
+        )
+        if reduction is None:
+            raise ImageTooLarge(width, height)
+    if target and fmt == "jpeg":
+        for factor in reversed(JPEG_REDUCTIONS):
+            if factor > reduction and math.ceil(max(width, height) / factor) >= target:
+                return factor
+    return reduction
+
+
 class ClothSegmenter:
     """U\u00b2-Net cloth segmentation model loader and parser."""
 
@@ -30,6 +115,9 @@ class ClothSegmenter:
         os.path.expanduser("~"), "\.u2net", "u2net.pth"
     )
 
+    #: Default location of the settings written by ``clothseg.py bench``
+    DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(DEFAULT_MODEL_PATH), "clothseg.json")
+
     @classmethod
     def download_model(cls, dest_path: str | None = None) -> str:
         """Download the pre-trained weights.
@@ -54,13 +142,16 @@ class ClothSegmenter:
         torch.hub.download_url_to_file(cls.MODEL_URL, dest, progress=True)
         return dest
 
-    def __init__(self, model_path: str | None = None):
+    def __init__(self, model_path: str | None = None, config_path: str | None = None):
         """Initialise the segmenter.
 
         Parameters
         ----------
         model_path : str | None
             Optional path to a pre-trained U2Net cloth segmentation model.
+        config_path : str | None
+            Tuned settings to apply. Defaults to ``CLOTHSEG_CONFIG`` or
+            :data:`DEFAULT_CONFIG_PATH`.
         """
         if model_path is None:
             model_path = (
@@ -74,58 +165,138 @@ class ClothSegmenter:
                 self.model.eval()
             except Exception:
                 self.model = None
+        #: Optional :class:`admission.TierGovernor` that skips tiers under load
+        self.governor = None
+        #: Recent seconds per image of each tier, used to skip tiers a deadline can't fit
+        self.tier_seconds: Dict[str, float] = {}
+        self.config_path = config_path or os.getenv("CLOTHSEG_CONFIG") or self.DEFAULT_CONFIG_PATH
+        self.settings = self.load_settings(self.config_path)
+        self.apply_settings()
+
+    @staticmethod
+    def load_settings(path: str | None) -> Dict:
+        """Return :data:`DEFAULT_SETTINGS` updated from the JSON file at ``path``."""
+        settings = dict(DEFAULT_SETTINGS)
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                settings.update({k: data[k] for k in DEFAULT_SETTINGS if k in data})
+            except (OSError, ValueError) as e:
+                logger.warning("Ignoring unreadable segmentation config %s: %s", path, e)
+        return settings
+
+    def apply_settings(self, **overrides) -> None:
+        """Update :attr:`settings` and apply the thread count to torch and OpenCV."""
+        self.settings.update(overrides)
+        threads = self.settings.get("threads")
+        if threads:
+            if torch is not None:
+                torch.set_num_threads(int(threads))
+            if cv2 is not None:
+                cv2.setNumThreads(int(threads))
+
+    def _working_scale(self, height: int, width: int) -> float:
+        limit = self.settings.get("working_resolution")
+        if not limit or max(height, width) <= limit:
+            return 1.0
+        return limit / max(height, width)
+
+    def load_model(self) -> bool:
+        """Load the weights now if they are available and not loaded yet.
+
+        :meth:`parse` calls this lazily. Servers can call it up front so the
+        weights are loaded once before worker processes are forked.
+
+        Returns
+        -------
+        bool
+            ``True`` when a model is loaded.
+        """
+        if self.model is None and torch is not None:  # pragma: no cover - load lazily
+            path = self.model_path
+            if path is None and os.path.exists(self.DEFAULT_MODEL_PATH):
+                path = self.DEFAULT_MODEL_PATH
+            if path and os.path.exists(path):
+                try:
+                    self.model = torch.jit.load(path)
+                    self.model.eval()
+                except Exception:
+                    self.model = None
+        return self.model is not None
 
     @staticmethod
     def _get_image_size(path: str) -> tuple[int, int]:
-        """Return ``(width, height)`` for a PNG or JPEG image.
+        """Return ``(width, height)`` as stored in the image header.
 
-        This helper avoids external dependencies by reading the image header
-        directly. If the size cannot be determined, ``(0, 0)`` is returned.
+        If the size cannot be determined, ``(0, 0)`` is returned.
         """
-        try:
-            with open(path, "rb") as f:
-                head = f.read(24)
-                if len(head) >= 24 and head.startswith(b"\211PNG\r\n\032\n") and head[12:16] == b"IHDR":
-                    width, height = struct.unpack(">II", head[16:24])
-                    return int(width), int(height)
-                if head[:2] == b"\xff\xd8":
-                    f.seek(2)
-                    while True:
-                        byte = f.read(1)
-                        if not byte:
-                            break
-                        if byte != b"\xff":
-                            continue
-                        marker = f.read(1)
-                        while marker == b"\xff":
-                            marker = f.read(1)
-                        if marker in b"\xc0\xc1\xc2\xc3\xc5\xc6\xc7\xc9\xca\xcb\xcd\xce\xcf":
-                            f.read(3)
-                            height, width = struct.unpack(">HH", f.read(4))
-                            return int(width), int(height)
-                        else:
-                            size_data = f.read(2)
-                            if len(size_data) != 2:
-                                break
-                            size = struct.unpack(">H", size_data)[0]
-                            f.seek(size - 2, 1)
-        except Exception:  # pragma: no cover - fallback when parsing fails
-            pass
-        return 0, 0
+        info = ClothSegmenter._get_image_info(path)
+        return info.width, info.height
+
+    @staticmethod
+    @stage("probe")
+    def _get_image_info(path: str) -> ImageInfo:
+        """Return the format, size and orientation read from the header at ``path``."""
+        return imageprobe.probe(path)
+
+    def _read_image(self, image_path: str, target: int | None = None):
+        """Decode ``image_path`` with OpenCV within the pixel budget.
+
+        A JPEG at least twice ``target`` on its longest side is decoded at
+        1/2, 1/4 or 1/8 scale by libjpeg, which skips most of the work. The
+        longest side of the result is still at least ``target``.
+
+        Returns ``(image, reduction, (height, width))``. The image is
+        ``reduction`` times smaller on each side than the original, whose size
+        is given as oriented in the decoded image. ``image`` is ``None`` when
+        the file can't be read. Raises :class:`ImageTooLarge` before decoding
+        anything too big.
+        """
+        info = self._get_image_info(image_path)
+        reduction = decode_reduction(info.format, info.width, info.height, target)
+        flag = cv2.IMREAD_COLOR if reduction == 1 else getattr(cv2, f"IMREAD_REDUCED_COLOR_{reduction}")
+        with stage("decode"):
+            img = cv2.imread(image_path, flag)
+        if img is None:
+            return None, reduction, (info.height, info.width)
+        if reduction == 1:
+            return img, 1, img.shape[:2]
+        # OpenCV applies the EXIF orientation while decoding
+        width, height = info.display_size
+        return img, reduction, (height, width)
 
+    @stage("grabcut")
     def _parse_grabcut(self, image_path: str) -> Dict[str, List]:
         """Return simple masks using OpenCV's GrabCut if available."""
-        if cv2 is None:
+        if cv2 is None or np is None:
+            return {}
+        try:
+            img, reduction, (height, width) = self._read_image(
+                image_path, self.settings.get("working_resolution")
+            )
+        except ImageTooLarge as e:
+            logger.warning("Not segmenting %s: %s", image_path, e)
             return {}
-        img = cv2.imread(image_path)
         if img is None:
             return {}
+        # Relative to the original size; a reduced decode already counts towards it
+        scale = min(self._working_scale(height, width), 1.0 / reduction)
+        if scale * reduction < 1.0:
+            # GrabCut cost grows with the pixel count; boxes are scaled back below
+            fx = scale * reduction
+            img = cv2.resize(img, None, fx=fx, fy=fx, interpolation=cv2.INTER_AREA)
         mask = np.zeros(img.shape[:2], np.uint8)
         rect = (1, 1, img.shape[1] - 2, img.shape[0] - 2)
         bgdModel = np.zeros((1, 65), np.float64)
         fgdModel = np.zeros((1, 65), np.float64)
         try:  # pragma: no cover - requires cv2
-            cv2.grabCut(img, mask, rect, bgdModel, fgdModel, 5, cv2.GC_INIT_WITH_RECT)
+            cv2.grabCut(img, mask, rect, bgdModel, fgdModel, 1, cv2.GC_INIT_WITH_RECT)
+            for _ in range(GRABCUT_ITERATIONS - 1):
+                check_deadline("grabcut")
+                cv2.grabCut(img, mask, rect, bgdModel, fgdModel, 1, cv2.GC_EVAL)
+        except DeadlineExceeded:
+            raise
         except Exception:  # pragma: no cover - grabcut failure
             return {}
         mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype("uint8")
@@ -134,6 +305,10 @@ class ClothSegmenter:
         ys, xs = np.where(mask2 == 1)
         left, right = int(xs.min()), int(xs.max())
         top, bottom = int(ys.min()), int(ys.max())
+        if scale < 1.0:
+            left, top = int(left / scale), int(top / scale)
+            right = min(width - 1, int((right + 1) / scale) - 1)
+            bottom = min(height - 1, int((bottom + 1) / scale) - 1)
         mid = (top + bottom) // 2
         return {
             "upper_body": [[left, top, right, mid]],
@@ -141,6 +316,7 @@ class ClothSegmenter:
             "full_body": [[left, top, right, bottom]],
         }
 
+    @stage("classify")
     def classify(self, image_path: str, parts: Dict[str, List]) -> Dict[str, str]:
         """Return a simple category and colour estimate for the garment."""
         if cv2 is None:
@@ -149,10 +325,13 @@ class ClothSegmenter:
         if not full:
             return {"category": "unknown", "color": "unknown"}
         x1, y1, x2, y2 = full[0]
-        img = cv2.imread(image_path)
+        try:
+            img, r, _ = self._read_image(image_path, CLASSIFY_RESOLUTION)
+        except ImageTooLarge:
+            return {"category": "unknown", "color": "unknown"}
         if img is None:
             return {"category": "unknown", "color": "unknown"}
-        region = img[y1:y2, x1:x2]
+        region = img[y1 // r:-(-y2 // r), x1 // r:-(-x2 // r)]
         if region.size == 0:
             return {"category": "unknown", "color": "unknown"}
         h, w = region.shape[:2]
@@ -187,53 +366,343 @@ class ClothSegmenter:
                 color = "purple"
         return {"category": category, "color": color}
 
+    def analyze(self, image_path: str) -> Dict[str, Dict]:
+        """Return segmentation ``parts`` together with classified ``attributes``."""
+        parts = self.parse(image_path)
+        return {"parts": parts, "attributes": self.classify(image_path, parts)}
+
+    def available_tiers(self) -> List[str]:
+        """Return the segmentation tiers usable here, best first."""
+        self.load_model()
+        tiers = []
+        if self.model is not None:
+            tiers.append("torchscript")
+        if cv2 is not None and np is not None:
+            tiers.append("grabcut")
+        tiers.append("header_split")
+        return tiers
+
+    def _tiers(self) -> List[str]:
+        """Return the tiers to try.
+
+        The governor may skip the best tiers. Tiers that usually take longer
+        than the request has left are skipped too. The header split is
+        always kept as the last resort.
+        """
+        tiers = self.available_tiers()
+        if self.governor is not None:
+            tiers = tiers[self.governor.level(len(tiers)):]
+        left = remaining()
+        if left is not None:
+            tiers = [t for t in tiers[:-1] if self.tier_seconds.get(t, 0.0) <= left] + tiers[-1:]
+        return tiers
+
+    def _record_tier(self, tier: str, count: int = 1, seconds: float | None = None) -> None:
+        if seconds is not None:
+            per_image = seconds / count
+            previous = self.tier_seconds.get(tier)
+            self.tier_seconds[tier] = (
+                per_image if previous is None
+                else previous + TIER_TIME_SMOOTHING * (per_image - previous)
+            )
+        SEGMENTATION_TIER.inc(count, tier=tier)
+        timings = current_request()
+        if timings is not None:
+            timings.tiers.extend([tier] * count)
+
+    @stage("parse")
     def parse(self, image_path: str) -> Dict[str, List]:
         """Return segmentation masks for the supplied image.
 
         If a real model is available, it will be used. Otherwise, this
         method returns dummy segmentation data so the rest of the
-        application can function without the heavy dependency.
+        application can function without the heavy dependency. A
+        :attr:`governor` may skip the better tiers while the server is
+        overloaded, and so does a request deadline that a tier would miss.
+        Work is abandoned with :class:`deadlines.DeadlineExceeded` once the
+        deadline has passed.
         """
-        parts = ["upper_body", "lower_body", "full_body"]
-
-        if self.model is None and torch is not None:  # pragma: no cover - load lazily
-            path = self.model_path
-            if path is None and os.path.exists(self.DEFAULT_MODEL_PATH):
-                path = self.DEFAULT_MODEL_PATH
-            if path and os.path.exists(path):
+        for tier in self._tiers():
+            start = time.perf_counter()
+            if tier == "torchscript":
+                # Real inference path. This branch is not executed in tests as
+                # it requires PyTorch and model weights.
                 try:
-                    self.model = torch.jit.load(path)
-                    self.model.eval()
-                except Exception:
-                    self.model = None
+                    result = self._parse_torch([image_path])[0]
+                except ImageTooLarge:
+                    continue
+                self._record_tier(tier, seconds=time.perf_counter() - start)
+                return result
+            if tier == "grabcut":
+                parts_gc = self._parse_grabcut(image_path)
+                if parts_gc:
+                    self._record_tier(tier, seconds=time.perf_counter() - start)
+                    return parts_gc
+        self._record_tier("header_split")
+        return self._parse_header_split(image_path)
+
+    @stage("parse")
+    def parse_batch(self, image_paths: List[str]) -> List[Dict[str, List]]:
+        """Return :meth:`parse` results for several images.
 
-        if self.model is None:
-            parts_gc = self._parse_grabcut(image_path)
-            if parts_gc:
-                return parts_gc
-            width, height = self._get_image_size(image_path)
-            if width == 0 or height == 0:
-                return {part: [] for part in parts}
-            half = height // 2
-            return {
-                "upper_body": [[0, 0, width, half]],
-                "lower_body": [[0, half, width, height]],
-                "full_body": [[0, 0, width, height]],
-            }
-
-        # Real inference path. This branch is not executed in tests as it
-        # requires PyTorch and model weights.
+        With a loaded model, inference runs in batches of the tuned
+        ``batch_size``. Otherwise every image is parsed on its own.
+        """
+        batch_size = max(1, int(self.settings.get("batch_size") or 1))
+        if batch_size == 1 or self._tiers()[0] != "torchscript":
+            return [self.parse(path) for path in image_paths]
+        results = []
+        for start in range(0, len(image_paths), batch_size):  # pragma: no cover - requires torch
+            check_deadline("parse")
+            chunk = image_paths[start:start + batch_size]
+            began = time.perf_counter()
+            try:
+                results.extend(self._parse_torch(chunk))
+            except ImageTooLarge:
+                results.extend(self.parse(path) for path in chunk)
+                continue
+            self._record_tier("torchscript", len(chunk), seconds=time.perf_counter() - began)
+        return results
+
+    def _parse_header_split(self, image_path: str) -> Dict[str, List]:
+        """Split the image into upper and lower halves using only its header."""
+        width, height = self._get_image_info(image_path).display_size
+        if width == 0 or height == 0:
+            return {part: [] for part in ("upper_body", "lower_body", "full_body")}
+        half = height // 2
+        return {
+            "upper_body": [[0, 0, width, half]],
+            "lower_body": [[0, half, width, height]],
+            "full_body": [[0, 0, width, height]],
+        }
+
+    def _parse_torch(self, image_paths: List[str]) -> List[Dict[str, List]]:
+        """Run the model on ``image_paths`` as one batch.
+
+        Images are resized to the working resolution (square) when one is
+        configured or more than one image is batched. JPEGs over the pixel
+        budget are decoded at a reduced scale when the policy allows it. The
+        masks are then scaled back to each image's own size. A mask of an
+        image over the budget would be as large as the decode that was
+        avoided, so such images get one ``[x1, y1, x2, y2]`` box per part in
+        their own coordinates instead, like :meth:`_parse_grabcut` returns.
+        Raises :class:`ImageTooLarge` for images that can't be decoded within
+        the budget.
+        """
+        parts = ["upper_body", "lower_body", "full_body"]
+        size = self.settings.get("working_resolution")
+        if size is None and len(image_paths) > 1:
+            size = BATCH_RESOLUTION
         with torch.no_grad():  # pragma: no cover - requires torch
-            image = Image.open(image_path).convert("RGB")
-            tensor = torch.from_numpy(np.array(image)).float().permute(2, 0, 1) / 255.0
-            tensor = tensor.unsqueeze(0)
-            output = self.model(tensor)[0]
-            masks = output > 0.5
-            return {p: m.squeeze().cpu().numpy().tolist() for p, m in zip(parts, masks)}
+            images = []
+            original_sizes = []
+            rescale = bool(size)
+            for path in image_paths:
+                info = self._get_image_info(path)
+                width, height = info.width, info.height
+                reduction = decode_reduction(info.format, width, height, size)
+                with stage("decode"):
+                    image = Image.open(path)
+                    if reduction > 1:
+                        # Let libjpeg scale in the DCT domain instead of decoding in full
+                        rescale = True
+                        image.draft("RGB", (math.ceil(width / reduction), math.ceil(height / reduction)))
+                    image = image.convert("RGB")
+                    if info.orientation != 1:
+                        # Rotating the reduced image is cheap; masks match what OpenCV sees
+                        rescale = True
+                        image = ImageOps.exif_transpose(image)
+                    images.append(image)
+                original_sizes.append(info.display_size)
+            if size:
+                images = [image.resize((size, size)) for image in images]
+            tensors = [torch.from_numpy(np.array(image)).float().permute(2, 0, 1) / 255.0 for image in images]
+            tensor = tensors[0].unsqueeze(0) if len(tensors) == 1 else torch.stack(tensors)
+            outputs = self.model(tensor)
+            results = []
+            for index in range(len(images)):
+                output = outputs[index]
+                width, height = original_sizes[index]
+                if width * height > MAX_IMAGE_PIXELS:
+                    masks = output > 0.5
+                    results.append({
+                        p: _mask_box(m.squeeze().cpu().numpy().tolist(), width, height)
+                        for p, m in zip(parts, masks)
+                    })
+                    continue
+                if rescale:
+                    output = torch.nn.functional.interpolate(
+                        output.unsqueeze(0).float(), size=(height, width), mode="nearest"
+                    )[0]
+                masks = output > 0.5
+                results.append({p: m.squeeze().cpu().numpy().tolist() for p, m in zip(parts, masks)})
+            return results
+
+
+#: Working resolutions tried by :func:`autotune`; ``None`` keeps the full image
+BENCH_RESOLUTIONS = (None, 1024, 768, 512, 320)
+
+#: Batch sizes tried by :func:`autotune` for the model tier
+BENCH_BATCH_SIZES = (1, 2, 4, 8)
+
+
+def _thread_options() -> List[int]:
+    cpus = os.cpu_count() or 1
+    return sorted({n for n in (1, 2, 4, 8, cpus) if n <= cpus})
+
+
+def synthetic_images(directory: str, sizes=((640, 480), (1600, 1200))) -> List[str]:
+    """Write JPEGs of a coloured garment on a noisy background and return their paths."""
+    if cv2 is None or np is None:
+        raise RuntimeError("OpenCV and NumPy are required to generate benchmark images")
+    rng = np.random.default_rng(0)
+    paths = []
+    for width, height in sizes:
+        img = rng.integers(90, 140, size=(height, width, 3), dtype=np.uint8)
+        cv2.rectangle(img, (width // 4, height // 6), (3 * width // 4, 5 * height // 6), (40, 60, 200), -1)
+        path = os.path.join(directory, f"bench_{width}x{height}.jpg")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return paths
+
+
+def _full_box(parts: Dict[str, List]) -> Optional[List[int]]:
+    """Return the ``full_body`` box of parse output holding boxes or masks."""
+    full = parts.get("full_body")
+    if not full:
+        return None
+    if len(full) == 1 and len(full[0]) == 4 and not isinstance(full[0][0], list):
+        return full[0]
+    ys = [y for y, row in enumerate(full) if any(row)]
+    xs = [x for row in full for x, v in enumerate(row) if v]
+    return [min(xs), min(ys), max(xs), max(ys)] if xs else None
+
+
+def _mask_box(mask: List[List[int]], width: int, height: int) -> List[List[int]]:
+    """Return ``[[x1, y1, x2, y2]]`` around ``mask`` scaled to a ``width`` x ``height`` image.
+
+    An empty mask gives ``[]``.
+    """
+    box = _full_box({"full_body": mask})
+    if box is None:
+        return []
+    sx, sy = width / len(mask[0]), height / len(mask)
+    return [[int(box[0] * sx), int(box[1] * sy),
+             min(width - 1, int((box[2] + 1) * sx) - 1), min(height - 1, int((box[3] + 1) * sy) - 1)]]
+
+
+def box_iou(a: Optional[List[int]], b: Optional[List[int]]) -> float:
+    """Intersection over union of two ``[x1, y1, x2, y2]`` boxes."""
+    if a is None or b is None:
+        return 1.0 if a == b else 0.0
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 1.0
+
+
+def _time_per_image(run, image_paths: List[str], repeat: int):
+    """Return ``(seconds_per_image, last_outputs)`` for ``run(image_paths)``."""
+    outputs = run(image_paths)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        outputs = run(image_paths)
+    return (time.perf_counter() - start) / (repeat * len(image_paths)), outputs
+
+
+def autotune(segmenter: ClothSegmenter, image_paths: List[str], repeat: int = 3, threads=None,
+             batch_sizes=BENCH_BATCH_SIZES, resolutions=BENCH_RESOLUTIONS, min_iou: float = 0.9) -> Dict:
+    """Measure every available tier and pick the fastest acceptable settings.
+
+    Each tier is timed for every combination of thread count, batch size
+    (model tier only) and working resolution. A reduced resolution is only
+    acceptable while the ``full_body`` box it finds overlaps the
+    full-resolution result by at least ``min_iou`` on every image.
+
+    Returns
+    -------
+    dict
+        ``{"tiers": {tier: [row, ...]}, "tier": best_tier, "settings": {...}}``,
+        where each row holds the settings tried, ``ms_per_image``,
+        ``images_per_sec`` and ``iou``.
+    """
+    threads = threads or _thread_options()
+    original = dict(segmenter.settings)
+    # Settings without a thread count leave the libraries' own, so restore those explicitly
+    torch_threads = torch.get_num_threads() if torch is not None else None
+    cv2_threads = cv2.getNumThreads() if cv2 is not None else None
+    tiers: Dict[str, List[Dict]] = {}
+
+    def row(settings, seconds, iou=1.0):
+        return dict(settings, ms_per_image=round(seconds * 1000, 3),
+                    images_per_sec=round(1 / seconds, 2) if seconds else None, iou=round(iou, 3))
+
+    seconds, _ = _time_per_image(lambda paths: [segmenter._parse_header_split(p) for p in paths], image_paths, repeat)
+    tiers["header_split"] = [row(dict(DEFAULT_SETTINGS), seconds)]
+
+    candidates = []
+    if cv2 is not None and np is not None:
+        candidates.append(("grabcut", lambda paths: [segmenter._parse_grabcut(p) for p in paths], (1,)))
+    if segmenter.load_model():  # pragma: no cover - requires torch and weights
+        candidates.append(("torchscript", segmenter.parse_batch, batch_sizes))
+
+    try:
+        for tier, run, batches in candidates:
+            segmenter.apply_settings(**DEFAULT_SETTINGS)
+            reference = [_full_box(parts) for parts in run(image_paths)]
+            rows = tiers[tier] = []
+            for n_threads in threads:
+                for batch_size in batches:
+                    for resolution in resolutions:
+                        settings = {"threads": n_threads, "batch_size": batch_size, "working_resolution": resolution}
+                        segmenter.apply_settings(**settings)
+                        seconds, outputs = _time_per_image(run, image_paths, repeat)
+                        iou = min(box_iou(_full_box(o), r) for o, r in zip(outputs, reference))
+                        rows.append(row(settings, seconds, iou))
+                        logger.info("%s %s: %.1f ms/image, IoU %.3f", tier, settings, seconds * 1000, iou)
+    finally:
+        segmenter.apply_settings(**original)
+        if torch_threads is not None:
+            torch.set_num_threads(torch_threads)
+        if cv2_threads is not None:
+            cv2.setNumThreads(cv2_threads)
+
+    # parse() always prefers the model, then GrabCut, so tune the best tier present
+    best_tier = next(t for t in ("torchscript", "grabcut", "header_split") if t in tiers)
+    acceptable = [r for r in tiers[best_tier] if r["iou"] >= min_iou] or tiers[best_tier]
+    best = min(acceptable, key=lambda r: r["ms_per_image"])
+    return {"tiers": tiers, "tier": best_tier, "settings": {k: best[k] for k in DEFAULT_SETTINGS}}
+
+
+def write_settings(path: str, result: Dict) -> None:
+    """Write :func:`autotune` output where :meth:`ClothSegmenter.load_settings` finds it."""
+    import platform
+    from datetime import datetime, timezone
+
+    data = dict(result["settings"])
+    data.update({
+        "tier": result["tier"],
+        "machine": {"node": platform.node(), "processor": platform.processor(), "cpus": os.cpu_count()},
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "results": result["tiers"],
+    })
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(v) for v in text.split(",") if v]
+
+
+def _resolution_list(text: str) -> List[Optional[int]]:
+    return [None if v == "full" else int(v) for v in text.split(",") if v]
 
 
 if __name__ == "__main__":  # pragma: no cover - manual invocation
     import argparse
+    import tempfile
 
     parser = argparse.ArgumentParser(description="U\u00b2-Net cloth segmentation utilities")
     parser.add_argument(
@@ -244,8 +713,50 @@ if __name__ == "__main__":  # pragma: no cover - manual invocation
     parser.add_argument(
         "--dest", type=str, default=None, help="Custom path for downloaded weights"
     )
+    commands = parser.add_subparsers(dest="command")
+    bench_parser = commands.add_parser(
+        "bench", help="Measure each segmentation tier and write the fastest settings"
+    )
+    bench_parser.add_argument("images", nargs="*", help="Representative images (synthetic ones by default)")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the images")
+    bench_parser.add_argument("--threads", type=_int_list, default=None, help="e.g. 1,2,4")
+    bench_parser.add_argument("--batch-sizes", type=_int_list, default=list(BENCH_BATCH_SIZES))
+    bench_parser.add_argument(
+        "--resolutions", type=_resolution_list, default=list(BENCH_RESOLUTIONS),
+        help="Working resolutions to try, e.g. full,1024,512",
+    )
+    bench_parser.add_argument("--min-iou", type=float, default=0.9, help="Required overlap with full resolution")
+    bench_parser.add_argument("--model", default=None, help="Model weights to benchmark")
+    bench_parser.add_argument(
+        "--output", default=None, help="Config file to write (default CLOTHSEG_CONFIG or ~/.u2net/clothseg.json)"
+    )
+    bench_parser.add_argument("--dry-run", action="store_true", help="Print results without writing the config")
     args = parser.parse_args()
 
     if args.download_model:
         path = ClothSegmenter.download_model(args.dest)
         print(f"Model downloaded to {path}")
+
+    if args.command == "bench":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        segmenter = ClothSegmenter(model_path=args.model)
+        # Start from untuned defaults; an existing config must not skew the reference
+        segmenter.settings = dict(DEFAULT_SETTINGS)
+        with tempfile.TemporaryDirectory() as tmp:
+            images = args.images or synthetic_images(tmp)
+            result = autotune(
+                segmenter, images, repeat=args.repeat, threads=args.threads, batch_sizes=args.batch_sizes,
+                resolutions=args.resolutions, min_iou=args.min_iou,
+            )
+        for tier, rows in result["tiers"].items():
+            print(f"\n{tier}")
+            print(f"{'threads':>8}{'batch':>7}{'resolution':>12}{'ms/image':>11}{'images/s':>10}{'IoU':>7}")
+            for r in rows:
+                resolution = r["working_resolution"] or "full"
+                print(f"{str(r['threads']):>8}{r['batch_size']:>7}{resolution:>12}"
+                      f"{r['ms_per_image']:>11}{str(r['images_per_sec']):>10}{r['iou']:>7}")
+        print(f"\nBest for {result['tier']}: {result['settings']}")
+        if not args.dry_run:
+            output = args.output or os.getenv("CLOTHSEG_CONFIG") or ClothSegmenter.DEFAULT_CONFIG_PATH
+            write_settings(output, result)
+            print(f"Settings written to {output}")
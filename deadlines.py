@@ -0,0 +1,109 @@
+"""Per-request deadlines.
+
+A request may carry an ``X-Request-Timeout`` header with the number of
+seconds the client is prepared to wait. ``REQUEST_TIMEOUT`` sets a server
+default and an upper bound. The resulting :class:`Deadline` is current for
+the rest of the request. It is checked between pipeline stages, it lets the
+segmenter skip tiers that can't finish in time and abort GrabCut between
+iterations, and its remaining time bounds OpenAI calls. Once it has passed,
+:class:`DeadlineExceeded` unwinds the request and the app answers ``504``.
+The client has given up by then, so no further work is spent on it.
+"""
+
+import contextlib
+import contextvars
+import os
+import time
+from typing import Optional
+
+from metrics import Counter, current_route
+
+DEADLINE_EXCEEDED = Counter(
+    "wardrobe_deadline_exceeded_total",
+    "Requests abandoned because their deadline passed, per route and stage",
+    ["route", "stage"],
+)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the current request's deadline has passed."""
+
+    def __init__(self, where: str):
+        super().__init__(f"deadline exceeded before {where}")
+        self.where = where
+
+
+class Deadline:
+    """A point in time, ``seconds`` from now, by which a request must finish."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def check(self, where: str) -> None:
+        """Raise :class:`DeadlineExceeded` if the deadline has passed."""
+        if self.expired():
+            raise deadline_exceeded(where)
+
+
+def deadline_exceeded(where: str) -> DeadlineExceeded:
+    """Count a request running out of time at ``where`` and return the exception to raise."""
+    DEADLINE_EXCEEDED.inc(route=current_route(), stage=where)
+    return DeadlineExceeded(where)
+
+
+_current_deadline: contextvars.ContextVar = contextvars.ContextVar("wardrobe_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Return the deadline of the request being handled, if it has one."""
+    return _current_deadline.get()
+
+
+def check_deadline(where: str) -> None:
+    """Raise :class:`DeadlineExceeded` if the current request is out of time."""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check(where)
+
+
+def remaining() -> Optional[float]:
+    """Return the seconds left for the current request, ``None`` without a deadline."""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline: Optional[Deadline]):
+    """Make ``deadline`` current for the ``with`` block."""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def _seconds(value) -> Optional[float]:
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds > 0 else None
+
+
+def deadline_from_headers(headers, default=None) -> Optional[Deadline]:
+    """Build the deadline for a request.
+
+    ``X-Request-Timeout`` may shorten ``default`` (``REQUEST_TIMEOUT`` when
+    not given) but never extend it. Invalid values are ignored.
+    """
+    if default is None:
+        default = os.getenv("REQUEST_TIMEOUT")
+    limits = [s for s in (_seconds(headers.get("X-Request-Timeout")), _seconds(default)) if s]
+    return Deadline(min(limits)) if limits else None
@@ -1,10 +1,17 @@
 import mimetypes
+from urllib.parse import parse_qsl
 
 
 class Request:
-    def __init__(self, form=None, files=None):
+    def __init__(self, form=None, files=None, json=None, args=None, headers=None):
         self.form = form or {}
         self.files = files or {}
+        self.json = json
+        self.args = args or {}
+        self.headers = headers or {}
+
+    def get_json(self):
+        return self.json
 
 
 class File:
@@ -20,10 +27,11 @@ class File:
 
 
 class Response:
-    def __init__(self, data='', status=200, json=None):
+    def __init__(self, data='', status=200, json=None, headers=None):
         self.data = data
         self.status_code = status
         self._json = json
+        self.headers = dict(headers or {})
 
     def get_json(self):
         return self._json
@@ -66,8 +74,9 @@ class Flask:
             def __exit__(self, exc_type, exc, tb):
                 pass
 
-            def open(self, path, method='GET', data=None, content_type=None):
+            def open(self, path, method='GET', data=None, content_type=None, json=None, headers=None):
                 global request
+                path, _, query = path.partition('?')
                 form = {}
                 files = {}
                 if method == 'POST' and data:
@@ -78,6 +87,9 @@ class Flask:
                             form[k] = v
                 request.form = form
                 request.files = files
+                request.json = json
+                request.args = dict(parse_qsl(query))
+                request.headers = dict(headers or {})
                 view = app.routes.get((method, path))
                 if not view:
                     return Response(status=404)
@@ -85,22 +97,24 @@ class Flask:
                 if isinstance(rv, Response):
                     return rv
                 if isinstance(rv, tuple):
-                    data, status = rv
+                    data, status = rv[0], rv[1]
+                    headers = rv[2] if len(rv) > 2 else {}
                     if isinstance(data, Response):
                         data.status_code = status
+                        data.headers.update(headers)
                         return data
                     if isinstance(data, dict):
-                        return Response(json=data, status=status)
-                    return Response(data=str(data), status=status)
+                        return Response(json=data, status=status, headers=headers)
+                    return Response(data=str(data), status=status, headers=headers)
                 if isinstance(rv, dict):
                     return Response(json=rv, status=200)
                 return Response(data=str(rv), status=200)
 
-            def get(self, path):
-                return self.open(path, method='GET')
+            def get(self, path, headers=None):
+                return self.open(path, method='GET', headers=headers)
 
-            def post(self, path, data=None, content_type=None):
-                return self.open(path, method='POST', data=data, content_type=content_type)
+            def post(self, path, data=None, content_type=None, json=None, headers=None):
+                return self.open(path, method='POST', data=data, content_type=content_type, json=json, headers=headers)
 
         return Client()
 
@@ -0,0 +1,29 @@
+"""Monkey-patch the process for gevent before anything else is imported.
+
+gevent can only make ``socket``, ``threading`` and the libraries built on
+them cooperative if it patches them before they are first imported.
+``serve.py`` and ``loadtest.py`` therefore import this module first and call
+:func:`patch_if_requested` with their command line, ahead of their own
+imports.
+"""
+
+import os
+
+
+def wants_gevent(argv, env=os.environ) -> bool:
+    """Return True if ``argv`` or ``SERVER_WORKER_CLASS`` select the gevent worker class."""
+    for i, arg in enumerate(argv):
+        if arg == "--worker-class" and i + 1 < len(argv):
+            return argv[i + 1] == "gevent"
+        if arg.startswith("--worker-class="):
+            return arg.partition("=")[2] == "gevent"
+    return env.get("SERVER_WORKER_CLASS") == "gevent"
+
+
+def patch_if_requested(argv) -> bool:
+    """Monkey-patch for gevent if ``argv`` asks for it and return whether it did."""
+    if not wants_gevent(argv):
+        return False
+    from gevent import monkey
+    monkey.patch_all()
+    return True
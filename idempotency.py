@@ -0,0 +1,125 @@
+"""Replay the response of a repeated POST instead of doing its work again.
+
+Clients that time out and retry ``/upload``, ``/compose`` or ``/suggest``
+would otherwise pay for segmentation and the OpenAI calls twice. A request
+carrying an ``Idempotency-Key`` header is run once per key. A repeat with
+the same key and the same request fingerprint gets the stored response. If
+the first request is still running, the repeat waits for it and shares its
+response. Reusing a key for a different request raises
+:class:`KeyConflict`. Responses are kept for ``ttl`` seconds in a bounded,
+per-process :class:`IdempotencyStore`. Failures are not kept (an exception,
+or a ``5xx`` such as an overload or a deadline), so a retry after one runs
+again.
+"""
+
+import collections
+import os
+import threading
+import time
+from typing import Optional
+
+from metrics import Counter
+
+IDEMPOTENT_REQUESTS = Counter(
+    "wardrobe_idempotent_requests_total",
+    "Requests with an Idempotency-Key per route and outcome (executed, replayed, joined or conflict)",
+    ["route", "outcome"],
+)
+
+
+class KeyConflict(Exception):
+    """Raised when an idempotency key is reused for a different request."""
+
+
+class _Entry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+        self.created = time.monotonic()
+
+
+class IdempotencyStore:
+    """Run each keyed request once and remember its response.
+
+    Parameters
+    ----------
+    max_entries : int
+        Keys remembered at most; the oldest are forgotten first.
+    ttl : float
+        Seconds a response is replayed for.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _claim(self, key, fingerprint: str):
+        now = time.monotonic()
+        with self._lock:
+            while self._entries:
+                oldest = next(iter(self._entries.values()))
+                if now - oldest.created <= self.ttl:
+                    break
+                self._entries.popitem(last=False)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.fingerprint != fingerprint:
+                    raise KeyConflict(key)
+                return entry, False
+            entry = self._entries[key] = _Entry(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry, True
+
+    def _forget(self, key, entry: _Entry) -> None:
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def run(self, key, fingerprint: str, func, keep=lambda response: True,
+            timeout: Optional[float] = None):
+        """Return ``(response, outcome)`` for the request ``key``.
+
+        The first request with ``key`` calls ``func`` (outcome ``executed``)
+        and its response is stored if ``keep(response)`` is true. Later ones
+        with the same ``fingerprint`` get that response (``replayed``), or
+        wait up to ``timeout`` seconds for it while it is being produced
+        (``joined``). A waiter whose leader fails without a response runs
+        ``func`` itself. Raises :class:`KeyConflict` for a different
+        fingerprint and :class:`TimeoutError` when the wait runs out.
+        """
+        while True:
+            entry, leader = self._claim(key, fingerprint)
+            if leader:
+                break
+            waited = not entry.done.is_set()
+            if not entry.done.wait(timeout):
+                raise TimeoutError(f"request {key!r} still in progress")
+            if entry.response is not None:
+                return entry.response, "joined" if waited else "replayed"
+        try:
+            response = func()
+        except BaseException:
+            self._forget(key, entry)
+            entry.done.set()
+            raise
+        if keep(response):
+            entry.response = response
+        else:
+            self._forget(key, entry)
+        entry.done.set()
+        return response, "executed"
+
+
+def store_from_env() -> IdempotencyStore:
+    """Build the :class:`IdempotencyStore` configured through ``IDEMPOTENCY_*`` variables."""
+    return IdempotencyStore(
+        max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1024")),
+        ttl=float(os.getenv("IDEMPOTENCY_TTL", "3600")),
+    )
@@ -0,0 +1,213 @@
+"""Read an image's format, size and EXIF orientation from its header.
+
+PNG, GIF and WebP keep their size in the first few dozen bytes. JPEG keeps
+its frame header after any number of APP segments (EXIF, thumbnails, ICC
+profiles), which usually fit in the first :data:`PROBE_BYTES` as well. The
+JPEG walker jumps from segment to segment within that buffer. For longer
+headers it reads :data:`REFILL_BYTES` at the next segment. Segment bodies are
+never scanned byte by byte, and nothing is decoded.
+"""
+
+import struct
+from typing import NamedTuple, Optional
+
+#: Bytes read up front; covers every header but unusually long JPEG APP runs
+PROBE_BYTES = 64 * 1024
+
+#: Bytes read after jumping past the buffer, enough for the next segment headers
+REFILL_BYTES = 4 * 1024
+
+#: Bytes of an EXIF segment searched for the orientation; IFD0 comes first
+EXIF_BYTES = 4 * 1024
+
+#: Leading bytes :func:`sniff` needs to recognise every format
+SNIFF_BYTES = 12
+
+#: JPEG start-of-frame markers carrying the image size (not DHT 0xC4, JPG 0xC8 or DAC 0xCC)
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+#: Progressive start-of-frame markers
+_PROGRESSIVE_MARKERS = frozenset({0xC2, 0xC6, 0xCA, 0xCE})
+#: JPEG markers without a length field
+_STANDALONE_MARKERS = frozenset(range(0xD0, 0xDA)) | {0x01}
+#: EXIF orientations that swap width and height when applied
+_TRANSPOSED_ORIENTATIONS = frozenset({5, 6, 7, 8})
+
+
+class ImageInfo(NamedTuple):
+    """What :func:`probe` learned from a header.
+
+    ``format`` is ``"png"``, ``"jpeg"``, ``"webp"``, ``"gif"`` or ``None``
+    when the file isn't recognised, in which case the size is ``0 x 0``.
+    ``orientation`` is the EXIF orientation (1 is upright).
+    """
+
+    format: Optional[str]
+    width: int
+    height: int
+    orientation: int = 1
+    progressive: bool = False
+
+    @property
+    def display_size(self) -> tuple:
+        """Return ``(width, height)`` after applying the EXIF orientation."""
+        if self.orientation in _TRANSPOSED_ORIENTATIONS:
+            return self.height, self.width
+        return self.width, self.height
+
+
+UNKNOWN = ImageInfo(None, 0, 0)
+
+
+class _Window:
+    """Random access to a file object through one sliding buffer."""
+
+    def __init__(self, f, start: int, head: bytes):
+        self.f = f
+        self.start = start
+        self.offset = 0
+        self.data = head
+
+    def get(self, offset: int, size: int) -> bytes:
+        end = offset + size
+        if offset < self.offset or end > self.offset + len(self.data):
+            self.f.seek(self.start + offset)
+            self.data = self.f.read(max(size, REFILL_BYTES))
+            self.offset = offset
+        return self.data[offset - self.offset:end - self.offset]
+
+
+class _Buffer:
+    """The same interface over bytes or a memoryview."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def get(self, offset: int, size: int) -> bytes:
+        return bytes(self.data[offset:offset + size])
+
+
+def _exif_orientation(exif: bytes) -> int:
+    """Return the orientation tag of a TIFF-structured EXIF block, or 1."""
+    if exif[:2] == b"II":
+        order = "<"
+    elif exif[:2] == b"MM":
+        order = ">"
+    else:
+        return 1
+    try:
+        (ifd,) = struct.unpack_from(order + "I", exif, 4)
+        (count,) = struct.unpack_from(order + "H", exif, ifd)
+        for index in range(count):
+            entry = ifd + 2 + 12 * index
+            tag, kind = struct.unpack_from(order + "HH", exif, entry)
+            if tag == 0x0112 and kind == 3:
+                (value,) = struct.unpack_from(order + "H", exif, entry + 8)
+                return value if 1 <= value <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+
+def _probe_jpeg(source) -> ImageInfo:
+    orientation = 1
+    pos = 2
+    while True:
+        prefix = source.get(pos, 4)
+        if len(prefix) < 2 or prefix[0] != 0xFF:
+            return UNKNOWN
+        marker = prefix[1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in _STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if len(prefix) < 4 or marker in (0xD9, 0xDA):  # end of image or scan before any frame
+            return UNKNOWN
+        (length,) = struct.unpack(">H", prefix[2:4])
+        if marker in _SOF_MARKERS:
+            frame = source.get(pos + 5, 4)
+            if len(frame) < 4:
+                return UNKNOWN
+            height, width = struct.unpack(">HH", frame)
+            return ImageInfo("jpeg", width, height, orientation, marker in _PROGRESSIVE_MARKERS)
+        if marker == 0xE1 and orientation == 1:
+            segment = source.get(pos + 4, min(length - 2, EXIF_BYTES))
+            if segment[:6] == b"Exif\x00\x00":
+                orientation = _exif_orientation(segment[6:])
+        pos += 2 + length
+
+
+def _probe_webp(head: bytes) -> ImageInfo:
+    kind = head[12:16]
+    try:
+        if kind == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+            width, height = struct.unpack_from("<HH", head, 26)
+            return ImageInfo("webp", width & 0x3FFF, height & 0x3FFF)
+        if kind == b"VP8L" and head[20] == 0x2F:
+            (bits,) = struct.unpack_from("<I", head, 21)
+            return ImageInfo("webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        if kind == b"VP8X":
+            width = int.from_bytes(head[24:27], "little") + 1
+            height = int.from_bytes(head[27:30], "little") + 1
+            return ImageInfo("webp", width, height)
+    except (IndexError, struct.error):
+        pass
+    return UNKNOWN
+
+
+def sniff(head: bytes) -> Optional[str]:
+    """Return the format whose signature starts ``head``, or ``None``.
+
+    Only the first :data:`SNIFF_BYTES` are looked at, so this works on the
+    first chunk of an upload before the rest has arrived.
+    """
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if head[:2] == b"\xff\xd8":
+        return "jpeg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _probe(head: bytes, source) -> ImageInfo:
+    fmt = sniff(head)
+    if fmt == "png" and head[12:16] == b"IHDR" and len(head) >= 24:
+        width, height = struct.unpack_from(">II", head, 16)
+        return ImageInfo("png", width, height)
+    if fmt == "jpeg":
+        return _probe_jpeg(source)
+    if fmt == "gif" and len(head) >= 10:
+        width, height = struct.unpack_from("<HH", head, 6)
+        return ImageInfo("gif", width, height)
+    if fmt == "webp":
+        return _probe_webp(head)
+    return UNKNOWN
+
+
+def probe_bytes(data) -> ImageInfo:
+    """Probe an image held in ``data`` (bytes or memoryview)."""
+    return _probe(bytes(data[:32]), _Buffer(data))
+
+
+def probe_file(f) -> ImageInfo:
+    """Probe the binary file object ``f`` from its current position.
+
+    The position afterwards is unspecified; callers restore it themselves.
+    """
+    start = f.tell()
+    head = f.read(PROBE_BYTES)
+    return _probe(head[:32], _Window(f, start, head))
+
+
+def probe(path: str) -> ImageInfo:
+    """Probe the image file at ``path``."""
+    try:
+        # Unbuffered: the window is the only buffer, so typical files take one read
+        with open(path, "rb", buffering=0) as f:
+            return probe_file(f)
+    except OSError:
+        return UNKNOWN
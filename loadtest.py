@@ -0,0 +1,453 @@
+"""Load generator for the Wardrobe app.
+
+Drives the WSGI app over HTTP with a weighted mix of endpoints, synthetic
+images of configurable sizes and a fixed number of concurrent clients. It
+reports throughput, latency percentiles and error rates per endpoint.
+
+OpenAI is replaced by :class:`StandInOpenAI`, which answers like
+``openai_stub`` after an injected delay. This keeps the slow network wait in
+the picture without spending API credits. By default the app is imported
+and served in this process by :class:`serve.WorkerServer`. ``--url`` targets
+a server that is already running, typically one started with
+``python loadtest.py serve`` so its workers use the stand-in too::
+
+    python loadtest.py run --mix upload=6,analyze=3,suggest=1 --concurrency 16 --duration 30
+    python loadtest.py serve --chat-latency 1.5 -- --workers 4 --worker-class gevent
+    python loadtest.py run --url http://127.0.0.1:8000 --rate 20 --max-p99-ms 8000
+
+With ``--rate`` requests are sent on a fixed schedule (open loop) and latency
+is measured from the scheduled send time, so a saturated server shows up as
+growing latency rather than as a quietly lower request rate.
+"""
+
+import sys
+
+import gevent_patch
+
+if __name__ == "__main__" and sys.argv[1:2] == ["serve"]:
+    # Before socket, threading and the app are imported; see serve.py
+    gevent_patch.patch_if_requested(sys.argv[2:])
+
+import argparse
+import itertools
+import json
+import logging
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from typing import Dict, List, Optional
+
+import openai_stub
+
+logger = logging.getLogger(__name__)
+
+#: Endpoints the generator knows how to call
+ENDPOINTS = ("upload", "analyze", "parse", "suggest", "compose", "refine")
+
+DEFAULT_MIX = "upload=6,analyze=2,suggest=1,refine=1"
+
+
+class StandInOpenAI:
+    """Replacement for the ``openai`` module that injects latency and errors.
+
+    Parameters
+    ----------
+    chat_latency, image_latency : float
+        Mean seconds a chat completion or image generation takes.
+    jitter : float
+        Relative spread of the latency; each call waits
+        ``latency * uniform(1 - jitter, 1 + jitter)``.
+    error_rate : float
+        Fraction of calls that raise ``error.OpenAIError`` after waiting.
+        Calls given a ``request_timeout`` shorter than their latency raise
+        ``error.Timeout`` once it has passed.
+    error : module attribute
+        The ``error`` namespace of the module being replaced, so the app's
+        ``except openai.error.OpenAIError`` clauses still match.
+    """
+
+    def __init__(self, chat_latency=0.8, image_latency=3.0, jitter=0.25, error_rate=0.0,
+                 error=openai_stub.error, seed=None):
+        self.chat_latency = chat_latency
+        self.image_latency = image_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error = error
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.api_key = "stand-in"
+        self.ChatCompletion = self._api(chat_latency, openai_stub.ChatCompletion.create)
+        self.Image = self._api(image_latency, openai_stub.Image.create)
+
+    def _api(self, latency, respond):
+        standin = self
+
+        class _API:
+            @staticmethod
+            def create(**kwargs):
+                standin._wait(latency, kwargs.get("request_timeout"))
+                return respond(**kwargs)
+        return _API
+
+    def _wait(self, latency, timeout=None):
+        with self._lock:
+            delay = latency * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            fail = self._random.random() < self.error_rate
+        if timeout is not None and delay > timeout:
+            time.sleep(max(0.0, timeout))
+            raise getattr(self.error, "Timeout", self.error.OpenAIError)("Request timed out")
+        time.sleep(max(0.0, delay))
+        if fail:
+            raise self.error.OpenAIError("Injected stand-in failure")
+
+    @classmethod
+    def install(cls, app_module, **kwargs) -> "StandInOpenAI":
+        """Replace ``app_module.openai`` with a stand-in and return it."""
+        standin = cls(error=app_module.openai.error, **kwargs)
+        app_module.openai = standin
+        return standin
+
+
+# -- Requests ----------------------------------------------------------------
+
+def encode_multipart(fields=(), files=()):
+    """Return ``(body, content_type)`` for form ``fields`` and ``files``.
+
+    ``files`` holds ``(field, filename, data)`` tuples.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, filename, data in files:
+        content_type = "image/png" if filename.endswith(".png") else "image/jpeg"
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def parse_sizes(text: str):
+    """Parse ``"640x480,1920x1080"`` into ``[(640, 480), (1920, 1080)]``."""
+    sizes = []
+    for item in text.split(","):
+        width, _, height = item.strip().lower().partition("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parse ``"upload=6,suggest=1"`` into endpoint weights."""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class RequestFactory:
+    """Build request bodies for each endpoint from synthetic images."""
+
+    def __init__(self, sizes, formats=("jpeg", "png"), items_per_upload=2, seed=None):
+        from tests.bench import extension, image_bytes
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.images = [
+            (f"synthetic_{w}x{h}{extension(fmt)}", image_bytes(fmt, w, h))
+            for w, h in sizes for fmt in formats
+        ]
+        self.items_per_upload = items_per_upload
+
+    def _pick(self, n=1):
+        with self._lock:
+            return [self._random.choice(self.images) for _ in range(n)]
+
+    def build(self, endpoint: str):
+        """Return ``(path, body, content_type)`` for one request."""
+        if endpoint == "upload":
+            body_image, *items = self._pick(1 + self.items_per_upload)
+            files = [("full_body_image",) + body_image]
+            files += [("clothing_item_images",) + item for item in items]
+            return ("/upload",) + encode_multipart(files=files)
+        if endpoint in ("analyze", "parse"):
+            return (f"/{endpoint}",) + encode_multipart(files=[("image",) + self._pick()[0]])
+        if endpoint == "compose":
+            body_image, item = self._pick(2)
+            return ("/compose",) + encode_multipart(files=[("body",) + body_image, ("clothes",) + item])
+        if endpoint == "suggest":
+            return ("/suggest",) + encode_multipart(fields=[("description", "smart casual dinner")])
+        if endpoint == "refine":
+            payload = {
+                "original_suggestion": "Blue shirt with black pants",
+                "available_clothing_items": [{"category": "shirt", "color": "blue"},
+                                             {"category": "pants", "color": "black"}],
+                "user_query": "Something warmer",
+            }
+            return "/refine_outfit_suggestion", json.dumps(payload).encode(), "application/json"
+        raise ValueError(endpoint)
+
+
+# -- Statistics --------------------------------------------------------------
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-pct * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Stats:
+    """Thread-safe collection of per-endpoint latencies and outcomes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+
+    def record(self, endpoint: str, latency: float, status) -> None:
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            codes = self.statuses.setdefault(endpoint, {})
+            codes[str(status)] = codes.get(str(status), 0) + 1
+            if not (isinstance(status, int) and 200 <= status < 400):
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Dict]:
+        """Return throughput, percentiles (ms) and error rate per endpoint and in total."""
+        with self._lock:
+            groups = dict(self.latencies)
+            groups["total"] = list(itertools.chain.from_iterable(self.latencies.values()))
+            errors = dict(self.errors, total=sum(self.errors.values()))
+            statuses = dict(self.statuses)
+        report = {}
+        for endpoint, values in groups.items():
+            values = sorted(values)
+            count = len(values)
+            report[endpoint] = {
+                "requests": count,
+                "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+                "error_rate": round(errors.get(endpoint, 0) / count, 4) if count else 0.0,
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p90_ms": round(percentile(values, 90) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+            }
+            if endpoint in statuses:
+                report[endpoint]["statuses"] = statuses[endpoint]
+        return report
+
+
+def format_report(report: Dict[str, Dict]) -> str:
+    columns = ("requests", "throughput_rps", "error_rate", "p50_ms", "p90_ms", "p99_ms", "max_ms")
+    lines = [f"{'endpoint':<10}" + "".join(f"{c:>15}" for c in columns)]
+    for endpoint in sorted(report, key=lambda e: (e == "total", e)):
+        lines.append(f"{endpoint:<10}" + "".join(f"{report[endpoint][c]:>15}" for c in columns))
+    return "\n".join(lines)
+
+
+# -- Driver ------------------------------------------------------------------
+
+def send(base_url: str, path: str, body: bytes, content_type: str, timeout: float):
+    """POST ``body`` and return the status code, or the exception class name."""
+    req = urllib.request.Request(base_url + path, data=body, headers={"Content-Type": content_type})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+    except (urllib.error.URLError, OSError) as e:
+        return type(getattr(e, "reason", e)).__name__
+
+
+def run_load(base_url: str, mix: Dict[str, float], factory: RequestFactory, concurrency: int = 8,
+             duration: float = 10.0, requests: Optional[int] = None, rate: Optional[float] = None,
+             timeout: float = 60.0, seed=None):
+    """Drive ``base_url`` and return ``(stats, elapsed_seconds)``.
+
+    Stops after ``duration`` seconds or ``requests`` requests, whichever
+    comes first.
+    """
+    stats = Stats()
+    chooser = random.Random(seed)
+    endpoints, weights = zip(*mix.items())
+    counter = itertools.count()
+    lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def next_request():
+        with lock:
+            index = next(counter)
+            if requests is not None and index >= requests:
+                return None
+            endpoint = chooser.choices(endpoints, weights)[0]
+        scheduled = start + index / rate if rate else None
+        if scheduled is not None and scheduled >= deadline:
+            return None
+        return endpoint, scheduled
+
+    def client():
+        while time.perf_counter() < deadline:
+            item = next_request()
+            if item is None:
+                return
+            endpoint, scheduled = item
+            path, body, content_type = factory.build(endpoint)
+            if scheduled is not None:
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+            sent = time.perf_counter()
+            status = send(base_url, path, body, content_type, timeout)
+            stats.record(endpoint, time.perf_counter() - (scheduled or sent), status)
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats, time.perf_counter() - start
+
+
+def start_local_server(threads: int, standin_options: Dict):
+    """Import the app with the stand-in and serve it on an ephemeral port.
+
+    Returns ``(base_url, server)``.
+    """
+    import app as app_module
+    import serve
+
+    if not callable(app_module.app):
+        raise RuntimeError("Flask is not installed; the app is only available as the test stub")
+    StandInOpenAI.install(app_module, **standin_options)
+    # Failures are counted in the report; their tracebacks would drown it
+    logging.getLogger(app_module.__name__).setLevel(logging.CRITICAL)
+    sock = socket.create_server(("127.0.0.1", 0))
+    sock.setblocking(False)
+    server = serve.WorkerServer(sock, app_module.app, threads=threads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = sock.getsockname()[:2]
+    return f"http://{host}:{port}", server
+
+
+# -- Command line ------------------------------------------------------------
+
+def _add_standin_arguments(parser) -> None:
+    group = parser.add_argument_group("OpenAI stand-in")
+    group.add_argument("--chat-latency", type=float, default=0.8, help="Mean chat completion seconds")
+    group.add_argument("--image-latency", type=float, default=3.0, help="Mean image generation seconds")
+    group.add_argument("--latency-jitter", type=float, default=0.25, help="Relative latency spread")
+    group.add_argument("--openai-error-rate", type=float, default=0.0, help="Fraction of failing calls")
+
+
+def _standin_options(args) -> Dict:
+    return {
+        "chat_latency": args.chat_latency,
+        "image_latency": args.image_latency,
+        "jitter": args.latency_jitter,
+        "error_rate": args.openai_error_rate,
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Load test the Wardrobe app")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Generate load and report latency per endpoint")
+    run.add_argument("--url", help="Target a running server instead of serving the app in-process")
+    run.add_argument("--mix", default=DEFAULT_MIX, help=f"Endpoint weights (default {DEFAULT_MIX})")
+    run.add_argument("--sizes", default="640x480,1600x1200", help="Image sizes, e.g. 640x480,1920x1080")
+    run.add_argument("--formats", default="jpeg,png", help="Comma separated png, jpeg, jpeg_progressive")
+    run.add_argument("--items", type=int, default=2, help="Clothing images per /upload request")
+    run.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    run.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    run.add_argument("--requests", type=int, help="Stop after this many requests")
+    run.add_argument("--rate", type=float, help="Open-loop request rate per second")
+    run.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    run.add_argument("--threads", type=int, default=16, help="Server threads for the in-process app")
+    run.add_argument("--seed", type=int, help="Seed for the endpoint and image choice")
+    run.add_argument("--json", dest="json_path", help="Also write the report to this file")
+    run.add_argument("--max-p99-ms", type=float, help="Exit 1 when the overall p99 exceeds this")
+    run.add_argument("--max-error-rate", type=float, help="Exit 1 when the overall error rate exceeds this")
+    _add_standin_arguments(run)
+
+    serve_cmd = commands.add_parser("serve", help="Run serve.py with the OpenAI stand-in")
+    _add_standin_arguments(serve_cmd)
+    serve_cmd.add_argument("serve_args", nargs=argparse.REMAINDER, help="Arguments for serve.py after --")
+    return parser
+
+
+def _serve(args) -> int:
+    import serve
+
+    serve_args = [a for a in args.serve_args if a != "--"]
+    if serve.build_parser().parse_args(serve_args).worker_class == "gevent":
+        from gevent import monkey
+        if not monkey.is_module_patched("socket"):
+            # Not started from the command line; serve.main would patch too late
+            # once the app is imported below
+            monkey.patch_all()
+    import app as app_module
+
+    StandInOpenAI.install(app_module, **_standin_options(args))
+    return serve.main(serve_args)
+
+
+def _run(args) -> int:
+    logging.basicConfig(level=logging.WARNING)
+    factory = RequestFactory(
+        parse_sizes(args.sizes), formats=args.formats.split(","), items_per_upload=args.items, seed=args.seed
+    )
+    server = None
+    base_url = args.url.rstrip("/") if args.url else None
+    if base_url is None:
+        base_url, server = start_local_server(args.threads, _standin_options(args))
+    try:
+        stats, elapsed = run_load(
+            base_url, parse_mix(args.mix), factory, concurrency=args.concurrency, duration=args.duration,
+            requests=args.requests, rate=args.rate, timeout=args.timeout, seed=args.seed,
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    report = stats.summary(elapsed)
+    print(format_report(report))
+    if args.json_path:
+        config = {k: v for k, v in vars(args).items() if k not in {"command", "json_path"}}
+        with open(args.json_path, "w") as f:
+            json.dump({"config": config, "elapsed_s": round(elapsed, 3), "endpoints": report}, f, indent=2)
+
+    total = report.get("total", {})
+    failed = False
+    if args.max_p99_ms is not None and total.get("p99_ms", 0) > args.max_p99_ms:
+        print(f"p99 {total['p99_ms']} ms exceeds {args.max_p99_ms} ms", file=sys.stderr)
+        failed = True
+    if args.max_error_rate is not None and total.get("error_rate", 0) > args.max_error_rate:
+        print(f"error rate {total['error_rate']} exceeds {args.max_error_rate}", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "serve":
+        return _serve(args)
+    return _run(args)
+
+
+if __name__ == "__main__":  # pragma: no cover - manual invocation
+    sys.exit(main())
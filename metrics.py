@@ -0,0 +1,424 @@
+"""Minimal Prometheus metrics for the Wardrobe app.
+
+Provides counters, gauges and histograms rendered in the Prometheus text
+exposition format, plus helpers that time whole routes and the stages inside
+them. The current route is tracked in a context variable, so :func:`stage`
+can be used anywhere in a request, including inside
+:class:`clothseg.ClothSegmenter`.
+
+Each process keeps its own values. When ``METRICS_DIR`` is set (for example
+with the preforking server in ``serve.py``), every process periodically writes
+a snapshot there and ``/metrics`` merges the snapshots of all workers.
+Counters and histograms of workers that have exited are folded into an
+archive so recycled workers don't lose history.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+#: Histogram buckets in seconds, stretched to cover slow OpenAI calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+#: Content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, object] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _snapshot(self) -> Dict:
+        with self._lock:
+            values = [[list(k), v if not isinstance(v, list) else [list(v[0]), v[1], v[2]]]
+                      for k, v in self._values.items()]
+        return {"type": self.type, "help": self.documentation,
+                "labelnames": list(self.labelnames), "values": values}
+
+
+class Counter(_Metric):
+    """Monotonically increasing value."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    type = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self) -> Dict:
+        data = super()._snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+def _merge(target: Dict, snapshot: Dict, include_gauges: bool = True) -> None:
+    """Add the values of ``snapshot`` into ``target`` in place."""
+    for name, metric in snapshot.items():
+        if metric["type"] == "gauge" and not include_gauges:
+            continue
+        merged = target.setdefault(name, {k: v for k, v in metric.items() if k != "values"})
+        values = {tuple(k): v for k, v in merged.get("values", [])}
+        for key, value in metric["values"]:
+            key = tuple(key)
+            if metric["type"] == "histogram":
+                current = values.get(key)
+                if current is None:
+                    values[key] = [list(value[0]), value[1], value[2]]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+            else:
+                values[key] = values.get(key, 0.0) + value
+        merged["values"] = [[list(k), v] for k, v in values.items()]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # pragma: no cover - pid reused by another user
+        return True
+    return True
+
+
+class Registry:
+    """Collection of metrics rendered together.
+
+    Parameters
+    ----------
+    directory : str | None
+        Shared snapshot directory for multi-process servers.
+    interval : float
+        Seconds between snapshot writes.
+    """
+
+    def __init__(self, directory: Optional[str] = None, interval: float = 5.0):
+        self.directory = directory
+        self.interval = interval
+        self._metrics: Dict[str, _Metric] = {}
+        self._writer_pid = None
+
+    def register(self, metric: _Metric) -> None:
+        # Re-importing a module re-registers its metrics; the newest wins
+        self._metrics[metric.name] = metric
+
+    def snapshot(self) -> Dict:
+        return {name: metric._snapshot() for name, metric in self._metrics.items()}
+
+    # -- multi-process support -------------------------------------------
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def write_snapshot(self) -> None:
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(os.getpid())
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def ensure_writer(self) -> None:
+        """Start the snapshot writer thread once per process."""
+        if not self.directory or self._writer_pid == os.getpid():
+            return
+        self._writer_pid = os.getpid()
+
+        def write_forever():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.write_snapshot()
+                except OSError:  # pragma: no cover - best effort
+                    pass
+
+        threading.Thread(target=write_forever, name="metrics-writer", daemon=True).start()
+
+    def _compact_dead(self) -> None:
+        """Fold snapshots of exited processes into ``archive.json``."""
+        archive = os.path.join(self.directory, "archive.json")
+        lock_path = os.path.join(self.directory, ".lock")
+        with open(lock_path, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                merged = {}
+                if os.path.exists(archive):
+                    with open(archive) as f:
+                        merged = json.load(f)
+                dead = []
+                for name in os.listdir(self.directory):
+                    if not (name.startswith("metrics-") and name.endswith(".json")):
+                        continue
+                    pid = int(name[len("metrics-"):-len(".json")])
+                    if _pid_alive(pid):
+                        continue
+                    with open(os.path.join(self.directory, name)) as f:
+                        _merge(merged, json.load(f), include_gauges=False)
+                    dead.append(name)
+                if dead:
+                    with open(archive + ".tmp", "w") as f:
+                        json.dump(merged, f)
+                    os.replace(archive + ".tmp", archive)
+                    for name in dead:
+                        os.remove(os.path.join(self.directory, name))
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def collect(self) -> Dict:
+        """Return the merged snapshot of every process sharing the directory."""
+        if not self.directory:
+            return self.snapshot()
+        self.write_snapshot()
+        self._compact_dead()
+        merged: Dict = {}
+        for name in sorted(os.listdir(self.directory)):
+            if name == "archive.json" or (name.startswith("metrics-") and name.endswith(".json")):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        _merge(merged, json.load(f))
+                except (OSError, ValueError):  # pragma: no cover - file vanished mid-read
+                    continue
+        return merged
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            labelnames = metric["labelnames"]
+            for key, value in sorted(metric["values"], key=lambda kv: kv[0]):
+                if metric["type"] == "histogram":
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(list(metric["buckets"]) + [float("inf")], counts):
+                        cumulative += bucket_count
+                        le = 'le="' + _format_value(bound) + '"'
+                        lines.append(f"{name}_bucket{_format_labels(labelnames, key, le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(labelnames, key)} {count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry(os.getenv("METRICS_DIR"))
+
+REQUEST_DURATION = Histogram(
+    "wardrobe_request_duration_seconds", "Total request latency per route", ["route"]
+)
+REQUESTS_TOTAL = Counter(
+    "wardrobe_requests_total", "Requests handled per route and status code", ["route", "status"]
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "wardrobe_requests_in_flight", "Requests currently being handled per route", ["route"]
+)
+STAGE_DURATION = Histogram(
+    "wardrobe_stage_duration_seconds", "Latency of the stages inside each route", ["route", "stage"]
+)
+
+
+class RequestTimings:
+    """Per-request record of the route, the time spent in each stage and the
+    segmentation tiers used."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.stages: Dict[str, float] = {}
+        self.tiers: List[str] = []
+
+
+_current_request: contextvars.ContextVar = contextvars.ContextVar("wardrobe_request", default=None)
+
+
+def current_request() -> Optional[RequestTimings]:
+    """Return the :class:`RequestTimings` of the request being handled."""
+    return _current_request.get()
+
+
+def current_route() -> str:
+    timings = _current_request.get()
+    return timings.route if timings is not None else "-"
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a stage of the current request.
+
+    Works as a context manager or a decorator. Outside of a request the
+    stage is recorded under the route ``"-"``.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _current_request.get()
+        STAGE_DURATION.observe(elapsed, route=timings.route if timings else "-", stage=name)
+        if timings is not None:
+            timings.stages[name] = timings.stages.get(name, 0.0) + elapsed
+
+
+#: Stages reported per request, mapped to their ``Server-Timing`` names.
+#: Durations overlap: ``segment`` and ``classify`` include their ``decode``.
+SERVER_TIMING_STAGES = {
+    "queue": "queue",
+    "decode": "decode",
+    "parse": "segment",
+    "classify": "classify",
+    "llm": "llm",
+    "image": "image",
+}
+
+
+def timing_breakdown(timings: Optional[RequestTimings], total: Optional[float] = None) -> Dict[str, float]:
+    """Return the reported stage durations of ``timings`` in milliseconds.
+
+    Stages that did not run in the request are left out. ``total`` (in
+    seconds) is added as a ``total`` entry when given.
+    """
+    breakdown = {}
+    stages = timings.stages if timings is not None else {}
+    for stage_name, name in SERVER_TIMING_STAGES.items():
+        if stage_name in stages:
+            breakdown[name] = round(stages[stage_name] * 1000, 1)
+    if total is not None:
+        breakdown["total"] = round(total * 1000, 1)
+    return breakdown
+
+
+def format_server_timing(breakdown: Dict[str, float]) -> str:
+    """Format a :func:`timing_breakdown` as a ``Server-Timing`` header value."""
+    return ", ".join(f"{name};dur={ms}" for name, ms in breakdown.items())
+
+
+def _status_of(rv) -> int:
+    if isinstance(rv, tuple) and len(rv) > 1 and isinstance(rv[1], int):
+        return rv[1]
+    return getattr(rv, "status_code", 200)
+
+
+def instrument_route(route: str):
+    """Decorate a view to record its latency, status and in-flight count."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            REGISTRY.ensure_writer()
+            token = _current_request.set(RequestTimings(route))
+            REQUESTS_IN_FLIGHT.inc(route=route)
+            start = time.perf_counter()
+            status = 500
+            try:
+                rv = view(*args, **kwargs)
+                status = _status_of(rv)
+                return rv
+            finally:
+                REQUEST_DURATION.observe(time.perf_counter() - start, route=route)
+                REQUESTS_TOTAL.inc(route=route, status=str(status))
+                REQUESTS_IN_FLIGHT.dec(route=route)
+                _current_request.reset(token)
+        return wrapper
+    return decorator
@@ -1,3 +1,24 @@
+class OpenAIObject(dict):
+    """Dictionary that also allows attribute access, like the real client's responses."""
+
+    def __init__(self, data=None):
+        super().__init__({k: _wrap(v) for k, v in (data or {}).items()})
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+def _wrap(value):
+    if isinstance(value, dict):
+        return OpenAIObject(value)
+    if isinstance(value, list):
+        return [_wrap(v) for v in value]
+    return value
+
+
 class ChatCompletion:
     """Simplified stand-in for ``openai.ChatCompletion``.
 
@@ -6,30 +27,36 @@ class ChatCompletion:
     """
 
     @staticmethod
-    def create(*, messages, model="gpt-3.5-turbo"):
-        """Return a deterministic response based on the last user message."""
+    def create(*, messages, model="gpt-3.5-turbo", request_timeout=None):
+        """Return a deterministic response based on the last user message.
+
+        ``request_timeout`` is accepted like the real client's and ignored.
+        """
 
         if not messages or "content" not in messages[-1] or not messages[-1]["content"]:
             raise error.OpenAIError("Invalid messages")
 
         content = messages[-1]["content"]
         suggestion = f"AI suggestion based on {content}"
-        return {"choices": [{"message": {"content": suggestion}}]}
+        return OpenAIObject({"choices": [{"message": {"content": suggestion}}]})
 
 class Image:
     """Simplified stand-in for ``openai.Image`` that validates input."""
 
     @staticmethod
-    def create(*, prompt, n=1, size="512x512"):
+    def create(*, prompt, n=1, size="512x512", request_timeout=None):
         if not prompt:
             raise error.OpenAIError("Prompt required")
 
         url = f"https://example.com/{prompt.replace(' ', '_')}.png"
-        return {"data": [{"url": url}]}
+        return OpenAIObject({"data": [{"url": url}]})
 
 class error:
     class OpenAIError(Exception):
         """Exception raised for OpenAI API errors in the stub."""
         pass
 
+    class Timeout(OpenAIError):
+        """Raised when a call takes longer than its ``request_timeout``."""
+
 api_key = None
@@ -0,0 +1,155 @@
+"""Local outfit candidate engine.
+
+Pairs the ``(category, color)`` attributes produced by
+:meth:`clothseg.ClothSegmenter.classify` using simple category compatibility
+and colour harmony rules. Every pair of items is scored at once with NumPy
+when it is installed so even large wardrobes are ranked in milliseconds; only
+the best few candidates need to be handed to the language model.
+"""
+
+from itertools import combinations
+from typing import Dict, List
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+#: Categories known to :meth:`ClothSegmenter.classify`; anything else is "unknown"
+CATEGORIES = ["shirt", "pants", "dress", "unknown"]
+
+#: Colours known to :meth:`ClothSegmenter.classify`; anything else is "unknown"
+COLORS = ["white", "black", "gray", "red", "orange", "yellow", "green", "blue", "purple", "unknown"]
+
+NEUTRALS = {"white", "black", "gray"}
+
+#: Approximate hue angle of each chromatic colour name
+HUES = {"red": 0, "orange": 30, "yellow": 60, "green": 120, "blue": 220, "purple": 280}
+
+#: How well two categories combine into an outfit (0 means never)
+CATEGORY_COMPATIBILITY = {
+    ("shirt", "pants"): 1.0,
+    ("shirt", "unknown"): 0.5,
+    ("pants", "unknown"): 0.5,
+    ("dress", "unknown"): 0.3,
+    ("unknown", "unknown"): 0.3,
+}
+
+#: Score of a dress worn on its own before colour is taken into account
+SINGLE_DRESS_SCORE = 0.9
+
+
+def color_harmony(a: str, b: str) -> float:
+    """Return a ``0..1`` harmony score for two colour names."""
+    if a == "unknown" or b == "unknown":
+        return 0.5
+    if a in NEUTRALS and b in NEUTRALS:
+        return 0.8
+    if a in NEUTRALS or b in NEUTRALS:
+        return 0.9
+    if a == b:
+        return 0.6  # monochrome
+    diff = abs(HUES[a] - HUES[b]) % 360
+    diff = min(diff, 360 - diff)
+    if diff >= 150:
+        return 0.85  # complementary
+    if diff <= 60:
+        return 0.7  # analogous
+    if 100 <= diff <= 140:
+        return 0.65  # triadic
+    return 0.3
+
+
+def _category_score(a: str, b: str) -> float:
+    return CATEGORY_COMPATIBILITY.get((a, b), CATEGORY_COMPATIBILITY.get((b, a), 0.0))
+
+
+_CATEGORY_MATRIX = [[_category_score(a, b) for b in CATEGORIES] for a in CATEGORIES]
+_COLOR_MATRIX = [[color_harmony(a, b) for b in COLORS] for a in COLORS]
+if np is not None:
+    _CATEGORY_ARRAY = np.array(_CATEGORY_MATRIX, dtype=np.float32)
+    _COLOR_ARRAY = np.array(_COLOR_MATRIX, dtype=np.float32)
+
+
+def _index(values: List[str], value) -> int:
+    value = (value or "unknown").lower()
+    return values.index(value) if value in values else len(values) - 1
+
+
+def _encode(items: List[Dict[str, str]]):
+    cats = [_index(CATEGORIES, item.get("category")) for item in items]
+    cols = [_index(COLORS, item.get("color")) for item in items]
+    return cats, cols
+
+
+def _pair_score(category: float, color: float) -> float:
+    # Colour can only lift a compatible pair, never rescue an incompatible one
+    return category * (0.5 + 0.5 * color)
+
+
+def _rank_numpy(cats, cols, limit):
+    cats = np.asarray(cats, dtype=np.intp)
+    cols = np.asarray(cols, dtype=np.intp)
+    first, second = np.triu_indices(len(cats), k=1)
+    scores = _pair_score(
+        _CATEGORY_ARRAY[cats[first], cats[second]],
+        _COLOR_ARRAY[cols[first], cols[second]],
+    )
+    dresses = np.flatnonzero(cats == CATEGORIES.index("dress"))
+    dress_scores = np.full(len(dresses), SINGLE_DRESS_SCORE, dtype=np.float32)
+
+    all_scores = np.concatenate([scores, dress_scores])
+    valid = np.flatnonzero(all_scores > 0)
+    if not len(valid):
+        return []
+    if len(valid) > limit:
+        top = np.argpartition(-all_scores[valid], limit - 1)[:limit]
+        valid = valid[top]
+    order = valid[np.argsort(-all_scores[valid], kind="stable")]
+
+    candidates = []
+    n_pairs = len(scores)
+    for idx in order.tolist():
+        if idx < n_pairs:
+            members = [int(first[idx]), int(second[idx])]
+        else:
+            members = [int(dresses[idx - n_pairs])]
+        candidates.append({"items": members, "score": round(float(all_scores[idx]), 4)})
+    return candidates
+
+
+def _rank_python(cats, cols, limit):
+    scored = []
+    for i, j in combinations(range(len(cats)), 2):
+        score = _pair_score(_CATEGORY_MATRIX[cats[i]][cats[j]], _COLOR_MATRIX[cols[i]][cols[j]])
+        if score > 0:
+            scored.append((score, [i, j]))
+    dress = CATEGORIES.index("dress")
+    scored.extend((SINGLE_DRESS_SCORE, [i]) for i, c in enumerate(cats) if c == dress)
+    scored.sort(key=lambda s: -s[0])
+    return [{"items": members, "score": round(score, 4)} for score, members in scored[:limit]]
+
+
+def rank_outfits(items: List[Dict[str, str]], limit: int = 3) -> List[Dict]:
+    """Return the ``limit`` best outfit candidates for ``items``.
+
+    Parameters
+    ----------
+    items : list of dict
+        Attribute dictionaries with ``category`` and ``color`` keys.
+    limit : int
+        Maximum number of candidates to return.
+
+    Returns
+    -------
+    list of dict
+        Candidates ordered best first. Each has ``items`` (indexes into
+        ``items``) and a ``score`` between 0 and 1.
+    """
+    if not items or limit <= 0:
+        return []
+    cats, cols = _encode(items)
+    if np is not None:
+        return _rank_numpy(cats, cols, limit)
+    return _rank_python(cats, cols, limit)
@@ -0,0 +1,275 @@
+"""On-demand profiling of individual requests.
+
+A request that carries the profiling token in an ``X-Profile`` header is run
+under a profiler and the result is written to ``PROFILE_DIR``. Two formats
+are supported:
+
+``collapsed``
+    A sampling profiler walks the stacks of the request thread, and of any
+    thread running its segmentation on :data:`app.cpu_executor`, every few
+    milliseconds. Stacks are written one per line as ``frame;frame;... count``
+    so they can be fed straight to ``flamegraph.pl`` or speedscope.
+``pstats``
+    A :mod:`cProfile` dump of the request thread, for ``python -m pstats``.
+
+Under gevent (``serve.py --worker-class gevent``) requests run on greenlets,
+which ``sys._current_frames()`` can't see, so :func:`resolve_format` picks
+``pstats`` instead of ``collapsed``.
+
+Profiles are rate limited per process so the token can't be used to slow the
+server down, and only the newest ``PROFILE_KEEP`` files are kept.
+"""
+
+import collections
+import contextvars
+import cProfile
+import functools
+import hmac
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+FORMATS = ("collapsed", "pstats")
+
+#: Modules whose frames are counted towards the ``focus`` share of a profile
+FOCUS_MODULES = ("clothseg",)
+
+_active_profile: contextvars.ContextVar = contextvars.ContextVar("wardrobe_profile", default=None)
+
+
+def greenlets_patched() -> bool:
+    """Return True if gevent has monkey-patched ``threading`` in this process."""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def resolve_format(requested: Optional[str]) -> str:
+    """Return the format a profile asked for as ``requested`` is written in.
+
+    Unknown formats get ``collapsed``, which falls back to ``pstats`` when
+    requests run on greenlets.
+    """
+    fmt = requested if requested in FORMATS else "collapsed"
+    if fmt == "collapsed" and greenlets_patched():
+        return "pstats"
+    return fmt
+
+
+def _frame_label(frame) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    code = frame.f_code
+    # co_qualname is new in Python 3.11
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class SamplingProfiler:
+    """Sample the stacks of registered threads at a fixed interval.
+
+    Parameters
+    ----------
+    interval : float
+        Seconds between samples.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self._roots: Dict[int, object] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, root_frame) -> None:
+        """Sample the calling thread; frames above ``root_frame`` are dropped."""
+        with self._lock:
+            self._roots[threading.get_ident()] = root_frame
+
+    def remove_thread(self) -> None:
+        with self._lock:
+            self._roots.pop(threading.get_ident(), None)
+
+    def start(self) -> None:
+        self.add_thread(sys._getframe(1))
+        self._thread = threading.Thread(target=self._run, name="wardrobe-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        """Record the current stack of every registered thread once."""
+        frames = sys._current_frames()
+        with self._lock:
+            roots = list(self._roots.items())
+        for ident, root in roots:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None and frame is not root:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def focus_share(self) -> float:
+        """Return the fraction of samples spent in :data:`FOCUS_MODULES`."""
+        if not self.samples:
+            return 0.0
+        hits = sum(
+            count for stack, count in self.stacks.items()
+            if any(f"{module}:" in stack for module in FOCUS_MODULES)
+        )
+        return hits / self.samples
+
+
+def track_thread(func):
+    """Return ``func`` wrapped so the active profile also samples its thread.
+
+    Used for work handed to another thread during a profiled request. When
+    no profile is active ``func`` is returned unchanged.
+    """
+    profiler = _active_profile.get()
+    if not isinstance(profiler, SamplingProfiler):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler.add_thread(sys._getframe())
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.remove_thread()
+    return wrapper
+
+
+class RateLimiter:
+    """Allow at most ``limit`` events per ``window`` seconds."""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._events and now - self._events[0] >= self.window:
+                self._events.popleft()
+            if len(self._events) >= self.limit:
+                return False
+            self._events.append(now)
+            return True
+
+
+class ProfileStore:
+    """Authorise, run and store request profiles.
+
+    Parameters
+    ----------
+    directory : str
+        Where profiles are written.
+    token : str | None
+        Secret that enables profiling. ``None`` disables it.
+    limit, window : int, float
+        At most ``limit`` profiles per ``window`` seconds in this process.
+    keep : int
+        Number of newest profiles kept on disk.
+    interval : float
+        Sampling interval of the ``collapsed`` format in seconds.
+    """
+
+    def __init__(self, directory: str, token: Optional[str] = None, limit: int = 5,
+                 window: float = 300.0, keep: int = 50, interval: float = 0.005):
+        self.directory = directory
+        self.token = token
+        self.keep = keep
+        self.interval = interval
+        self.limiter = RateLimiter(limit, window)
+
+    def check(self, supplied: Optional[str]) -> str:
+        """Return ``"ok"``, ``"denied"`` or ``"rate_limited"`` for a request token."""
+        if not self.token or not supplied or not hmac.compare_digest(
+                supplied.encode(), self.token.encode()):
+            return "denied"
+        if not self.limiter.allow():
+            return "rate_limited"
+        return "ok"
+
+    def run(self, func, fmt: str = "collapsed", label: str = ""):
+        """Call ``func`` under a profiler and return ``(result, profile_id)``."""
+        profile_id = uuid.uuid4().hex
+        if fmt == "pstats":
+            profiler = cProfile.Profile()
+            token = _active_profile.set(profiler)
+            try:
+                result = profiler.runcall(func)
+            finally:
+                _active_profile.reset(token)
+            self._write(profile_id, "pstats", profiler.dump_stats)
+            return result, profile_id
+
+        sampler = SamplingProfiler(self.interval)
+        token = _active_profile.set(sampler)
+        sampler.start()
+        try:
+            result = func()
+        finally:
+            sampler.stop()
+            _active_profile.reset(token)
+        header = (
+            f"# {label} samples={sampler.samples} interval={self.interval}"
+            f" focus={sampler.focus_share():.2f}\n"
+        )
+        self._write(profile_id, "collapsed", lambda path: _write_text(path, header + sampler.collapsed()))
+        return result, profile_id
+
+    def path_for(self, profile_id: str, fmt: str = "collapsed") -> str:
+        extension = "prof" if fmt == "pstats" else "collapsed"
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def _write(self, profile_id: str, fmt: str, writer) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        writer(self.path_for(profile_id, fmt))
+        self._prune()
+
+    def _prune(self) -> None:
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[self.keep:]:
+            try:
+                os.remove(path)
+            except OSError:  # pragma: no cover - removed concurrently
+                pass
+
+
+def _write_text(path: str, text: str) -> None:
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def store_from_env() -> ProfileStore:
+    """Build the :class:`ProfileStore` configured through ``PROFILE_*`` variables."""
+    env = os.environ
+    return ProfileStore(
+        env.get("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "wardrobe-profiles"),
+        token=env.get("PROFILE_TOKEN") or None,
+        limit=int(env.get("PROFILE_RATE_LIMIT", "5")),
+        window=float(env.get("PROFILE_RATE_WINDOW", "300")),
+        keep=int(env.get("PROFILE_KEEP", "50")),
+        interval=float(env.get("PROFILE_INTERVAL", "0.005")),
+    )
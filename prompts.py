@@ -0,0 +1,178 @@
+"""Pieces of the prompts sent to OpenAI, kept within token budgets.
+
+Every endpoint that talks to the LLM describes clothing items the same way,
+``Item N: A {color} {category}``. Identical items are grouped onto one line
+(``Items 2, 5: A white shirt``) so their numbers stay valid for outfit
+references. What can grow with the user's input, such as the item list, a
+free text description, the conversation so far or the file names sent to
+``/compose``, is cut to the endpoint's budget. A note says how much was left out. Prompts within budget
+come out unchanged. Where a prompt has several such parts, :func:`allocate`
+shares the one budget between them.
+
+Token counts are estimated at about four characters per token, which is close
+enough for English prompts to keep sizes predictable without a tokenizer.
+Budgets default to :data:`DEFAULT_BUDGETS` and can be set per endpoint with
+``PROMPT_BUDGET_<NAME>`` (for example ``PROMPT_BUDGET_UPLOAD=800``). The
+estimated size of every prompt sent is recorded in
+``wardrobe_prompt_tokens{route,api}``, and truncations are counted in
+``wardrobe_prompt_truncated_total{route,section}``.
+"""
+
+import os
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from metrics import Counter, Histogram, current_route
+
+PROMPT_TOKENS = Histogram(
+    "wardrobe_prompt_tokens",
+    "Estimated tokens of prompts sent to OpenAI per route and API",
+    ["route", "api"],
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000),
+)
+PROMPT_TRUNCATED = Counter(
+    "wardrobe_prompt_truncated_total",
+    "Prompt sections shortened to fit their token budget per route",
+    ["route", "section"],
+)
+
+#: Token budget of the variable part of each endpoint's prompt
+#: (``image`` covers the item list of image prompts, which OpenAI caps at 1000 characters)
+DEFAULT_BUDGETS = {"upload": 1500, "refine": 1500, "compose": 300, "suggest": 300, "image": 150}
+
+#: Characters per token assumed by :func:`estimate_tokens`
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly count the tokens of ``text``."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def budget(name: str) -> int:
+    """Return the token budget of endpoint ``name`` (``PROMPT_BUDGET_<NAME>``)."""
+    return int(os.getenv(f"PROMPT_BUDGET_{name.upper()}") or DEFAULT_BUDGETS[name])
+
+
+def allocate(total: int, sections: Dict[str, int]) -> Dict[str, int]:
+    """Split ``total`` tokens between ``sections``, which map names to the tokens they need.
+
+    Sections needing no more than an equal share get what they need, and
+    what they leave over is shared equally by the others.
+    """
+    shares = {}
+    wanting = dict(sections)
+    while wanting:
+        share = (total - sum(shares.values())) // len(wanting)
+        small = {name: need for name, need in wanting.items() if need <= share}
+        if not small:
+            shares.update(dict.fromkeys(wanting, share))
+            break
+        shares.update(small)
+        for name in small:
+            del wanting[name]
+    return shares
+
+
+def _truncated(section: str) -> None:
+    PROMPT_TRUNCATED.inc(route=current_route(), section=section)
+
+
+def describe_item(attributes: Dict) -> str:
+    """Return ``"{color} {category}"``, leaving out an unknown colour."""
+    category = attributes.get("category", "item")
+    color = attributes.get("color", "")
+    if color and color.lower() != "unknown":
+        return f"{color} {category}"
+    return category
+
+
+def _fit_lines(lines: List[str], tokens: int, section: str, more) -> List[str]:
+    """Keep the leading ``lines`` that fit in ``tokens``, then a ``more(n)`` note."""
+    used = 0
+    for kept, line in enumerate(lines):
+        used += estimate_tokens(line)
+        if used > tokens:
+            _truncated(section)
+            return lines[:kept] + [more(len(lines) - kept)]
+    return lines
+
+
+def format_items(items: Sequence[Dict], indexes: Optional[Iterable[int]] = None,
+                 tokens: Optional[int] = None) -> str:
+    """Return one ``Item N: A ...`` line per distinct item of ``items``.
+
+    ``indexes`` picks the items to include (all by default); numbers are
+    the items' positions plus one either way. Items with the same
+    description share a line. With ``tokens`` the list is cut to about that
+    many tokens.
+    """
+    groups: Dict[str, List[int]] = {}
+    for i in range(len(items)) if indexes is None else indexes:
+        groups.setdefault(describe_item(items[i]), []).append(i + 1)
+    lines = []
+    for description, numbers in groups.items():
+        label = f"Item {numbers[0]}" if len(numbers) == 1 else "Items " + ", ".join(map(str, numbers))
+        lines.append(f"{label}: A {description}")
+    if tokens is not None:
+        lines = _fit_lines(lines, tokens, "items", lambda n: f"...and {n} more items")
+    return "\n".join(lines)
+
+
+def join_descriptions(descriptions: Iterable[str], tokens: Optional[int] = None, section: str = "items") -> str:
+    """Join ``descriptions`` with commas, once each and within ``tokens``."""
+    unique = list(dict.fromkeys(d for d in descriptions if d))
+    if tokens is not None:
+        unique = _fit_lines(unique, tokens, section, lambda n: f"and {n} more")
+    return ", ".join(unique)
+
+
+def clip(text: str, tokens: int, section: str = "text") -> str:
+    """Return ``text`` cut to about ``tokens`` tokens."""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    _truncated(section)
+    return text[:limit].rstrip() + "..."
+
+
+def format_history(turns, tokens: Optional[int] = None) -> str:
+    """Render earlier turns of a conversation in about ``tokens`` tokens.
+
+    ``turns`` have ``user_query`` and ``response`` attributes, oldest
+    first. The newest turns are kept in full. Older turns that no longer fit
+    keep only the user's request, and the oldest are left out and counted.
+    Without ``tokens`` every turn is kept in full.
+    """
+    if tokens is None:
+        tokens = sum(estimate_tokens(f'User: "{t.user_query}"\nYou: "{t.response}"') for t in turns)
+    lines = []
+    used = 0
+    omitted = 0
+    keep = "full"
+    for turn in reversed(turns):
+        if keep == "full":
+            text = f'User: "{turn.user_query}"\nYou: "{turn.response}"'
+            if used + estimate_tokens(text) <= tokens:
+                lines.append(text)
+                used += estimate_tokens(text)
+                continue
+            keep = "query"
+        if keep == "query":
+            text = f'User: "{turn.user_query}"'
+            if used + estimate_tokens(text) <= tokens:
+                lines.append(text)
+                used += estimate_tokens(text)
+                continue
+            keep = None
+        omitted += 1
+    lines.reverse()
+    if omitted:
+        _truncated("history")
+        lines.insert(0, f"({omitted} earlier requests omitted)")
+    return "\n".join(lines)
+
+
+def observe(api: str, kwargs: Dict) -> None:
+    """Record the estimated size of the prompt in OpenAI call ``kwargs``."""
+    text = kwargs.get("prompt") or "".join(m.get("content", "") for m in kwargs.get("messages", ()))
+    PROMPT_TOKENS.observe(estimate_tokens(text), route=current_route(), api=api)
@@ -0,0 +1,283 @@
+"""Production server entrypoint with preforked, model-sharing workers.
+
+The master process imports :mod:`app`, loads the segmentation weights once
+and freezes the garbage collector's view of the heap. It then forks the
+workers, which inherit the loaded model and share its memory pages
+copy-on-write instead of each loading their own copy. Every worker serves
+requests from a bounded thread pool on the shared listening socket. After a
+configurable number of requests it drains and exits, and the master
+replaces it with a fresh fork.
+
+With ``--worker-class gevent`` (or ``SERVER_WORKER_CLASS=gevent``) the
+process is monkey-patched before anything else is imported, and each request
+runs on a greenlet. Requests spend most of
+their time waiting on OpenAI, and those waits now yield to other requests
+instead of holding an OS thread. CPU-bound segmentation is dispatched to a
+pool of ``--threads`` real threads through :data:`app.cpu_executor`. A single
+worker can therefore keep up to ``--connections`` requests in flight.
+
+Usage::
+
+    python serve.py --workers 4 --threads 8 --max-requests 1000
+    python serve.py --worker-class gevent --connections 500
+
+Each option can also be set through an environment variable (``HOST``,
+``PORT``, ``SERVER_WORKERS``, ``SERVER_THREADS``, ``SERVER_MAX_REQUESTS``,
+``SERVER_MAX_REQUESTS_JITTER``, ``SERVER_WORKER_CLASS`` and
+``SERVER_CONNECTIONS``).
+"""
+
+import sys
+
+import gevent_patch
+
+if __name__ == "__main__":
+    # Before socket, threading and the app (and the OpenAI client) are imported
+    gevent_patch.patch_if_requested(sys.argv[1:])
+
+import argparse
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+logger = logging.getLogger(__name__)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Return the command line parser with environment variable defaults."""
+    env = os.environ
+    parser = argparse.ArgumentParser(description="Serve the Wardrobe app with preforked workers")
+    parser.add_argument("--host", default=env.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(env.get("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(env.get("SERVER_WORKERS", os.cpu_count() or 1)),
+        help="Number of forked worker processes",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=int(env.get("SERVER_THREADS", "4")),
+        help="Request handling threads per worker",
+    )
+    parser.add_argument(
+        "--max-requests", type=int, default=int(env.get("SERVER_MAX_REQUESTS", "0")),
+        help="Recycle a worker after this many requests (0 disables recycling)",
+    )
+    parser.add_argument(
+        "--max-requests-jitter", type=int, default=int(env.get("SERVER_MAX_REQUESTS_JITTER", "0")),
+        help="Random extra requests per worker so workers don't recycle together",
+    )
+    parser.add_argument(
+        "--worker-class", choices=["sync", "gevent"], default=env.get("SERVER_WORKER_CLASS", "sync"),
+        help="'gevent' serves requests on greenlets so OpenAI waits don't occupy threads",
+    )
+    parser.add_argument(
+        "--connections", type=int, default=int(env.get("SERVER_CONNECTIONS", "1000")),
+        help="Maximum concurrent requests per gevent worker",
+    )
+    parser.add_argument("--backlog", type=int, default=int(env.get("SERVER_BACKLOG", "128")))
+    return parser
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that logs through :mod:`logging` instead of stderr."""
+
+    def log_message(self, format, *args):  # noqa: A002 - signature from BaseHTTPRequestHandler
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+class WorkerServer(WSGIServer):
+    """WSGI server running on an inherited socket with a bounded thread pool.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        Listening socket shared with the other workers. It must be
+        non-blocking so a worker that loses the ``accept`` race just
+        returns to polling.
+    application : callable
+        The WSGI application.
+    threads : int
+        Size of the request handling thread pool.
+    max_requests : int
+        Stop accepting after this many requests; ``0`` never recycles.
+    """
+
+    def __init__(self, sock, application, threads=4, max_requests=0):
+        super().__init__(sock.getsockname()[:2], QuietRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.set_app(application)
+        self.max_requests = max_requests
+        self.handled = 0
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wardrobe-worker")
+
+    def process_request(self, request, client_address):
+        self.handled += 1
+        if self.max_requests and self.handled >= self.max_requests:
+            # shutdown() blocks until serve_forever returns, so ask from another thread
+            threading.Thread(target=self.shutdown, daemon=True).start()
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        # Finish in-flight requests but leave the shared socket to the master
+        self._pool.shutdown(wait=True)
+
+
+def load_application():
+    """Import the app and load everything workers should share.
+
+    Returns the WSGI application.
+    """
+    import app as app_module
+
+    if app_module.cloth_segmenter.load_model():
+        logger.info("Segmentation model loaded in master process")
+    else:
+        logger.info("No segmentation model available; workers will use fallback parsers")
+    if app_module.DATABASE_URL.endswith(":memory:"):
+        logger.warning("In-memory database is not shared between workers; set DATABASE_URL to a file")
+    # Objects allocated so far are never collected, so GC passes in the
+    # workers don't touch (and thereby copy) the shared pages
+    gc.collect()
+    gc.freeze()
+    return app_module.app
+
+
+def _after_fork_in_worker():
+    try:
+        import app as app_module
+    except Exception:  # pragma: no cover - defensive
+        return
+    engine = app_module.engine
+    # Pooled connections inherited from the master must not be shared
+    if hasattr(engine, "dispose") and not app_module.DATABASE_URL.endswith(":memory:"):
+        engine.dispose(close=False)
+
+
+def run_gevent_worker(sock, application, args, max_requests) -> None:
+    """Serve requests on greenlets with segmentation in a real thread pool."""
+    import gevent
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer as GeventWSGIServer
+    from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+    import app as app_module
+
+    app_module.cpu_executor = GeventThreadPoolExecutor(max_workers=args.threads)
+    handled = 0
+
+    def counting_application(environ, start_response):
+        nonlocal handled
+        handled += 1
+        if max_requests and handled == max_requests:
+            gevent.spawn(server.stop, timeout=30)
+        return application(environ, start_response)
+
+    server = GeventWSGIServer(sock, counting_application, spawn=Pool(args.connections), log=logger)
+    gevent.signal_handler(signal.SIGTERM, server.stop, 30)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.serve_forever()
+    app_module.cpu_executor.shutdown(wait=True)
+
+
+def run_worker(sock, application, args) -> None:
+    """Serve requests until recycled or asked to stop, then exit the process."""
+    _after_fork_in_worker()
+    max_requests = args.max_requests
+    if max_requests and args.max_requests_jitter:
+        max_requests += random.randint(0, args.max_requests_jitter)
+    if args.worker_class == "gevent":
+        run_gevent_worker(sock, application, args, max_requests)
+        os._exit(0)
+    server = WorkerServer(sock, application, threads=args.threads, max_requests=max_requests)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    os._exit(0)
+
+
+def spawn_worker(sock, application, args) -> int:
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover - child process
+        try:
+            run_worker(sock, application, args)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.worker_class == "gevent":
+        from gevent import monkey
+        if not monkey.is_module_patched("socket"):
+            # Called without gevent_patch, e.g. main(["--worker-class", "gevent"])
+            logger.warning("Patching for gevent after socket and threading were imported")
+            monkey.patch_all()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(message)s")
+
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    sock.setblocking(False)
+    # Lets the app size per-process limits, such as admission control, to the worker count
+    os.environ["SERVER_WORKERS"] = str(max(1, args.workers))
+    application = load_application()
+
+    workers = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(max(1, args.workers)):
+        workers.add(spawn_worker(sock, application, args))
+    logger.info("Listening on %s:%s with %d workers", args.host, args.port, len(workers))
+
+    while workers:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:  # pragma: no cover - retried by os.wait on 3.5+
+            continue
+        workers.discard(pid)
+        if not stopping:
+            workers.add(spawn_worker(sock, application, args))
+            logger.info("Worker %d exited; started replacement", pid)
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover - manual invocation
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""Nearest-neighbour index over wardrobe item attributes.
+
+Items are embedded as small feature vectors (colour in HSV and a one-hot
+category, optionally followed by embedding features from the segmenter) so
+"what looks like this" queries don't need to scan and compare every stored
+item attribute by attribute. Two backends are provided:
+
+``brute``
+    Exact search over a dense matrix (NumPy when available, pure Python
+    otherwise).
+``lsh``
+    Approximate search using random-hyperplane locality sensitive hashing
+    with an exact re-rank of the candidates. Requires NumPy and falls back
+    to ``brute`` without it.
+
+Both backends support incremental inserts and are persisted as one JSON file
+per user.
+"""
+
+import fcntl
+import json
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from outfits import CATEGORIES, HUES, NEUTRALS
+
+#: Approximate ``(value, saturation)`` of the achromatic colour names
+_NEUTRAL_VALUES = {"white": 1.0, "gray": 0.5, "black": 0.0}
+
+#: Weight of the category block relative to the colour block
+CATEGORY_WEIGHT = 0.75
+
+
+def color_to_hsv(color: Optional[str]) -> tuple[float, float, float]:
+    """Return an approximate ``(hue_degrees, saturation, value)`` for a colour name."""
+    color = (color or "unknown").lower()
+    if color in NEUTRALS:
+        return 0.0, 0.0, _NEUTRAL_VALUES[color]
+    if color in HUES:
+        return float(HUES[color]), 0.8, 0.8
+    return 0.0, 0.0, 0.5
+
+
+def item_features(attributes: Dict[str, str], embedding: Optional[Sequence[float]] = None) -> List[float]:
+    """Return the feature vector for an item's ``category``/``color`` attributes.
+
+    Hue is encoded on the unit circle scaled by saturation so red and purple
+    are neighbours. All components are roughly centred on zero, which keeps
+    random hyperplanes through the origin informative. ``embedding`` features
+    are appended unchanged.
+    """
+    hue, sat, val = color_to_hsv(attributes.get("color"))
+    rad = math.radians(hue)
+    vector = [sat * math.cos(rad), sat * math.sin(rad), sat - 0.5, val - 0.5]
+    category = (attributes.get("category") or "unknown").lower()
+    if category not in CATEGORIES:
+        category = "unknown"
+    offset = 1.0 / len(CATEGORIES)
+    vector.extend(
+        CATEGORY_WEIGHT * ((1.0 if c == category else 0.0) - offset) for c in CATEGORIES
+    )
+    if embedding is not None:
+        vector.extend(float(v) for v in embedding)
+    return vector
+
+
+class BruteForceIndex:
+    """Exact k-NN index using a dense feature matrix."""
+
+    backend = "brute"
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.vectors: List[List[float]] = []
+        self._positions: Dict[int, int] = {}
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, item_id: int, vector: Sequence[float]) -> None:
+        """Insert or replace the vector stored for ``item_id``."""
+        vector = [float(v) for v in vector]
+        if item_id in self._positions:
+            self.vectors[self._positions[item_id]] = vector
+        else:
+            self._positions[item_id] = len(self.ids)
+            self.ids.append(item_id)
+            self.vectors.append(vector)
+        self._matrix = None
+
+    def _distances(self, vector: Sequence[float], rows: Optional[List[int]] = None):
+        rows = range(len(self.ids)) if rows is None else rows
+        if np is not None:
+            matrix = self._matrix
+            if matrix is None:
+                matrix = self._matrix = np.asarray(self.vectors, dtype=np.float32)
+            diff = matrix[np.asarray(rows, dtype=np.intp)] - np.asarray(vector, dtype=np.float32)
+            return np.sqrt((diff * diff).sum(axis=1)).tolist()
+        return [math.dist(self.vectors[r], vector) for r in rows]
+
+    def _rank(self, vector, k, rows=None, exclude=None):
+        rows = list(range(len(self.ids))) if rows is None else rows
+        if not rows:
+            return []
+        distances = self._distances(vector, rows)
+        ranked = sorted(zip(distances, rows))
+        results = []
+        for distance, row in ranked:
+            if self.ids[row] == exclude:
+                continue
+            results.append((self.ids[row], round(float(distance), 6)))
+            if len(results) == k:
+                break
+        return results
+
+    def query(self, vector: Sequence[float], k: int = 5, exclude: Optional[int] = None):
+        """Return up to ``k`` ``(item_id, distance)`` pairs nearest to ``vector``."""
+        return self._rank(vector, k, exclude=exclude)
+
+    def vector(self, item_id: int) -> Optional[List[float]]:
+        """Return the stored vector for ``item_id`` or ``None``."""
+        if item_id not in self._positions:
+            return None
+        return self.vectors[self._positions[item_id]]
+
+    def to_dict(self) -> Dict:
+        return {"backend": self.backend, "ids": self.ids, "vectors": self.vectors}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "BruteForceIndex":
+        index = cls()
+        for item_id, vector in zip(data.get("ids", []), data.get("vectors", [])):
+            index.add(int(item_id), vector)
+        return index
+
+
+class LSHIndex(BruteForceIndex):
+    """Approximate k-NN index using random-hyperplane hashing.
+
+    Parameters
+    ----------
+    tables : int
+        Number of independent hash tables. More tables improve recall.
+    bits : int
+        Hyperplanes per table. More bits make buckets smaller and queries
+        cheaper at the cost of recall.
+    seed : int
+        Seed for the hyperplanes so a persisted index hashes identically
+        after reloading.
+    """
+
+    backend = "lsh"
+
+    def __init__(self, tables: int = 4, bits: int = 6, seed: int = 0):
+        if np is None:
+            raise RuntimeError("NumPy is required for the LSH backend")
+        super().__init__()
+        self.tables = tables
+        self.bits = bits
+        self.seed = seed
+        self._planes = None
+        self._buckets: List[Dict[int, List[int]]] = [dict() for _ in range(tables)]
+
+    def _hashes(self, vector) -> List[int]:
+        if self._planes is None:
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal((self.tables, self.bits, len(vector))).astype(np.float32)
+        signs = (self._planes @ np.asarray(vector, dtype=np.float32)) > 0
+        weights = 1 << np.arange(self.bits)
+        return (signs * weights).sum(axis=1).tolist()
+
+    def add(self, item_id: int, vector: Sequence[float]) -> None:
+        if item_id in self._positions:
+            # Replacing a vector moves it between buckets; rebuild them
+            super().add(item_id, vector)
+            self._rebuild()
+            return
+        super().add(item_id, vector)
+        row = len(self.ids) - 1
+        for table, key in enumerate(self._hashes(self.vectors[row])):
+            self._buckets[table].setdefault(key, []).append(row)
+
+    def _rebuild(self) -> None:
+        self._buckets = [dict() for _ in range(self.tables)]
+        for row, vector in enumerate(self.vectors):
+            for table, key in enumerate(self._hashes(vector)):
+                self._buckets[table].setdefault(key, []).append(row)
+
+    def query(self, vector: Sequence[float], k: int = 5, exclude: Optional[int] = None):
+        candidates = set()
+        for table, key in enumerate(self._hashes(vector)):
+            candidates.update(self._buckets[table].get(key, ()))
+        results = self._rank(vector, k, rows=sorted(candidates), exclude=exclude)
+        if len(results) < min(k, len(self.ids) - (exclude in self._positions)):
+            # Too few colliding items; an exact scan is cheap at this size
+            return super().query(vector, k, exclude=exclude)
+        return results
+
+    def to_dict(self) -> Dict:
+        data = super().to_dict()
+        data.update({"tables": self.tables, "bits": self.bits, "seed": self.seed})
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LSHIndex":
+        index = cls(tables=data.get("tables", 4), bits=data.get("bits", 6), seed=data.get("seed", 0))
+        for item_id, vector in zip(data.get("ids", []), data.get("vectors", [])):
+            index.add(int(item_id), vector)
+        return index
+
+
+def make_index(backend: str = "brute") -> BruteForceIndex:
+    """Return an empty index for ``backend`` (``"brute"`` or ``"lsh"``)."""
+    if backend == "lsh" and np is not None:
+        return LSHIndex()
+    if backend not in {"brute", "lsh"}:
+        raise ValueError(f"Unknown similarity backend: {backend}")
+    return BruteForceIndex()
+
+
+class SimilarityIndexStore:
+    """Per-user indexes, optionally persisted as JSON files in ``directory``.
+
+    When ``directory`` is ``None`` indexes only live in memory. Otherwise
+    every worker process caches the indexes it has read and reloads one when
+    its file was replaced by another process. Inserts read, update and
+    replace the file under an exclusive lock, so concurrent writers don't
+    lose each other's items.
+    """
+
+    def __init__(self, directory: Optional[str] = None, backend: str = "brute"):
+        self.directory = directory
+        self.backend = backend
+        # user id -> (stamp of the file the index was read from, index)
+        self._indexes: Dict[int, Tuple[Optional[tuple], BruteForceIndex]] = {}
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_id: int) -> Optional[str]:
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f"user_{int(user_id)}.json")
+
+    @staticmethod
+    def _stamp(path: Optional[str]) -> Optional[tuple]:
+        # os.replace gives every saved version a new inode
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            return None
+        return stat and (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _cached(self, user_id: int, stamp: Optional[tuple]) -> Optional[BruteForceIndex]:
+        cached = self._indexes.get(user_id)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        return None
+
+    def _read(self, path: Optional[str], stamp: Optional[tuple], loader) -> BruteForceIndex:
+        if stamp is not None:
+            with open(path) as f:
+                data = json.load(f)
+            cls = LSHIndex if data.get("backend") == "lsh" and np is not None else BruteForceIndex
+            return cls.from_dict(data)
+        index = make_index(self.backend)
+        for item_id, vector in (loader() if loader else ()):
+            index.add(item_id, vector)
+        return index
+
+    def get(self, user_id: int, loader=None) -> BruteForceIndex:
+        """Return the index for ``user_id``, loading or building it if needed.
+
+        ``loader`` is called with no arguments to obtain ``(item_id, vector)``
+        pairs when no persisted index exists yet.
+        """
+        with self._lock:
+            path = self._path(user_id)
+            stamp = self._stamp(path)
+            index = self._cached(user_id, stamp)
+            if index is None:
+                index = self._read(path, stamp, loader)
+                self._indexes[user_id] = (stamp, index)
+            return index
+
+    def query(self, user_id: int, vector: Sequence[float], k: int = 5, exclude: Optional[int] = None,
+              loader=None):
+        """Return up to ``k`` ``(item_id, distance)`` pairs from the user's index.
+
+        Inserts update a cached index in place, so queries hold the same lock.
+        """
+        index = self.get(user_id, loader)
+        with self._lock:
+            return index.query(vector, k, exclude=exclude)
+
+    def add(self, user_id: int, item_id: int, vector: Sequence[float], loader=None) -> None:
+        """Insert ``vector`` for ``item_id`` and persist the user's index."""
+        path = self._path(user_id)
+        if path is None:
+            index = self.get(user_id, loader)
+            with self._lock:
+                index.add(item_id, vector)
+            return
+        with self._lock, open(path + ".lock", "a") as lock:
+            # Other worker processes update the same file
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stamp = self._stamp(path)
+            index = self._cached(user_id, stamp)
+            if index is None:
+                index = self._read(path, stamp, loader)
+            index.add(item_id, vector)
+            self._save(path, index)
+            self._indexes[user_id] = (self._stamp(path), index)
+
+    @staticmethod
+    def _save(path: str, index: BruteForceIndex) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index.to_dict(), f)
+        os.replace(tmp_path, path)
+
+
+def index_directory_for(database_url: str) -> Optional[str]:
+    """Return the directory that sits next to a SQLite database file.
+
+    ``None`` is returned for in-memory or non-SQLite databases.
+    """
+    prefix = "sqlite:///"
+    if not database_url.startswith(prefix):
+        return None
+    path = database_url[len(prefix):]
+    if not path or path == ":memory:":
+        return None
+    return path + ".similarity"
@@ -2,8 +2,9 @@ import sqlite3
 from typing import Any, Dict, List, Type
 
 class Column:
-    def __init__(self, column_type: Any, primary_key: bool = False, unique: bool = False, nullable: bool = True):
+    def __init__(self, column_type: Any, *args: Any, primary_key: bool = False, unique: bool = False, nullable: bool = True):
         self.type = column_type
+        self.foreign_keys = [a for a in args if isinstance(a, ForeignKey)]
         self.primary_key = primary_key
         self.unique = unique
         self.nullable = nullable
@@ -14,6 +15,10 @@ class Integer:
 class String:
     pass
 
+class ForeignKey:
+    def __init__(self, target: str):
+        self.target = target
+
 class Engine:
     def __init__(self, url: str):
         if url == 'sqlite:///:memory:':
@@ -63,7 +68,7 @@ class Session:
     def add(self, obj: Any):
         table = obj.__class__.__tablename__
         cols = obj.__class__._columns
-        row = {c: getattr(obj, c) for c in cols}
+        row = {c: obj.__dict__.get(c) for c in cols}
         # auto id
         pk = None
         for c in cols:
@@ -71,11 +76,16 @@ class Session:
             if isinstance(col_desc, Column) and col_desc.primary_key:
                 pk = c
                 break
-        if pk and getattr(obj, pk, None) is None:
-            row[pk] = len(self.bind.data.setdefault(table, [])) + 1
+        if pk and obj.__dict__.get(pk) is None:
+            row[pk] = max((r[pk] for r in self.bind.data.setdefault(table, [])), default=0) + 1
             setattr(obj, pk, row[pk])
         self.bind.data.setdefault(table, []).append(row)
 
+    def delete(self, obj: Any):
+        rows = self.bind.data.get(obj.__class__.__tablename__, [])
+        pk = next(c for c in obj.__class__._columns if getattr(obj.__class__, c).primary_key)
+        rows[:] = [row for row in rows if row.get(pk) != getattr(obj, pk)]
+
     def commit(self):
         pass
 
@@ -106,15 +116,20 @@ class Query:
         self.data = filtered
         return self
 
-    def first(self):
-        if not self.data:
-            return None
-        row = self.data[0]
+    def _to_model(self, row: Dict[str, Any]):
         obj = self.model()
         for k, v in row.items():
             setattr(obj, k, v)
         return obj
 
+    def first(self):
+        if not self.data:
+            return None
+        return self._to_model(self.data[0])
+
+    def all(self):
+        return [self._to_model(row) for row in self.data]
+
     def count(self):
         return len(self.data)
 
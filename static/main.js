@@ -14,6 +14,12 @@ document.addEventListener('DOMContentLoaded', () => {
   const bodyInput = composeForm.querySelector('input[name="body"]');
   const clothesInput = composeForm.querySelector('input[name="clothes"]');
 
+  // Upload limits advertised by the server; null when /config is unavailable
+  const uploadConfig = fetch('/config')
+    .then(response => (response.ok ? response.json() : null))
+    .then(config => (config ? config.upload : null))
+    .catch(() => null);
+
   uploadInput.addEventListener('change', () => {
     previewFiles(uploadInput.files, uploadPreview, true);
   });
@@ -29,8 +35,8 @@ document.addEventListener('DOMContentLoaded', () => {
   uploadForm.addEventListener('submit', async (e) => {
     e.preventDefault();
     showLoading(uploadLoading);
-    const formData = new FormData(uploadForm);
-    const response = await fetch('/upload', {
+    const formData = await prepareFormData(uploadForm);
+    const response = await timedFetch('/upload', {
       method: 'POST',
       body: formData
     });
@@ -54,7 +60,7 @@ document.addEventListener('DOMContentLoaded', () => {
     e.preventDefault();
     showLoading(suggestLoading);
     const formData = new FormData(suggestForm);
-    const response = await fetch('/suggest', {
+    const response = await timedFetch('/suggest', {
       method: 'POST',
       body: formData
     });
@@ -77,8 +83,8 @@ document.addEventListener('DOMContentLoaded', () => {
   composeForm.addEventListener('submit', async (e) => {
     e.preventDefault();
     showLoading(composeLoading);
-    const formData = new FormData(composeForm);
-    const response = await fetch('/compose', {
+    const formData = await prepareFormData(composeForm);
+    const response = await timedFetch('/compose', {
       method: 'POST',
       body: formData
     });
@@ -158,6 +164,85 @@ document.addEventListener('DOMContentLoaded', () => {
     });
   }
 
+  // Collect a form's fields, downscaling photos to the server's upload target
+  async function prepareFormData(form) {
+    const config = await uploadConfig;
+    const formData = new FormData();
+    for (const [name, value] of new FormData(form).entries()) {
+      if (config && value instanceof File && value.size > 0) {
+        formData.append(name, await downscaleImage(value, config));
+      } else {
+        formData.append(name, value);
+      }
+    }
+    return formData;
+  }
+
+  // Return ``file`` resized to ``config.max_dimension`` on its longest side and
+  // re-encoded as JPEG, lowering the quality until it fits ``config.max_bytes``.
+  // Photos already within the limits, and anything the browser can't decode,
+  // are sent unchanged.
+  async function downscaleImage(file, config) {
+    let bitmap;
+    try {
+      bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+    } catch (e) {
+      return file;
+    }
+    const longest = Math.max(bitmap.width, bitmap.height);
+    const allowed = config.mime_types.includes(file.type);
+    if (allowed && longest <= config.max_dimension && file.size <= config.max_bytes) {
+      bitmap.close();
+      return file;
+    }
+    const scale = Math.min(1, config.max_dimension / longest);
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.round(bitmap.width * scale);
+    canvas.height = Math.round(bitmap.height * scale);
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+    bitmap.close();
+
+    let quality = config.jpeg_quality;
+    let blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', quality));
+    while (blob && blob.size > config.max_bytes && quality > 0.5) {
+      quality -= 0.1;
+      blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', quality));
+    }
+    if (!blob) return file;
+    const name = file.name.replace(/\.[^.]*$/, '') + '.jpg';
+    return new File([blob], name, { type: 'image/jpeg', lastModified: file.lastModified });
+  }
+
+  // Set localStorage.debugTiming = '1' to log per-stage server timings
+  const debugTiming = window.localStorage && localStorage.getItem('debugTiming') === '1';
+
+  async function timedFetch(url, options) {
+    const opts = Object.assign({}, options);
+    if (debugTiming) {
+      opts.headers = Object.assign({}, opts.headers, { 'X-Debug-Timing': '1' });
+    }
+    const started = performance.now();
+    const response = await fetch(url, opts);
+    if (debugTiming) {
+      logServerTiming(url, response, performance.now() - started);
+    }
+    return response;
+  }
+
+  function logServerTiming(url, response, elapsed) {
+    const header = response.headers.get('Server-Timing');
+    if (!header) return;
+    const stages = {};
+    header.split(',').forEach(entry => {
+      const [name, ...params] = entry.trim().split(';');
+      const dur = params.find(p => p.trim().startsWith('dur='));
+      stages[name] = dur ? parseFloat(dur.trim().slice(4)) : null;
+    });
+    console.groupCollapsed(`${url} ${response.status} ${elapsed.toFixed(0)} ms`);
+    console.table(stages);
+    console.groupEnd();
+  }
+
   function showLoading(el) {
     el.classList.add('active');
   }
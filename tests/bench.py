@@ -0,0 +1,348 @@
+"""Micro-benchmark helpers: synthetic images, timing and baseline comparison.
+
+Images are generated in pure Python so the suite runs without Pillow or
+OpenCV. PNGs hold an RGB gradient. JPEGs are real, decodable baseline or
+progressive files built from flat-coloured 8x8 blocks, so only DC
+coefficients need encoding.
+
+Benchmarks only run in full when ``BENCH=1``. Otherwise each case runs a
+couple of iterations as a smoke test. Full runs write their results to
+``BENCH_OUTPUT`` (default ``bench_output.json``) and fail when a case is more
+than ``BENCH_THRESHOLD`` (default 0.3) slower than ``tests/bench_baseline.json``.
+``BENCH_UPDATE_BASELINE=1`` rewrites the baseline instead.
+"""
+
+import functools
+import json
+import os
+import platform
+import struct
+import time
+import tracemalloc
+import zlib
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+
+ENABLED = os.getenv("BENCH") == "1"
+OUTPUT_PATH = os.getenv("BENCH_OUTPUT", "bench_output.json")
+THRESHOLD = float(os.getenv("BENCH_THRESHOLD", "0.3"))
+UPDATE_BASELINE = os.getenv("BENCH_UPDATE_BASELINE") == "1"
+
+#: Resolutions exercised by full runs; smoke runs only use ``small``
+SIZES = {"small": (320, 240), "medium": (1280, 960), "large": (2048, 1536)}
+
+#: Image formats produced by :func:`image_bytes`
+FORMATS = ("png", "jpeg", "jpeg_progressive")
+
+
+def sizes():
+    return SIZES if ENABLED else {"small": SIZES["small"]}
+
+
+# -- PNG ---------------------------------------------------------------------
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def png_bytes(width: int, height: int) -> bytes:
+    """Return an RGB PNG with a red/green gradient across and blue down."""
+    base = bytearray(width * 3)
+    base[0::3] = bytes(x * 255 // max(width - 1, 1) for x in range(width))
+    base[1::3] = bytes(255 - x * 255 // max(width - 1, 1) for x in range(width))
+    rows = []
+    for y in range(height):
+        row = bytearray(base)
+        row[2::3] = bytes([y * 255 // max(height - 1, 1)]) * width
+        rows.append(b"\x00" + bytes(row))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(b"".join(rows), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+# -- JPEG --------------------------------------------------------------------
+
+#: Standard luminance DC table (Annex K.3): code length counts and symbols
+_DC_BITS = [0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0]
+_DC_VALUES = list(range(12))
+#: A one-symbol AC table: every block is a single end-of-block code "0"
+_AC_BITS = [1] + [0] * 15
+_AC_VALUES = [0x00]
+
+
+def _huffman_codes(bits, values):
+    codes, code, k = {}, 0, 0
+    for length, count in enumerate(bits, start=1):
+        for _ in range(count):
+            codes[values[k]] = (code, length)
+            code += 1
+            k += 1
+        code <<= 1
+    return codes
+
+
+_DC_CODES = _huffman_codes(_DC_BITS, _DC_VALUES)
+_EOB = _huffman_codes(_AC_BITS, _AC_VALUES)[0x00]
+
+
+class _BitWriter:
+    def __init__(self):
+        self.out = bytearray()
+        self.acc = 0
+        self.n = 0
+
+    def write(self, code: int, length: int) -> None:
+        self.acc = (self.acc << length) | code
+        self.n += length
+        while self.n >= 8:
+            self.n -= 8
+            byte = (self.acc >> self.n) & 0xFF
+            self.out.append(byte)
+            if byte == 0xFF:
+                self.out.append(0x00)  # byte stuffing
+        self.acc &= (1 << self.n) - 1
+
+    def flush(self) -> bytes:
+        if self.n:
+            self.write((1 << (8 - self.n)) - 1, 8 - self.n)  # pad with ones
+        return bytes(self.out)
+
+
+def _write_dc(writer: _BitWriter, diff: int) -> None:
+    category = abs(diff).bit_length()
+    writer.write(*_DC_CODES[category])
+    if category:
+        writer.write(diff if diff > 0 else diff + (1 << category) - 1, category)
+
+
+def _segment(marker: int, payload: bytes) -> bytes:
+    return struct.pack(">BBH", 0xFF, marker, len(payload) + 2) + payload
+
+
+def _block_colors(width: int, height: int):
+    """Return per-block ``(Y, Cb, Cr)`` DC values, level shifted."""
+    bw, bh = (width + 7) // 8, (height + 7) // 8
+    blocks = []
+    for by in range(bh):
+        for bx in range(bw):
+            r = bx * 255 // max(bw - 1, 1)
+            g = 255 - r
+            b = by * 255 // max(bh - 1, 1)
+            y = 0.299 * r + 0.587 * g + 0.114 * b
+            cb = 128 - 0.168736 * r - 0.331264 * g + 0.5 * b
+            cr = 128 + 0.5 * r - 0.418688 * g - 0.081312 * b
+            blocks.append(tuple(int(round(v)) - 128 for v in (y, cb, cr)))
+    return blocks
+
+
+def jpeg_bytes(width: int, height: int, progressive: bool = False) -> bytes:
+    """Return a 3-component JPEG of flat 8x8 blocks in a colour gradient.
+
+    With a quantiser of 8 the DC coefficient of a flat block equals its
+    level-shifted sample value. Baseline files hold one interleaved scan.
+    Progressive files hold a DC scan followed by one AC scan per component.
+    """
+    blocks = _block_colors(width, height)
+    out = bytearray(b"\xff\xd8")
+    out += _segment(0xE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00")
+    out += _segment(0xDB, b"\x00" + bytes([8] * 64))
+    sof = struct.pack(">BHHB", 8, height, width, 3) + b"\x01\x11\x00\x02\x11\x00\x03\x11\x00"
+    out += _segment(0xC2 if progressive else 0xC0, sof)
+    out += _segment(0xC4, b"\x00" + bytes(_DC_BITS) + bytes(_DC_VALUES))
+    out += _segment(0xC4, b"\x10" + bytes(_AC_BITS) + bytes(_AC_VALUES))
+
+    all_components = b"\x03\x01\x00\x02\x00\x03\x00"
+    writer = _BitWriter()
+    previous = [0, 0, 0]
+    for block in blocks:
+        for c, value in enumerate(block):
+            _write_dc(writer, value - previous[c])
+            previous[c] = value
+            if not progressive:
+                writer.write(*_EOB)
+    if not progressive:
+        out += _segment(0xDA, all_components + b"\x00\x3f\x00")
+        out += writer.flush()
+    else:
+        out += _segment(0xDA, all_components + b"\x00\x00\x00")
+        out += writer.flush()
+        for component in (1, 2, 3):
+            writer = _BitWriter()
+            for _ in blocks:
+                writer.write(*_EOB)
+            out += _segment(0xDA, bytes([1, component, 0x00]) + b"\x01\x3f\x00")
+            out += writer.flush()
+    out += b"\xff\xd9"
+    return bytes(out)
+
+
+def exif_segment(orientation: int, big_endian: bool = False) -> bytes:
+    """Return an APP1 segment holding only an EXIF orientation tag."""
+    order = ">" if big_endian else "<"
+    tiff = (b"MM" if big_endian else b"II") + struct.pack(order + "HI", 42, 8)
+    tiff += struct.pack(order + "H", 1) + struct.pack(order + "HHIHH", 0x0112, 3, 1, orientation, 0)
+    tiff += struct.pack(order + "I", 0)
+    return _segment(0xE1, b"Exif\x00\x00" + tiff)
+
+
+def with_segments(jpeg: bytes, *segments: bytes) -> bytes:
+    """Insert ``segments`` right after the SOI marker of ``jpeg``."""
+    return jpeg[:2] + b"".join(segments) + jpeg[2:]
+
+
+def app_segments(count: int, size: int = 65000) -> bytes:
+    """Return ``count`` APP2 segments of ``size`` bytes, like a large ICC profile."""
+    return _segment(0xE2, b"ICC_PROFILE\x00" + b"\x00" * (size - 12)) * count
+
+
+@functools.lru_cache(maxsize=None)
+def image_bytes(fmt: str, width: int, height: int) -> bytes:
+    """Return a cached synthetic image in one of :data:`FORMATS`."""
+    if fmt == "png":
+        return png_bytes(width, height)
+    return jpeg_bytes(width, height, progressive=fmt == "jpeg_progressive")
+
+
+def extension(fmt: str) -> str:
+    return ".png" if fmt == "png" else ".jpg"
+
+
+def parts_payload(width: int, height: int) -> dict:
+    """Return a ``/parse`` response with model masks as nested lists of 0 and 1.
+
+    Each part covers a band of the image, like a person standing in the
+    middle of the photo.
+    """
+    def mask(top, bottom):
+        inside = [0] * (width // 4) + [1] * (width - width // 2) + [0] * (width // 4)
+        outside = [0] * width
+        return [inside if top <= y < bottom else outside for y in range(height)]
+
+    return {
+        "parts": {
+            "full_body": mask(height // 8, height * 7 // 8),
+            "upper_body": mask(height // 8, height // 2),
+            "lower_body": mask(height // 2, height * 7 // 8),
+        },
+        "attributes": {"category": "dress", "color": "blue"},
+    }
+
+
+def legacy_image_size(path: str):
+    """The byte-at-a-time JPEG walker ``imageprobe`` replaced, for comparison."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(24)
+            if len(head) >= 24 and head.startswith(b"\211PNG\r\n\032\n") and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:2] == b"\xff\xd8":
+                f.seek(2)
+                while True:
+                    byte = f.read(1)
+                    if not byte:
+                        break
+                    if byte != b"\xff":
+                        continue
+                    marker = f.read(1)
+                    while marker == b"\xff":
+                        marker = f.read(1)
+                    if marker in b"\xc0\xc1\xc2\xc3\xc5\xc6\xc7\xc9\xca\xcb\xcd\xce\xcf":
+                        f.read(3)
+                        height, width = struct.unpack(">HH", f.read(4))
+                        return width, height
+                    size_data = f.read(2)
+                    if len(size_data) != 2:
+                        break
+                    f.seek(struct.unpack(">H", size_data)[0] - 2, 1)
+    except Exception:
+        pass
+    return 0, 0
+
+
+# -- Timing ------------------------------------------------------------------
+
+def measure(func, min_time: float = 0.25, min_iterations: int = 3) -> dict:
+    """Run ``func`` repeatedly and return throughput and peak memory.
+
+    ``peak_kib`` is the largest Python heap growth of one call as seen by
+    :mod:`tracemalloc`. NumPy buffers are included, OpenCV matrices are not.
+    """
+    if not ENABLED:
+        min_time, min_iterations = 0.0, 2
+    func()  # warm up caches and lazy imports
+    iterations = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while iterations < min_iterations or elapsed < min_time:
+        func()
+        iterations += 1
+        elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / elapsed, 2),
+        "mean_ms": round(elapsed / iterations * 1000, 4),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+class Recorder:
+    """Collect benchmark results and compare them with the stored baseline."""
+
+    def __init__(self, baseline_path: str = BASELINE_PATH, output_path: str = OUTPUT_PATH):
+        self.baseline_path = baseline_path
+        self.output_path = output_path
+        self.results = {}
+
+    def run(self, name: str, func, **kwargs) -> dict:
+        result = measure(func, **kwargs)
+        self.results[name] = result
+        if ENABLED:
+            self.save()
+        return result
+
+    def skip(self, name: str, reason: str) -> None:
+        self.results[name] = {"skipped": reason}
+
+    def save(self) -> None:
+        data = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": self.results,
+        }
+        with open(self.output_path, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        if UPDATE_BASELINE:
+            baseline = self._baseline()
+            baseline.update({k: v["ops_per_sec"] for k, v in self.results.items() if "ops_per_sec" in v})
+            with open(self.baseline_path, "w") as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+    def _baseline(self) -> dict:
+        if not os.path.exists(self.baseline_path):
+            return {}
+        with open(self.baseline_path) as f:
+            return json.load(f)
+
+    def regressions(self, threshold: float = THRESHOLD) -> list:
+        """Return ``(name, ops_per_sec, baseline)`` for cases that got slower."""
+        if not ENABLED or UPDATE_BASELINE:
+            return []
+        baseline = self._baseline()
+        slow = []
+        for name, result in sorted(self.results.items()):
+            expected = baseline.get(name)
+            if expected and "ops_per_sec" in result and result["ops_per_sec"] < expected * (1 - threshold):
+                slow.append((name, result["ops_per_sec"], expected))
+        return slow
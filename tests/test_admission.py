@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+from admission import (
+    ADMISSION_REJECTED, AdmissionController, Overloaded, TierGovernor, admitted, controller_from_env,
+    current_controller,
+)
+
+
+def _expect_overloaded(func, reason):
+    try:
+        func()
+    except Overloaded as e:
+        assert e.reason == reason
+        assert e.retry_after >= 1
+    else:
+        raise AssertionError('Overloaded not raised')
+
+
+def _hold(controller, entered, release):
+    with controller.slot():
+        entered.set()
+        release.wait(5)
+
+
+def test_waiters_are_admitted_in_turn_and_overflow_is_rejected():
+    controller = AdmissionController('t1', max_concurrency=1, max_queue=1, max_wait=5)
+    entered, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=_hold, args=(controller, entered, release))
+    holder.start()
+    assert entered.wait(5)
+
+    second_entered, second_release = threading.Event(), threading.Event()
+    waiter = threading.Thread(target=_hold, args=(controller, second_entered, second_release))
+    waiter.start()
+    for _ in range(100):
+        if controller.waiting == 1:
+            break
+        time.sleep(0.01)
+    assert controller.waiting == 1
+
+    # Queue is full: both the entry check and a new slot fail immediately
+    start = time.monotonic()
+    _expect_overloaded(controller.check, 'queue_full')
+    _expect_overloaded(lambda: controller.slot().__enter__(), 'queue_full')
+    assert time.monotonic() - start < 1
+
+    release.set()
+    assert second_entered.wait(5)
+    second_release.set()
+    holder.join(5)
+    waiter.join(5)
+    assert (controller.active, controller.waiting) == (0, 0)
+    assert controller.service_time is not None
+    assert ADMISSION_REJECTED.value(**{'class': 't1', 'reason': 'queue_full'}) == 2
+
+
+def test_wait_longer_than_max_wait_is_rejected():
+    controller = AdmissionController('t2', max_concurrency=1, max_queue=5, max_wait=0.05)
+    entered, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=_hold, args=(controller, entered, release))
+    holder.start()
+    assert entered.wait(5)
+    try:
+        start = time.monotonic()
+        _expect_overloaded(lambda: controller.slot().__enter__(), 'timeout')
+        assert 0.05 <= time.monotonic() - start < 1
+        assert controller.waiting == 0
+    finally:
+        release.set()
+        holder.join(5)
+
+
+def test_admitted_sets_current_controller():
+    controller = AdmissionController('t3', max_concurrency=2, max_queue=0, max_wait=0)
+    assert current_controller() is None
+    with admitted(controller):
+        assert current_controller() is controller
+        with controller.slot():
+            assert controller.active == 1
+    assert current_controller() is None
+
+
+def test_governor_steps_down_under_load_and_recovers():
+    controller = AdmissionController('t5', max_concurrency=1, max_queue=1, max_wait=1)
+    governor = TierGovernor(controller, target=0.1, cooldown=0)
+    assert governor.level(3) == 0
+
+    controller.wait_time = 0.5
+    assert [governor.level(3) for _ in range(3)] == [1, 2, 2]
+    # Fewer tiers available never skips the last one
+    assert governor.level(2) == 1
+
+    # Between the thresholds the level holds
+    controller.wait_time = 0.08
+    assert governor.level(3) == 2
+    controller.wait_time = 0.01
+    assert [governor.level(3) for _ in range(3)] == [1, 0, 0]
+
+
+def test_governor_waits_for_cooldown_between_steps():
+    controller = AdmissionController('t6', max_concurrency=1, max_queue=1, max_wait=1)
+    governor = TierGovernor(controller, target=0.1, cooldown=60)
+    controller.wait_time = 0.5
+    assert governor.level(3) == 1
+    assert governor.level(3) == 1
+
+
+def test_rejections_count_as_long_waits():
+    controller = AdmissionController('t7', max_concurrency=1, max_queue=0, max_wait=2)
+    with controller.slot():
+        assert controller.wait_time < 0.5
+        _expect_overloaded(controller.check, 'queue_full')
+    assert controller.wait_time > 0.3
+
+
+def test_default_concurrency_is_shared_between_workers():
+    with patch('os.cpu_count', return_value=8), patch.dict(os.environ, {'SERVER_WORKERS': '4'}):
+        controller = controller_from_env('image')
+    assert (controller.max_concurrency, controller.max_queue) == (2, 4)
+    with patch('os.cpu_count', return_value=2), patch.dict(os.environ, {'SERVER_WORKERS': '8'}):
+        assert controller_from_env('image').max_concurrency == 1
+    env = {'SERVER_WORKERS': '4', 'ADMISSION_IMAGE_CONCURRENCY': '6'}
+    with patch('os.cpu_count', return_value=8), patch.dict(os.environ, env):
+        assert controller_from_env('image').max_concurrency == 6
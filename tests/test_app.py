@@ -1,14 +1,18 @@
 import io
 import os
 import base64
+import tempfile
+import time
 import types
 import contextlib
 import pytest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 from flask_stub import File
 
 from app import app
 import app as app_module
+import prompts
+from admission import AdmissionController, TierGovernor
 
 PNG_BYTES = base64.b64decode(
     'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVQImWNgYAAAAAUAAarVyFEAAAAASUVORK5CYII='
@@ -687,3 +691,585 @@ def test_parse_route_with_real_model(client):
     assert response.status_code == 200
     payload = response.get_json()
     assert all(payload['parts'][p] for p in ('upper_body', 'lower_body', 'full_body'))
+
+
+def _chat_response(content):
+    message = types.SimpleNamespace(content=content)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def test_upload_reuses_wardrobe_items(client):
+    client.post('/register/phone', data={'phone': 'wardrobe-user'})
+    analysis = {
+        'parts': {'full_body': [[0, 0, 4, 8]]},
+        'attributes': {'category': 'shirt', 'color': 'blue'},
+    }
+    with patch.object(app_module.cloth_segmenter, 'analyze', return_value=analysis) as analyze, \
+         patch('app.openai.ChatCompletion.create', return_value=_chat_response('Wear it')), \
+         patch('app.openai.Image.create', return_value={'data': [{'url': 'http://example.com/o.png'}]}):
+        first = client.post('/upload', data={
+            'identifier': 'wardrobe-user',
+            'full_body_image': (io.BytesIO(PNG_BYTES), 'body.png'),
+            'clothing_item_images': (io.BytesIO(PNG_BYTES), 'shirt.png'),
+        }, content_type='multipart/form-data')
+        second = client.post('/upload', data={
+            'identifier': 'wardrobe-user',
+            'full_body_image': (io.BytesIO(PNG_BYTES), 'body.png'),
+            'clothing_item_images': (io.BytesIO(PNG_BYTES), 'shirt.png'),
+        }, content_type='multipart/form-data')
+        item_id = first.get_json()['wardrobe_item_ids'][0]
+        by_id = client.post('/upload', data={
+            'identifier': 'wardrobe-user',
+            'full_body_image': (io.BytesIO(PNG_BYTES), 'body.png'),
+            'clothing_item_ids': str(item_id),
+        }, content_type='multipart/form-data')
+        analyze.assert_called_once()
+
+    assert first.status_code == 200
+    assert second.get_json()['wardrobe_item_ids'] == [item_id]
+    assert by_id.status_code == 200
+    assert by_id.get_json()['clothing_items_attributes'] == [{'category': 'shirt', 'color': 'blue'}]
+
+    listing = client.post('/wardrobe', data={'identifier': 'wardrobe-user'})
+    assert listing.get_json() == {
+        'items': [{'id': item_id, 'category': 'shirt', 'color': 'blue', 'box': [0, 0, 4, 8]}]
+    }
+
+
+def test_upload_unknown_wardrobe_item(client):
+    client.post('/register/phone', data={'phone': 'wardrobe-missing'})
+    response = client.post('/upload', data={
+        'identifier': 'wardrobe-missing',
+        'full_body_image': (io.BytesIO(PNG_BYTES), 'body.png'),
+        'clothing_item_ids': '999',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 404
+    assert response.get_json() == {'error': 'Unknown clothing item id: 999'}
+
+
+def test_refine_with_wardrobe_item_ids(client):
+    client.post('/register/phone', data={'phone': 'wardrobe-refine'})
+    with app_module.SessionLocal() as session:
+        user = session.query(app_module.User).filter_by(identifier='wardrobe-refine').first()
+        item = app_module.WardrobeItem(user_id=user.id, image_hash='abc', category='pants', color='black')
+        session.add(item)
+        session.commit()
+        item_id = item.id
+    with patch('app.openai.ChatCompletion.create', return_value=_chat_response('Try it')) as chat_create:
+        response = client.post('/refine_outfit_suggestion', json={
+            'identifier': 'wardrobe-refine',
+            'clothing_item_ids': [item_id],
+            'original_suggestion': 'Jeans',
+            'user_query': 'Something darker?',
+        })
+        prompt = chat_create.call_args.kwargs['messages'][0]['content']
+    assert response.status_code == 200
+    assert 'Item 1: A black pants' in prompt
+
+
+def test_upload_sends_ranked_candidates_to_llm(client):
+    analyses = iter([
+        {'parts': {}, 'attributes': {'category': 'shirt', 'color': 'white'}},
+        {'parts': {}, 'attributes': {'category': 'shirt', 'color': 'white'}},
+        {'parts': {}, 'attributes': {'category': 'pants', 'color': 'blue'}},
+    ])
+    with patch.object(app_module.cloth_segmenter, 'analyze', side_effect=lambda path: next(analyses)), \
+         patch.object(app_module, 'OUTFIT_CANDIDATE_LIMIT', 1), \
+         patch('app.openai.ChatCompletion.create', return_value=_chat_response('Wear it')) as chat_create, \
+         patch('app.openai.Image.create', return_value={'data': [{'url': 'http://example.com/o.png'}]}) as img_create:
+        response = client.post('/upload', data={
+            'full_body_image': (io.BytesIO(PNG_BYTES), 'body.png'),
+            'clothing_item_images1': (io.BytesIO(PNG_BYTES), 'a.png'),
+            'clothing_item_images2': (io.BytesIO(PNG_BYTES), 'b.png'),
+            'clothing_item_images3': (io.BytesIO(PNG_BYTES), 'c.png'),
+        }, content_type='multipart/form-data')
+        prompt = chat_create.call_args.kwargs['messages'][0]['content']
+        image_prompt = img_create.call_args.kwargs['prompt']
+    assert response.status_code == 200
+    assert response.get_json()['outfit_candidates'] == [{'items': [0, 2], 'score': 0.95}]
+    assert 'Outfit 1: Item 1 + Item 3' in prompt
+    assert 'Item 2' not in prompt
+    assert 'white shirt, blue pants.' in image_prompt
+
+
+def test_similar_route(client):
+    client.post('/register/phone', data={'phone': 'similar-user'})
+    analyses = iter([
+        {'parts': {}, 'attributes': {'category': 'shirt', 'color': 'red'}},
+        {'parts': {}, 'attributes': {'category': 'pants', 'color': 'blue'}},
+        {'parts': {}, 'attributes': {'category': 'shirt', 'color': 'orange'}},
+    ])
+    with patch.object(app_module.cloth_segmenter, 'analyze', side_effect=lambda path: next(analyses)), \
+         patch('app.openai.ChatCompletion.create', return_value=_chat_response('Wear it')), \
+         patch('app.openai.Image.create', return_value={'data': [{'url': 'http://example.com/o.png'}]}):
+        response = client.post('/upload', data={
+            'identifier': 'similar-user',
+            'full_body_image': (io.BytesIO(PNG_BYTES), 'body.png'),
+            'clothing_item_images1': (io.BytesIO(PNG_BYTES + b'1'), 'a.png'),
+            'clothing_item_images2': (io.BytesIO(PNG_BYTES + b'2'), 'b.png'),
+            'clothing_item_images3': (io.BytesIO(PNG_BYTES + b'3'), 'c.png'),
+        }, content_type='multipart/form-data')
+    red, blue, orange = response.get_json()['wardrobe_item_ids']
+
+    response = client.post('/similar', data={'identifier': 'similar-user', 'item_id': str(red), 'k': '1'})
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert [item['id'] for item in payload['similar']] == [orange]
+
+    missing = client.post('/similar', data={'identifier': 'similar-user', 'item_id': '12345'})
+    assert missing.status_code == 404
+
+
+def test_segmentation_runs_on_cpu_executor(client):
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+    threads = []
+
+    def record_parse(path):
+        threads.append(threading.current_thread().name)
+        return {'upper_body': [], 'lower_body': [], 'full_body': []}
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cpu')
+    try:
+        with patch.object(app_module, 'cpu_executor', executor), \
+             patch.object(app_module.cloth_segmenter, 'parse', side_effect=record_parse):
+            response = client.post('/parse', data={'image': (io.BytesIO(PNG_BYTES), 'a.png')},
+                                   content_type='multipart/form-data')
+    finally:
+        executor.shutdown()
+    assert response.status_code == 200
+    assert threads and threads[0].startswith('cpu')
+
+
+def test_metrics_route_reports_stages_and_tiers(client):
+    client.post('/parse', data={'image': (io.BytesIO(PNG_BYTES), 'm.png')},
+                content_type='multipart/form-data')
+    with patch('app.openai.ChatCompletion.create', side_effect=app_module.openai.error.OpenAIError('fail')):
+        client.post('/suggest', data={'description': 'x'})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain')
+    body = response.data
+    assert 'wardrobe_request_duration_seconds_count{route="/parse"}' in body
+    assert 'wardrobe_stage_duration_seconds_count{route="/parse",stage="validate"}' in body
+    assert 'wardrobe_stage_duration_seconds_count{route="/parse",stage="save"}' in body
+    assert 'wardrobe_stage_duration_seconds_count{route="/parse",stage="parse"}' in body
+    assert 'wardrobe_segmentation_tier_total{tier="header_split"}' in body
+    assert 'wardrobe_openai_errors_total{route="/suggest",api="chat"}' in body
+    assert 'wardrobe_requests_in_flight{route="/parse"} 0' in body
+    assert 'wardrobe_requests_total{route="/suggest",status="502"}' in body
+
+
+def test_server_timing_header(client):
+    chat = {'choices': [{'message': {'content': 'Wear it'}}]}
+    with patch('app.openai.ChatCompletion.create', return_value=chat), \
+         patch('app.openai.Image.create', return_value={'data': [{'url': 'http://x/y.png'}]}):
+        response = client.post('/suggest', data={'description': 'beach'})
+    assert response.status_code == 200
+    entries = dict(e.split(';dur=') for e in response.headers['Server-Timing'].split(', '))
+    assert set(entries) == {'llm', 'image', 'total'}
+    assert all(float(ms) >= 0 for ms in entries.values())
+    assert 'debug' not in response.get_json()
+
+    response = client.post('/parse', data={'image': (io.BytesIO(PNG_BYTES), 't.png')},
+                           content_type='multipart/form-data')
+    assert 'segment;dur=' in response.headers['Server-Timing']
+
+
+def test_segmentation_tier_header_follows_governor(client):
+    controller = AdmissionController('tier-test', max_concurrency=1, max_queue=1, max_wait=1)
+    governor = TierGovernor(controller, target=0.1, cooldown=0)
+    controller.wait_time = 1.0
+    with patch.object(app_module.cloth_segmenter, 'governor', governor):
+        for _ in range(2):
+            response = client.post('/parse?debug=1', data={'image': (io.BytesIO(PNG_BYTES), 't.png')},
+                                   content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.headers['X-Segmentation-Tier'] == 'header_split'
+    assert response.get_json()['debug']['segmentation_tiers'] == ['header_split']
+    assert response.get_json()['parts']['upper_body'] == [[0, 0, 1, 0]]
+
+    response = client.post('/suggest', data={'description': 'x'})
+    assert 'X-Segmentation-Tier' not in response.headers
+
+
+def test_debug_timing_field(client):
+    response = client.post('/analyze?debug=timing', data={'image': (io.BytesIO(PNG_BYTES), 't.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    timings = response.get_json()['debug']['timings_ms']
+    assert {'segment', 'classify', 'total'} <= set(timings)
+
+    response = client.post('/parse', data={}, content_type='multipart/form-data',
+                           headers={'X-Debug-Timing': '1'})
+    assert response.status_code == 400
+    assert response.get_json()['debug']['timings_ms'].keys() == {'total'}
+
+
+def test_profile_request_with_token(client):
+    import tempfile
+    from profiling import ProfileStore
+    with tempfile.TemporaryDirectory() as directory:
+        store = ProfileStore(directory, token='s3cret', limit=1, interval=0.001)
+        data = lambda: {'image': (io.BytesIO(PNG_BYTES), 'p.png')}
+        with patch.object(app_module, 'profile_store', store):
+            response = client.post('/analyze', data=data(), content_type='multipart/form-data',
+                                   headers={'X-Profile': 's3cret'})
+            assert response.status_code == 200
+            assert response.headers['X-Profile-Status'] == 'ok'
+            profile_id = response.headers['X-Profile-Id']
+            assert os.path.exists(store.path_for(profile_id))
+
+            # Tokens in the query string would be logged and are ignored
+            response = client.post('/analyze?profile=s3cret', data=data(), content_type='multipart/form-data')
+            assert 'X-Profile-Status' not in response.headers
+            response = client.post('/analyze', data=data(), content_type='multipart/form-data',
+                                   headers={'X-Profile': 's3cret'})
+            assert response.headers['X-Profile-Status'] == 'rate_limited'
+            response = client.post('/analyze', data=data(), content_type='multipart/form-data',
+                                   headers={'X-Profile': 'guess'})
+            assert response.headers['X-Profile-Status'] == 'denied'
+            assert 'X-Profile-Id' not in response.headers
+            assert len(os.listdir(directory)) == 1
+
+
+def test_image_endpoints_shed_load_when_saturated(client):
+    controller = app_module.image_admission
+    saved = (controller.active, controller.waiting)
+    controller.active, controller.waiting = controller.max_concurrency, controller.max_queue
+    try:
+        response = client.post('/parse', data={'image': (io.BytesIO(PNG_BYTES), 's.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+        assert response.get_json() == {'error': 'Server busy, please retry later'}
+        # Cheap endpoints are not admission controlled
+        response = client.post('/get_user', data={'identifier': 'nobody@example.com'})
+        assert response.status_code == 404
+    finally:
+        controller.active, controller.waiting = saved
+    response = client.get('/metrics')
+    assert 'wardrobe_admission_rejected_total{class="image",reason="queue_full"}' in response.data
+
+
+def test_segmentation_timeout_in_queue_returns_503(client):
+    from admission import Overloaded
+    with patch.object(app_module.image_admission, 'slot', side_effect=Overloaded('image', 'timeout', 3)):
+        response = client.post('/analyze', data={'image': (io.BytesIO(PNG_BYTES), 's.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '3'
+        response = client.post('/upload', data={
+            'full_body_image': (io.BytesIO(PNG_BYTES), 'body.png'),
+            'clothing_item_images': (io.BytesIO(PNG_BYTES), 'shirt.png'),
+        }, content_type='multipart/form-data')
+    assert response.status_code == 503
+
+
+def test_openai_calls_get_the_remaining_deadline(client):
+    chat = {'choices': [{'message': {'content': 'Wear it'}}]}
+    with patch('app.openai.ChatCompletion.create', return_value=chat) as chat_create, \
+         patch('app.openai.Image.create', return_value={'data': [{'url': 'http://x/y.png'}]}):
+        client.post('/suggest', data={'description': 'beach'})
+        assert 'request_timeout' not in chat_create.call_args.kwargs
+        response = client.post('/suggest', data={'description': 'beach'}, headers={'X-Request-Timeout': '8'})
+    assert response.status_code == 200
+    assert 7 < chat_create.call_args.kwargs['request_timeout'] <= 8
+
+
+def test_expired_deadline_returns_504(client):
+    import time
+
+    def slow_parse(path):
+        time.sleep(0.05)
+        return {'upper_body': [], 'lower_body': [], 'full_body': []}
+
+    with patch.object(app_module.cloth_segmenter, 'parse', side_effect=slow_parse), \
+         patch.object(app_module.cloth_segmenter, 'classify') as classify:
+        response = client.post('/analyze', data={'image': (io.BytesIO(PNG_BYTES), 's.png')},
+                               content_type='multipart/form-data', headers={'X-Request-Timeout': '0.02'})
+    assert response.status_code == 504
+    assert response.get_json() == {'error': 'Request deadline exceeded'}
+    classify.assert_not_called()
+
+    def timed_out(**kwargs):
+        time.sleep(kwargs['request_timeout'])
+        raise app_module.openai.error.Timeout('timed out')
+
+    with patch('app.openai.ChatCompletion.create', side_effect=timed_out):
+        response = client.post('/suggest', data={'description': 'beach'}, headers={'X-Request-Timeout': '0.02'})
+    assert response.status_code == 504
+    response = client.get('/metrics')
+    assert 'wardrobe_deadline_exceeded_total{route="/analyze",' in response.data
+    assert 'wardrobe_deadline_exceeded_total{route="/suggest",stage="llm"}' in response.data
+
+
+def test_queued_work_is_cancelled_when_deadline_passes(client):
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+    release = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=1)
+    executor.submit(release.wait, 5)
+    try:
+        with patch.object(app_module, 'cpu_executor', executor), \
+             patch.object(app_module.cloth_segmenter, 'parse') as parse:
+            response = client.post('/parse', data={'image': (io.BytesIO(PNG_BYTES), 's.png')},
+                                   content_type='multipart/form-data', headers={'X-Request-Timeout': '0.05'})
+            release.set()
+            executor.shutdown()
+    finally:
+        release.set()
+    assert response.status_code == 504
+    parse.assert_not_called()
+
+
+def test_executor_timeout_is_a_deadline_even_before_it_shows(client):
+    import concurrent.futures
+    executor = MagicMock()
+    executor.submit.return_value.result.side_effect = concurrent.futures.TimeoutError()
+    with patch.object(app_module, 'cpu_executor', executor), \
+         patch.object(app_module.cloth_segmenter, 'parse'):
+        # A generous deadline that check_deadline won't see as expired
+        response = client.post('/parse', data={'image': (io.BytesIO(PNG_BYTES), 's.png')},
+                               content_type='multipart/form-data', headers={'X-Request-Timeout': '60'})
+    assert response.status_code == 504
+    executor.submit.return_value.cancel.assert_called_once()
+
+
+def test_uploads_over_pixel_budget_are_rejected(client):
+    import clothseg
+    from tests import bench
+    png, jpeg = bench.png_bytes(64, 48), bench.jpeg_bytes(64, 48)
+    with patch.object(clothseg, 'MAX_IMAGE_PIXELS', 1000), \
+         patch.object(app_module.cloth_segmenter, 'parse') as parse:
+        response = client.post('/parse', data={'image': (io.BytesIO(png), 'big.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 400
+        parse.assert_not_called()
+        assert not app_module._is_allowed_image(File(io.BytesIO(jpeg), 'big.jpg'))
+        with patch.object(clothseg, 'OVERSIZE_POLICY', 'reduce'):
+            assert app_module._is_allowed_image(File(io.BytesIO(jpeg), 'big.jpg'))
+            assert not app_module._is_allowed_image(File(io.BytesIO(png), 'big.png'))
+    assert app_module._is_allowed_image(File(io.BytesIO(png), 'big.png'))
+
+
+def test_config_advertises_upload_target(client):
+    with patch.dict(os.environ, {'UPLOAD_MAX_DIMENSION': ''}), \
+            patch.dict(app_module.cloth_segmenter.settings, {'working_resolution': 1024}):
+        response = client.get('/config')
+    assert response.status_code == 200
+    assert 'max-age' in response.headers['Cache-Control']
+    upload = response.get_json()['upload']
+    assert upload['max_dimension'] == 1024
+    assert upload['max_bytes'] == app_module.MAX_IMAGE_SIZE
+    assert upload['mime_types'] == ['image/jpeg', 'image/png']
+    with patch.dict(os.environ, {'UPLOAD_MAX_DIMENSION': '1600'}):
+        assert client.get('/config').get_json()['upload']['max_dimension'] == 1600
+
+
+def test_asset_ids_replace_file_parts(client):
+    from assets import AssetStore
+    with tempfile.TemporaryDirectory() as directory, \
+            patch.object(app_module, 'asset_store', AssetStore(directory)):
+        response = client.post('/assets', data={'image': (io.BytesIO(PNG_BYTES), 'body.png')})
+        assert response.status_code == 201
+        asset_id = response.get_json()['asset_id']
+        with patch.object(app_module.cloth_segmenter, 'parse', return_value={'full_body': []}) as parse, \
+                patch.object(app_module.cloth_segmenter, 'classify', return_value={'color': 'red'}):
+            response = client.post('/analyze', data={'image_asset_id': asset_id})
+        assert response.status_code == 200
+        assert response.get_json()['attributes'] == {'color': 'red'}
+        # The stored copy is parsed in place and kept for the next request
+        path = parse.call_args[0][0]
+        assert path == os.path.join(directory, asset_id) and os.path.exists(path)
+
+        response = client.post('/parse', data={'image_asset_id': 'f' * 64})
+        assert response.status_code == 404
+        response = client.post('/assets', data={'image': (io.BytesIO(b'not an image'), 'x.png')})
+        assert response.status_code == 400
+
+
+def test_compose_names_assets_by_label_not_id(client):
+    from assets import AssetStore
+    from tests import bench
+    with tempfile.TemporaryDirectory() as directory, \
+            patch.object(app_module, 'asset_store', AssetStore(directory)):
+        body_id = client.post('/assets', data={'image': (io.BytesIO(PNG_BYTES), 'me.png')}).get_json()['asset_id']
+        shirt_id = client.post('/assets', data={
+            'image': (io.BytesIO(bench.png_bytes(8, 8)), 'img_001.png'), 'label': 'red shirt',
+        }).get_json()['asset_id']
+        unnamed_id = app_module.asset_store.put(io.BytesIO(bench.png_bytes(9, 9)))
+        with patch.object(app_module.cloth_segmenter, 'parse', return_value={'full_body': []}), \
+                patch('app.openai.ChatCompletion.create',
+                      return_value={'choices': [{'message': {'content': 'combo'}}]}) as chat_create, \
+                patch('app.openai.Image.create', return_value={'data': [{'url': 'http://example.com/c.png'}]}):
+            response = client.post('/compose', data={
+                'body_asset_id': body_id, 'clothes_asset_ids': f'{shirt_id},{unnamed_id}'})
+        prompt = chat_create.call_args.kwargs['messages'][0]['content']
+    assert response.status_code == 200
+    assert prompt.endswith('with clothing items: red shirt')
+    for asset_id in (body_id, shirt_id, unnamed_id):
+        assert asset_id not in prompt
+
+
+def test_chunked_uploads_are_refused_when_staging_is_full(client):
+    from assets import AssetStore
+    with tempfile.TemporaryDirectory() as directory:
+        with patch.object(app_module, 'asset_store', AssetStore(directory, max_staged=0)):
+            response = client.post('/assets/uploads', data={'length': '10'})
+            assert response.status_code == 429
+            assert response.headers['Retry-After'] == '60'
+        with patch.object(app_module, 'asset_store', AssetStore(directory, max_staged_bytes=5)):
+            response = client.post('/assets/uploads', data={'length': '10'})
+            assert response.status_code == 507
+
+def test_chunked_upload_resumes_and_finalizes_into_an_asset(client):
+    from assets import AssetStore
+    image = PNG_BYTES
+    with tempfile.TemporaryDirectory() as directory, \
+            patch.object(app_module, 'asset_store', AssetStore(directory)):
+        response = client.post('/assets/uploads', data={'length': str(len(image))})
+        assert response.status_code == 201
+        upload_id = response.get_json()['upload_id']
+        response = client.post('/assets/uploads/chunk', data={
+            'upload_id': upload_id, 'offset': '0', 'chunk': (io.BytesIO(image[:40]), 'blob')})
+        assert response.get_json()['offset'] == 40
+        response = client.post('/assets/uploads/finalize', data={'upload_id': upload_id})
+        assert response.status_code == 409 and response.get_json()['offset'] == 40
+
+        # After a dropped connection the client asks where to continue
+        response = client.get(f'/assets/uploads?upload_id={upload_id}')
+        assert response.get_json()['offset'] == 40
+        response = client.post('/assets/uploads/chunk', data={
+            'upload_id': upload_id, 'offset': '0', 'chunk': (io.BytesIO(image[:40]), 'blob')})
+        assert response.status_code == 409 and response.get_json()['offset'] == 40
+        client.post('/assets/uploads/chunk', data={
+            'upload_id': upload_id, 'offset': '40', 'chunk': (io.BytesIO(image[40:]), 'blob')})
+        response = client.post('/assets/uploads/finalize', data={'upload_id': upload_id})
+        assert response.status_code == 201
+        asset_id = response.get_json()['asset_id']
+        with patch.object(app_module.cloth_segmenter, 'parse', return_value={'full_body': []}):
+            assert client.post('/parse', data={'image_asset_id': asset_id}).status_code == 200
+
+        response = client.post('/assets/uploads', data={'length': str(app_module.MAX_IMAGE_SIZE + 1)})
+        assert response.status_code == 400
+        upload_id = client.post('/assets/uploads', data={'length': '12'}).get_json()['upload_id']
+        client.post('/assets/uploads/chunk', data={
+            'upload_id': upload_id, 'offset': '0', 'chunk': (io.BytesIO(b'not an image'), 'blob')})
+        assert client.post('/assets/uploads/finalize', data={'upload_id': upload_id}).status_code == 400
+        assert client.get(f'/assets/uploads?upload_id={upload_id}').status_code == 404
+
+
+def test_idempotency_key_replays_suggestion(client):
+    from idempotency import IdempotencyStore
+    headers = {'Idempotency-Key': 'retry-1'}
+    with patch.object(app_module, 'idempotency_store', IdempotencyStore()), \
+            patch('app.openai.ChatCompletion.create') as chat_create, \
+            patch('app.openai.Image.create') as img_create:
+        chat_create.return_value = {'choices': [{'message': {'content': 'Layer a jacket'}}]}
+        img_create.return_value = {'data': [{'url': 'http://example.com/a.png'}]}
+        first = client.post('/suggest', data={'description': 'rainy day'}, headers=headers)
+        again = client.post('/suggest', data={'description': 'rainy day'}, headers=headers)
+        other = client.post('/suggest', data={'description': 'beach'}, headers=headers)
+        chat_create.assert_called_once()
+        img_create.assert_called_once()
+    assert first.status_code == again.status_code == 200
+    assert again.get_json() == first.get_json()
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert other.status_code == 422
+
+
+def test_idempotency_key_does_not_keep_failures(client):
+    from idempotency import IdempotencyStore
+    headers = {'Idempotency-Key': 'retry-2'}
+    with patch.object(app_module, 'idempotency_store', IdempotencyStore()), \
+            patch('app.openai.ChatCompletion.create') as chat_create, \
+            patch('app.openai.Image.create') as img_create:
+        chat_create.side_effect = [app_module.openai.error.OpenAIError('fail'),
+                                   {'choices': [{'message': {'content': 'ok'}}]}]
+        img_create.return_value = {'data': [{'url': 'http://example.com/a.png'}]}
+        assert client.post('/suggest', data={'description': 'x'}, headers=headers).status_code == 502
+        assert client.post('/suggest', data={'description': 'x'}, headers=headers).status_code == 200
+        assert chat_create.call_count == 2
+
+
+def test_refine_session_carries_context_between_turns(client):
+    replies = iter([_chat_response('Wear the navy blazer'), _chat_response('Swap in loafers')])
+    with patch('app.openai.ChatCompletion.create', side_effect=lambda **kwargs: next(replies)) as chat_create:
+        first = client.post('/refine_outfit_suggestion', json={
+            'original_suggestion': 'Blazer and chinos',
+            'available_clothing_items': [{'category': 'blazer', 'color': 'navy'}],
+            'user_query': 'Something smarter?',
+        })
+        session_id = first.get_json()['session_id']
+        second = client.post('/refine_outfit_suggestion', json={
+            'session_id': session_id,
+            'user_query': 'And the shoes?',
+        })
+        prompt = chat_create.call_args.kwargs['messages'][0]['content']
+    assert second.status_code == 200
+    assert second.get_json()['session_id'] == session_id
+    assert 'Item 1: A navy blazer' in prompt
+    assert '"Blazer and chinos"' in prompt
+    assert 'User: "Something smarter?"\nYou: "Wear the navy blazer"' in prompt
+    assert '"And the shoes?"' in prompt
+
+    response = client.post('/refine_outfit_suggestion', json={'session_id': 'nope', 'user_query': 'Hi'})
+    assert response.status_code == 404
+
+
+def test_idle_refine_sessions_are_pruned(client):
+    with patch('app.openai.ChatCompletion.create', return_value=_chat_response('Wear the navy blazer')):
+        first = client.post('/refine_outfit_suggestion', json={
+            'original_suggestion': 'Blazer and chinos',
+            'available_clothing_items': [],
+            'user_query': 'Anything warmer?',
+        })
+        session_id = first.get_json()['session_id']
+        later = time.time() + app_module.REFINE_SESSION_TTL + 1
+        with patch('app.time.time', return_value=later), patch.object(app_module, '_refine_pruned', 0.0):
+            expired = client.post('/refine_outfit_suggestion', json={'session_id': session_id, 'user_query': 'Hi'})
+            client.post('/refine_outfit_suggestion', json={
+                'original_suggestion': 'Jeans', 'available_clothing_items': [], 'user_query': 'Shoes?',
+            })
+    assert expired.status_code == 404
+    with app_module.SessionLocal() as session:
+        conversation = session.query(app_module.RefineSession).filter_by(public_id=session_id).first()
+        assert conversation is None
+        assert session.query(app_module.RefineTurn).filter_by(user_query='Anything warmer?').count() == 0
+
+
+def test_refine_prompt_stays_within_one_budget(client):
+    def prompt_for(payload):
+        with patch('app.openai.ChatCompletion.create', return_value=_chat_response('More layers')) as chat:
+            response = client.post('/refine_outfit_suggestion', json=payload)
+        return response.get_json()['session_id'], chat.call_args.kwargs['messages'][0]['content']
+
+    _, fixed = prompt_for({'original_suggestion': '', 'available_clothing_items': [], 'user_query': ''})
+    items = [{'category': f'item{i}', 'color': 'blue'} for i in range(200)]
+    with patch.dict(os.environ, {'PROMPT_BUDGET_REFINE': '300'}):
+        session_id, prompt = prompt_for({
+            'original_suggestion': 'Blazer and chinos ' * 100, 'available_clothing_items': items,
+            'user_query': 'Warmer? ' * 100,
+        })
+        for _ in range(5):
+            _, prompt = prompt_for({'session_id': session_id, 'user_query': 'Warmer still?'})
+    assert 'Item 1: A blue item0' in prompt
+    assert 'User: "Warmer' in prompt
+    assert prompts.estimate_tokens(prompt) <= prompts.estimate_tokens(fixed) + 300
+
+
+def test_refine_clips_client_text_to_budget(client):
+    with patch('app.openai.ChatCompletion.create', return_value=_chat_response('Try the scarf')) as chat_create, \
+            patch.dict(os.environ, {'PROMPT_BUDGET_REFINE': '10'}):
+        response = client.post('/refine_outfit_suggestion', json={
+            'original_suggestion': 'Blazer and chinos ' * 100,
+            'available_clothing_items': [],
+            'user_query': 'What else? ' * 100,
+        })
+        prompt = chat_create.call_args.kwargs['messages'][0]['content']
+    assert response.status_code == 200
+    assert 'Blazer and chinos ' * 3 not in prompt
+    assert 'What else? ' * 5 not in prompt
+    assert len(prompt) < 1000
@@ -0,0 +1,112 @@
+import io
+import os
+import tempfile
+import time
+
+from assets import AssetStore, OffsetMismatch, StagingFull
+
+
+def test_put_is_content_addressed():
+    with tempfile.TemporaryDirectory() as directory:
+        store = AssetStore(directory)
+        first = store.put(io.BytesIO(b'photo'))
+        assert store.put(io.BytesIO(b'photo')) == first
+        assert store.put(io.BytesIO(b'other')) != first
+        assert sorted(os.listdir(directory)) == sorted([first, store.put(io.BytesIO(b'other'))])
+        asset = store.get(first)
+        with open(asset.path, 'rb') as f:
+            assert f.read() == b'photo'
+
+
+def test_label_is_kept_next_to_the_asset():
+    with tempfile.TemporaryDirectory() as directory:
+        store = AssetStore(directory)
+        asset_id = store.put(io.BytesIO(b'photo'), 'shirt.png')
+        assert store.get(asset_id).label == 'shirt.png'
+        assert store.get(asset_id).filename == asset_id
+        # Storing the same content again without a name keeps the label
+        store.put(io.BytesIO(b'photo'))
+        assert store.get(asset_id).label == 'shirt.png'
+        assert store.get(store.put(io.BytesIO(b'other'))).label == ''
+    with tempfile.TemporaryDirectory() as directory:
+        store = AssetStore(directory, ttl=60)
+        asset_id = store.put(io.BytesIO(b'photo'))
+        assert store.get('0' * 64) is None
+        assert store.get('../' + asset_id) is None
+        assert store.get(None) is None
+        stale = time.time() - 120
+        os.utime(store.path_for(asset_id), (stale, stale))
+        assert store.get(asset_id) is None
+
+
+def test_use_restarts_the_ttl_and_put_prunes_expired():
+    with tempfile.TemporaryDirectory() as directory:
+        store = AssetStore(directory, ttl=60)
+        kept = store.put(io.BytesIO(b'kept'))
+        dropped = store.put(io.BytesIO(b'dropped'))
+        stale = time.time() - 50
+        for asset_id in (kept, dropped):
+            os.utime(store.path_for(asset_id), (stale, stale))
+        assert store.get(kept) is not None
+        stale = time.time() - 120
+        os.utime(store.path_for(dropped), (stale, stale))
+        store._pruned = 0.0
+        store.put(io.BytesIO(b'new'))
+        assert not os.path.exists(store.path_for(dropped))
+        assert os.path.exists(store.path_for(kept))
+
+
+def test_chunks_append_at_offset_and_complete_into_an_asset():
+    with tempfile.TemporaryDirectory() as directory:
+        store = AssetStore(directory)
+        upload = store.start_upload(10)
+        assert store.append(upload, 0, io.BytesIO(b'01234')) == 5
+        try:
+            store.append(upload, 0, io.BytesIO(b'01234'))  # a retried chunk that already arrived
+        except OffsetMismatch as e:
+            assert e.offset == 5
+        else:
+            raise AssertionError('expected OffsetMismatch')
+        try:
+            store.append(upload, 5, io.BytesIO(b'56789x'))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('expected ValueError')
+        resumed = store.staged(upload.upload_id)
+        assert (resumed.offset, resumed.length) == (5, 10)
+        assert store.append(resumed, 5, io.BytesIO(b'56789')) == 10
+        asset_id = store.complete(resumed)
+        assert asset_id == store.put(io.BytesIO(b'0123456789'))
+        assert store.staged(upload.upload_id) is None
+        assert [name for name in os.listdir(store.staging) if name != '.lock'] == []
+
+
+def _expect_staging_full(store, length, reason):
+    try:
+        store.start_upload(length)
+    except StagingFull as e:
+        assert e.reason == reason
+    else:
+        raise AssertionError('expected StagingFull')
+
+
+def test_abandoned_uploads_are_pruned_and_staging_is_capped():
+    with tempfile.TemporaryDirectory() as directory:
+        store = AssetStore(directory, staging_ttl=60, max_staged=2, max_staged_bytes=100)
+        abandoned = store.start_upload(10)
+        store.append(abandoned, 0, io.BytesIO(b'01234'))
+        active = store.start_upload(10)
+        _expect_staging_full(store, 10, 'count')
+
+        stale = time.time() - 120
+        os.utime(abandoned.path + '.json', (stale, stale))
+        assert store.staged(abandoned.upload_id) is None
+        # Starting another upload removes the abandoned one first
+        replacement = store.start_upload(80)
+        assert not os.path.exists(abandoned.path) and not os.path.exists(abandoned.path + '.json')
+        assert store.staged(active.upload_id) is not None
+
+        store.discard(replacement)
+        _expect_staging_full(store, 91, 'bytes')
+        assert store.start_upload(90).length == 90
@@ -0,0 +1,145 @@
+import io
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+import pytest
+from flask_stub import File
+
+import app as app_module
+import clothseg
+import imageprobe
+import encoding
+from clothseg import ClothSegmenter
+from tests import bench
+
+recorder = bench.Recorder()
+
+
+@pytest.fixture
+def images():
+    """Write every synthetic image to disk and yield ``{(fmt, size): path}``."""
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {}
+        for size, (width, height) in bench.sizes().items():
+            for fmt in bench.FORMATS:
+                path = os.path.join(directory, f"{size}_{fmt}{bench.extension(fmt)}")
+                with open(path, "wb") as f:
+                    f.write(bench.image_bytes(fmt, width, height))
+                paths[fmt, size] = path
+        yield paths
+
+
+def _assert_no_regressions(prefix):
+    regressions = [r for r in recorder.regressions() if r[0].startswith(prefix)]
+    assert not regressions, "slower than baseline: " + ", ".join(
+        f"{name} {ops:.1f} < {base:.1f} ops/s" for name, ops, base in regressions
+    )
+
+
+def _cases(images):
+    for (fmt, size), path in sorted(images.items()):
+        yield f"{fmt}/{size}", fmt, path
+
+
+def test_synthetic_images_have_expected_headers(images):
+    for (fmt, size), path in images.items():
+        width, height = bench.sizes()[size]
+        assert ClothSegmenter._get_image_size(path) == (width, height)
+        assert bench.legacy_image_size(path) == (width, height)
+        info = imageprobe.probe(path)
+        assert info.format == ("png" if fmt == "png" else "jpeg")
+        assert info.progressive == (fmt == "jpeg_progressive")
+
+
+def test_bench_is_allowed_image(images):
+    for name, fmt, path in _cases(images):
+        with open(path, "rb") as f:
+            upload = File(io.BytesIO(f.read()), os.path.basename(path))
+        result = recorder.run(f"is_allowed_image/{name}", lambda: app_module._is_allowed_image(upload))
+        assert result["ops_per_sec"] > 0
+    _assert_no_regressions("is_allowed_image/")
+
+
+def test_bench_get_image_size(images):
+    for name, fmt, path in _cases(images):
+        recorder.run(f"get_image_size/{name}", lambda: ClothSegmenter._get_image_size(path))
+    _assert_no_regressions("get_image_size/")
+
+
+def test_bench_probe_jpeg_with_long_app_segments():
+    """Phone photos carry EXIF, thumbnails and ICC profiles ahead of the frame header."""
+    with tempfile.TemporaryDirectory() as directory:
+        for count in (0, 4, 16):
+            path = os.path.join(directory, f"app{count}.jpg")
+            with open(path, "wb") as f:
+                f.write(bench.with_segments(bench.jpeg_bytes(320, 240), bench.exif_segment(6),
+                                            bench.app_segments(count)))
+            with open(path, "rb") as f:
+                data = f.read()
+            assert imageprobe.probe(path)[:4] == ("jpeg", 320, 240, 6)
+            assert bench.legacy_image_size(path) == (320, 240)
+            recorder.run(f"probe_legacy/app{count}", lambda: bench.legacy_image_size(path))
+            recorder.run(f"probe_path/app{count}", lambda: imageprobe.probe(path))
+            recorder.run(f"probe_file/app{count}", lambda: imageprobe.probe_file(io.BytesIO(data)))
+    _assert_no_regressions("probe_")
+
+
+def test_bench_parse_header_split(images):
+    segmenter = ClothSegmenter(model_path="/nonexistent")
+    with patch.object(clothseg, "cv2", None), patch.object(clothseg, "torch", None):
+        for name, fmt, path in _cases(images):
+            result = recorder.run(f"parse_header_split/{name}", lambda: segmenter.parse(path))
+    assert result["peak_kib"] >= 0
+    _assert_no_regressions("parse_header_split/")
+
+
+def test_bench_grabcut_and_classify(images):
+    if clothseg.cv2 is None:
+        recorder.skip("parse_grabcut", "OpenCV not installed")
+        recorder.skip("classify", "OpenCV not installed")
+        return
+    segmenter = ClothSegmenter(model_path="/nonexistent")
+    for name, fmt, path in _cases(images):
+        recorder.run(f"parse_grabcut/{name}", lambda: segmenter._parse_grabcut(path), min_iterations=1)
+        parts = segmenter._parse_grabcut(path)
+        recorder.run(f"classify/{name}", lambda: segmenter.classify(path, parts))
+    _assert_no_regressions("parse_grabcut/")
+    _assert_no_regressions("classify/")
+
+
+def test_bench_reduced_decode(images):
+    if clothseg.cv2 is None:
+        recorder.skip("decode_full", "OpenCV not installed")
+        recorder.skip("decode_classify", "OpenCV not installed")
+        return
+    segmenter = ClothSegmenter(model_path="/nonexistent")
+    for name, fmt, path in _cases(images):
+        if fmt == "png":
+            continue
+        recorder.run(f"decode_full/{name}", lambda: segmenter._read_image(path))
+        img, reduction, _ = segmenter._read_image(path, clothseg.CLASSIFY_RESOLUTION)
+        assert max(img.shape[:2]) >= min(clothseg.CLASSIFY_RESOLUTION, max(bench.sizes()[name.split("/")[1]]))
+        recorder.run(f"decode_classify/{name}",
+                     lambda: segmenter._read_image(path, clothseg.CLASSIFY_RESOLUTION))
+    _assert_no_regressions("decode_")
+
+
+def test_bench_response_encoding():
+    for size, (width, height) in sorted(bench.sizes().items()):
+        payload = bench.parts_payload(width, height)
+        # What Flask's default provider does: sorted keys, ASCII escapes
+        recorder.run(f"json_stdlib/{size}",
+                     lambda: json.dumps(payload, sort_keys=True, ensure_ascii=True, separators=(",", ":")),
+                     min_iterations=1)
+        recorder.run(f"json_fast/{size}", lambda: encoding.dumps(payload), min_iterations=1)
+        body = encoding.dumps(payload).encode()
+        recorder.run(f"compress_gzip/{size}", lambda: encoding.compress(body, "gzip"), min_iterations=1)
+        assert len(encoding.compress(body, "gzip")) < len(body) // 20
+        if encoding.brotli is None:
+            recorder.skip(f"compress_br/{size}", "brotli not installed")
+        else:
+            recorder.run(f"compress_br/{size}", lambda: encoding.compress(body, "br"), min_iterations=1)
+    _assert_no_regressions("json_")
+    _assert_no_regressions("compress_")
@@ -0,0 +1,249 @@
+import json
+import os
+import struct
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import clothseg
+from clothseg import ClothSegmenter
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'sample.png')
+
+
+def test_settings_are_read_from_config_at_startup():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'clothseg.json')
+        with open(path, 'w') as f:
+            json.dump({'threads': 3, 'working_resolution': 512, 'tier': 'grabcut', 'unknown': 1}, f)
+        fake_cv2 = MagicMock()
+        with patch.dict(os.environ, {'CLOTHSEG_CONFIG': path}), patch.object(clothseg, 'cv2', fake_cv2):
+            segmenter = ClothSegmenter(model_path='/nonexistent')
+        fake_cv2.setNumThreads.assert_called_once_with(3)
+    assert segmenter.settings == {'threads': 3, 'batch_size': 1, 'working_resolution': 512}
+    assert segmenter._working_scale(1024, 768) == 0.5
+    assert segmenter._working_scale(400, 300) == 1.0
+
+
+def test_unreadable_config_falls_back_to_defaults():
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        f.write('{not json')
+    try:
+        segmenter = ClothSegmenter(model_path='/nonexistent', config_path=f.name)
+    finally:
+        os.remove(f.name)
+    assert segmenter.settings == clothseg.DEFAULT_SETTINGS
+
+
+def test_box_helpers():
+    assert clothseg.box_iou([0, 0, 10, 10], [0, 0, 10, 10]) == 1.0
+    assert clothseg.box_iou([0, 0, 10, 10], [5, 0, 15, 10]) == 50 / 150
+    assert clothseg.box_iou(None, None) == 1.0
+    assert clothseg._full_box({'full_body': [[1, 2, 3, 4]]}) == [1, 2, 3, 4]
+    mask = [[0, 0, 0], [0, 1, 1], [0, 1, 0]]
+    assert clothseg._full_box({'full_body': mask}) == [1, 1, 2, 2]
+
+
+def test_autotune_without_opencv_reports_header_split():
+    segmenter = ClothSegmenter(model_path='/nonexistent')
+    with patch.object(clothseg, 'cv2', None), patch.object(clothseg, 'torch', None):
+        result = clothseg.autotune(segmenter, [SAMPLE], repeat=1)
+    assert set(result['tiers']) == {'header_split'}
+    assert result['tier'] == 'header_split'
+    assert result['tiers']['header_split'][0]['ms_per_image'] >= 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'nested', 'clothseg.json')
+        clothseg.write_settings(path, result)
+        assert ClothSegmenter.load_settings(path) == clothseg.DEFAULT_SETTINGS
+        with open(path) as f:
+            assert json.load(f)['tier'] == 'header_split'
+
+
+
+def test_autotune_restores_thread_counts_after_a_failure():
+    fake_torch = MagicMock()
+    fake_torch.get_num_threads.return_value = 6
+    segmenter = ClothSegmenter(model_path='/nonexistent')
+    reference = [{'full_body': [[0, 0, 10, 10]]}]
+    with patch.object(clothseg, 'cv2', None), patch.object(clothseg, 'torch', fake_torch), \
+            patch.object(segmenter, 'load_model', return_value=True), \
+            patch.object(segmenter, 'parse_batch', side_effect=[reference, RuntimeError('out of memory')]):
+        try:
+            clothseg.autotune(segmenter, [SAMPLE], repeat=1, threads=[1])
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('expected RuntimeError')
+    assert fake_torch.set_num_threads.call_args_list[-1].args == (6,)
+    assert segmenter.settings == clothseg.DEFAULT_SETTINGS
+
+def test_deadline_skips_tiers_that_cannot_finish():
+    from deadlines import Deadline, deadline_scope
+    segmenter = ClothSegmenter(model_path='/nonexistent')
+    segmenter.tier_seconds = {'grabcut': 5.0}
+    with patch.object(segmenter, 'available_tiers', return_value=['grabcut', 'header_split']):
+        assert segmenter._tiers() == ['grabcut', 'header_split']
+        with deadline_scope(Deadline(1)):
+            assert segmenter._tiers() == ['header_split']
+        with deadline_scope(Deadline(10)):
+            assert segmenter._tiers() == ['grabcut', 'header_split']
+
+
+def test_tier_times_are_averaged_per_image():
+    segmenter = ClothSegmenter(model_path='/nonexistent')
+    segmenter._record_tier('grabcut', seconds=1.0)
+    segmenter._record_tier('grabcut', count=2, seconds=4.0)
+    assert abs(segmenter.tier_seconds['grabcut'] - 1.2) < 1e-9
+
+
+def test_decode_reduction_enforces_pixel_budget():
+    with patch.object(clothseg, 'MAX_IMAGE_PIXELS', 1000):
+        assert clothseg.decode_reduction('png', 40, 25) == 1
+        for fmt in ('png', 'jpeg'):
+            try:
+                clothseg.decode_reduction(fmt, 100, 100)
+            except clothseg.ImageTooLarge as e:
+                assert (e.width, e.height) == (100, 100)
+            else:
+                raise AssertionError('ImageTooLarge not raised')
+        with patch.object(clothseg, 'OVERSIZE_POLICY', 'reduce'):
+            assert clothseg.decode_reduction('jpeg', 100, 100) == 4
+            assert clothseg.decode_reduction('jpeg', 250, 120) == 8
+            try:
+                clothseg.decode_reduction('png', 100, 100)
+            except clothseg.ImageTooLarge:
+                pass
+            else:
+                raise AssertionError('PNGs cannot be reduced while decoding')
+
+
+def test_over_budget_image_is_never_decoded():
+    from tests import bench
+    fake_cv2 = MagicMock()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'big.png')
+        with open(path, 'wb') as f:
+            f.write(bench.png_bytes(64, 48))
+        segmenter = ClothSegmenter(model_path='/nonexistent')
+        assert segmenter._get_image_info(path)[:3] == ('png', 64, 48)
+        with patch.object(clothseg, 'MAX_IMAGE_PIXELS', 1000), patch.object(clothseg, 'cv2', fake_cv2):
+            assert segmenter._parse_grabcut(path) == {}
+            parts = {'full_body': [[0, 0, 64, 48]]}
+            assert segmenter.classify(path, parts) == {'category': 'unknown', 'color': 'unknown'}
+            assert segmenter.parse(path)['full_body'] == [[0, 0, 64, 48]]
+    fake_cv2.imread.assert_not_called()
+
+
+class _ListTensor:
+    """Just enough of a torch tensor, backed by nested lists."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def float(self):
+        return self
+
+    def permute(self, *axes):
+        return self
+
+    def unsqueeze(self, dim):
+        return self
+
+    def squeeze(self):
+        return self
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+    def tolist(self):
+        return self.data
+
+    def __truediv__(self, value):
+        return self
+
+    def __gt__(self, value):
+        def compare(a):
+            return [compare(x) for x in a] if isinstance(a, list) else int(a > value)
+        return _ListTensor(compare(self.data))
+
+    def __getitem__(self, item):
+        return _ListTensor(self.data[item])
+
+
+def test_over_budget_model_masks_become_boxes():
+    from tests import bench
+    decoded = []
+
+    class FakeImage:
+        def draft(self, mode, size):
+            decoded.append(size)
+
+        def convert(self, mode):
+            return self
+
+    def model(tensor):
+        # A garment in the middle half of whatever resolution the model sees
+        height, width = len(tensor.data), len(tensor.data[0])
+        mask = [[int(width // 4 <= x < 3 * width // 4 and height // 4 <= y < 3 * height // 4)
+                 for x in range(width)] for y in range(height)]
+        return _ListTensor([[mask, [[0] * width for _ in range(height)], mask]])
+
+    fake_torch = MagicMock()
+    fake_torch.jit.load.return_value = MagicMock(side_effect=model)
+    fake_torch.from_numpy = _ListTensor
+    fake_np = MagicMock()
+    fake_np.array = lambda image: [[[0, 0, 0]] * decoded[-1][0] for _ in range(decoded[-1][1])]
+    fake_pil = MagicMock()
+    fake_pil.open.return_value = FakeImage()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'big.jpg')
+        with open(path, 'wb') as f:
+            f.write(bench.jpeg_bytes(320, 240))
+        with patch.object(clothseg, 'torch', fake_torch, create=True), \
+                patch.object(clothseg, 'Image', fake_pil, create=True), \
+                patch.object(clothseg, 'np', fake_np), \
+                patch.object(clothseg, 'MAX_IMAGE_PIXELS', 20000), \
+                patch.object(clothseg, 'OVERSIZE_POLICY', 'reduce'):
+            segmenter = ClothSegmenter(model_path=path)
+            result = segmenter._parse_torch([path])[0]
+    assert decoded == [(160, 120)]
+    # Boxes in the original 320x240 coordinates, not 76800-pixel masks
+    assert result == {
+        'upper_body': [[80, 60, 239, 179]],
+        'lower_body': [],
+        'full_body': [[80, 60, 239, 179]],
+    }
+    assert clothseg._full_box(result) == [80, 60, 239, 179]
+
+def test_decode_reduction_meets_target_size():
+    assert clothseg.decode_reduction('jpeg', 4000, 3000, target=256) == 8
+    assert clothseg.decode_reduction('jpeg', 4000, 3000, target=1024) == 2
+    assert clothseg.decode_reduction('jpeg', 1600, 1200, target=2048) == 1
+    # Only JPEG decoders can scale while decoding
+    assert clothseg.decode_reduction('png', 4000, 3000, target=256) == 1
+    with patch.object(clothseg, 'MAX_IMAGE_PIXELS', 1000000), patch.object(clothseg, 'OVERSIZE_POLICY', 'reduce'):
+        # The budget wins over a larger target
+        assert clothseg.decode_reduction('jpeg', 4000, 3000, target=2000) == 4
+
+
+def test_classify_decodes_at_reduced_scale():
+    from tests import bench
+    fake_cv2 = MagicMock()
+    fake_cv2.IMREAD_REDUCED_COLOR_8 = 65
+    fake_cv2.imread.return_value = None
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'photo.jpg')
+        with open(path, 'wb') as f:
+            # Only the headers of a 4000x3000 photo taken in portrait
+            frame = struct.pack('>BBHBHHB', 0xFF, 0xC0, 17, 8, 3000, 4000, 3) + b'\x01\x11\x00\x02\x11\x00\x03\x11\x00'
+            f.write(b'\xff\xd8' + bench.exif_segment(6) + frame)
+        segmenter = ClothSegmenter(model_path='/nonexistent')
+        assert segmenter._get_image_info(path)[:4] == ('jpeg', 4000, 3000, 6)
+        with patch.object(clothseg, 'cv2', fake_cv2):
+            segmenter.classify(path, {'full_body': [[0, 0, 3000, 4000]]})
+        # Header split boxes follow the EXIF orientation, like decoded images
+        assert segmenter._parse_header_split(path)['full_body'] == [[0, 0, 3000, 4000]]
+    fake_cv2.imread.assert_called_once_with(path, 65)
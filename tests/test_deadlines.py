@@ -0,0 +1,42 @@
+import os
+import time
+from unittest.mock import patch
+
+from deadlines import (
+    Deadline, DeadlineExceeded, check_deadline, current_deadline, deadline_from_headers, deadline_scope,
+    remaining,
+)
+
+
+def test_header_shortens_but_never_extends_the_default():
+    with patch.dict(os.environ, {'REQUEST_TIMEOUT': '30'}):
+        assert deadline_from_headers({}).seconds == 30
+        assert deadline_from_headers({'X-Request-Timeout': '2.5'}).seconds == 2.5
+        assert deadline_from_headers({'X-Request-Timeout': '90'}).seconds == 30
+        assert deadline_from_headers({'X-Request-Timeout': 'soon'}).seconds == 30
+    with patch.dict(os.environ, {'REQUEST_TIMEOUT': ''}):
+        assert deadline_from_headers({}) is None
+        assert deadline_from_headers({'X-Request-Timeout': '-1'}) is None
+        assert deadline_from_headers({'X-Request-Timeout': '4'}).seconds == 4
+
+
+def test_scope_makes_deadline_current():
+    assert current_deadline() is None and remaining() is None
+    check_deadline('anything')  # no deadline, nothing to enforce
+    with deadline_scope(Deadline(10)) as deadline:
+        assert current_deadline() is deadline
+        assert 9 < remaining() <= 10
+        check_deadline('stage')
+    assert current_deadline() is None
+
+
+def test_expired_deadline_raises():
+    with deadline_scope(Deadline(0.01)):
+        time.sleep(0.02)
+        assert remaining() == 0.0
+        try:
+            check_deadline('grabcut')
+        except DeadlineExceeded as e:
+            assert e.where == 'grabcut'
+        else:
+            raise AssertionError('DeadlineExceeded not raised')
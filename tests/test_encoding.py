@@ -0,0 +1,89 @@
+import datetime
+import gzip
+import json
+from unittest import mock
+
+import encoding
+from encoding import accepted_encoding, compress_response, dumps, json_provider
+
+
+class FakeResponse:
+    """The parts of a Flask response :func:`compress_response` uses."""
+
+    def __init__(self, data: bytes, mimetype='application/json', status_code=200):
+        self.data = data
+        self.mimetype = mimetype
+        self.status_code = status_code
+        self.headers = {}
+        self.vary = set()
+        self.direct_passthrough = False
+        self.is_streamed = False
+
+    def get_data(self):
+        return self.data
+
+    def set_data(self, data):
+        self.data = data
+
+
+def test_dumps_is_compact_and_keeps_key_order():
+    payload = {'parts': {'top': [[1, 2, 3, 4]]}, 'id': 7, 'name': 'café'}
+    text = dumps(payload)
+    assert text == '{"parts":{"top":[[1,2,3,4]]},"id":7,"name":"café"}'
+    assert json.loads(text) == payload
+
+
+def test_dumps_falls_back_to_the_standard_library():
+    payload = {2: 'two', 'when': datetime.date(2024, 5, 1)}
+    with mock.patch.object(encoding, 'orjson', None):
+        fallback = dumps(payload, default=str)
+    assert fallback == '{"2":"two","when":"2024-05-01"}'
+    assert dumps(payload, default=str) == fallback
+
+
+def test_provider_keeps_indented_output_for_debugging():
+    class Base:
+        def __init__(self, app):
+            self.app = app
+
+        def default(self, o):
+            return str(o)
+
+        def dumps(self, obj, **kwargs):
+            return 'base'
+
+    provider = json_provider(Base)(None)
+    assert provider.dumps({'b': 1, 'a': [1, 2]}) == '{"b":1,"a":[1,2]}'
+    assert provider.dumps({'a': 1}, indent=2) == 'base'
+    assert provider.sort_keys is False
+
+
+def test_accepted_encoding_honours_quality_values():
+    with mock.patch.object(encoding, 'brotli', None):
+        assert accepted_encoding('gzip, deflate, br') == 'gzip'
+    assert accepted_encoding('gzip;q=0, deflate') is None
+    assert accepted_encoding('identity') is None
+    assert accepted_encoding('') is None
+    assert accepted_encoding('*') == 'gzip'
+
+
+def test_large_json_is_gzipped_for_clients_that_accept_it():
+    body = json.dumps({'mask': [[0, 1] * 64] * 64}).encode()
+    with mock.patch.object(encoding, 'brotli', None):
+        response = compress_response(FakeResponse(body), 'gzip, br')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert len(response.data) < len(body) // 10
+    assert gzip.decompress(response.data) == body
+
+
+def test_small_unaccepted_and_binary_bodies_are_left_alone():
+    large = b'{"a": "' + b'x' * 4096 + b'"}'
+    for response, accept in (
+        (FakeResponse(b'{"a":1}'), 'gzip'),
+        (FakeResponse(large), 'identity'),
+        (FakeResponse(large, mimetype='image/png'), 'gzip'),
+        (FakeResponse(large, status_code=304), 'gzip'),
+    ):
+        assert compress_response(response, accept).data == response.data
+        assert 'Content-Encoding' not in response.headers
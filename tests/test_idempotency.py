@@ -0,0 +1,72 @@
+import threading
+import time
+
+from idempotency import IdempotencyStore, KeyConflict
+
+
+def test_repeat_is_replayed_and_different_request_conflicts():
+    store = IdempotencyStore()
+    calls = []
+
+    def work():
+        calls.append(1)
+        return len(calls)
+
+    assert store.run('k', 'a', work) == (1, 'executed')
+    assert store.run('k', 'a', work) == (1, 'replayed')
+    assert calls == [1]
+    try:
+        store.run('k', 'b', work)
+    except KeyConflict:
+        pass
+    else:
+        raise AssertionError('expected KeyConflict')
+
+
+def test_concurrent_repeat_joins_the_running_request():
+    store = IdempotencyStore()
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    leader = threading.Thread(target=lambda: results.append(store.run('k', 'a', slow)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(store.run('k', 'a', lambda: 'again')))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert sorted(results) == [('done', 'executed'), ('done', 'joined')]
+
+
+def test_failures_are_not_kept():
+    store = IdempotencyStore()
+
+    def boom():
+        raise RuntimeError('boom')
+
+    try:
+        store.run('k', 'a', boom)
+    except RuntimeError:
+        pass
+    assert store.run('k', 'a', lambda: 503, keep=lambda status: status < 500) == (503, 'executed')
+    assert store.run('k', 'a', lambda: 200) == (200, 'executed')
+    assert store.run('k', 'a', lambda: 201) == (200, 'replayed')
+
+
+def test_store_is_bounded_and_expires():
+    store = IdempotencyStore(max_entries=2, ttl=60)
+    for key in 'abc':
+        store.run(key, 'f', lambda: key)
+    assert len(store) == 2
+    assert store.run('a', 'f', lambda: 'rerun') == ('rerun', 'executed')
+    store = IdempotencyStore(ttl=0.01)
+    store.run('k', 'f', lambda: 1)
+    time.sleep(0.02)
+    assert store.run('k', 'f', lambda: 2) == (2, 'executed')
@@ -0,0 +1,68 @@
+import io
+import os
+import struct
+import tempfile
+
+import imageprobe
+from tests import bench
+
+
+def _probe_all(data):
+    """Probe ``data`` as bytes, as a file object and as a path; all must agree."""
+    results = {imageprobe.probe_bytes(data), imageprobe.probe_file(io.BytesIO(data))}
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(data)
+    try:
+        results.add(imageprobe.probe(f.name))
+    finally:
+        os.remove(f.name)
+    assert len(results) == 1, results
+    return results.pop()
+
+
+def test_png_and_jpeg():
+    assert _probe_all(bench.png_bytes(30, 20)) == ('png', 30, 20, 1, False)
+    assert _probe_all(bench.jpeg_bytes(64, 48)) == ('jpeg', 64, 48, 1, False)
+    assert _probe_all(bench.jpeg_bytes(64, 48, progressive=True)) == ('jpeg', 64, 48, 1, True)
+
+
+def test_jpeg_exif_orientation_and_long_app_segments():
+    jpeg = bench.jpeg_bytes(64, 48)
+    for big_endian in (False, True):
+        info = _probe_all(bench.with_segments(jpeg, bench.exif_segment(6, big_endian)))
+        assert (info.width, info.height, info.orientation) == (64, 48, 6)
+        assert info.display_size == (48, 64)
+    # The frame header sits well beyond the first probe buffer
+    padded = bench.with_segments(jpeg, bench.exif_segment(3), bench.app_segments(5))
+    assert len(padded) > 4 * imageprobe.PROBE_BYTES
+    info = _probe_all(padded)
+    assert (info.width, info.height, info.orientation) == (64, 48, 3)
+    assert info.display_size == (64, 48)
+
+
+def test_gif_and_webp():
+    assert _probe_all(b'GIF89a' + struct.pack('<HH', 300, 200) + b'\x00' * 10)[:3] == ('gif', 300, 200)
+    lossy = b'RIFF\x00\x00\x00\x00WEBPVP8 \x00\x00\x00\x00\x00\x00\x00\x9d\x01\x2a' + struct.pack('<HH', 640, 480)
+    assert _probe_all(lossy)[:3] == ('webp', 640, 480)
+    bits = (640 - 1) | ((480 - 1) << 14)
+    lossless = b'RIFF\x00\x00\x00\x00WEBPVP8L\x00\x00\x00\x00\x2f' + struct.pack('<I', bits)
+    assert _probe_all(lossless)[:3] == ('webp', 640, 480)
+    extended = b'RIFF\x00\x00\x00\x00WEBPVP8X\x00\x00\x00\x00\x00\x00\x00\x00' + (4000 - 1).to_bytes(3, 'little') \
+        + (3000 - 1).to_bytes(3, 'little')
+    assert _probe_all(extended)[:3] == ('webp', 4000, 3000)
+
+
+def test_unknown_and_truncated_files():
+    jpeg = bench.jpeg_bytes(64, 48)
+    frame = jpeg.index(b'\xff\xc0')
+    for data in (b'', b'not an image at all', b'\x89PNG\r\n\x1a\n', jpeg[:frame + 4], b'RIFF\x00\x00\x00\x00WEBPVP8 '):
+        assert _probe_all(data) == imageprobe.UNKNOWN
+    assert imageprobe.probe('/nonexistent/image.png') == imageprobe.UNKNOWN
+
+
+def test_sniff_reads_only_the_signature():
+    assert imageprobe.sniff(bench.png_bytes(30, 20)[:imageprobe.SNIFF_BYTES]) == 'png'
+    assert imageprobe.sniff(bench.jpeg_bytes(64, 48)[:imageprobe.SNIFF_BYTES]) == 'jpeg'
+    assert imageprobe.sniff(b'GIF87a') == 'gif'
+    assert imageprobe.sniff(b'RIFF\x00\x00\x00\x00WEBP') == 'webp'
+    assert imageprobe.sniff(b'%PDF-1.7') is None
@@ -0,0 +1,104 @@
+import email
+import socket
+import threading
+import time
+
+import pytest
+
+import loadtest
+import openai_stub
+import serve
+
+
+def _flaky_app(environ, start_response):
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    environ['wsgi.input'].read(length)
+    if environ['PATH_INFO'] == '/suggest':
+        start_response('502 Bad Gateway', [('Content-Type', 'text/plain')])
+        return [b'upstream failed']
+    time.sleep(0.01)
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [b'{}']
+
+
+@pytest.fixture
+def server_url():
+    sock = socket.create_server(('127.0.0.1', 0))
+    sock.setblocking(False)
+    server = serve.WorkerServer(sock, _flaky_app, threads=4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{sock.getsockname()[1]}'
+    server.shutdown()
+    server.server_close()
+    sock.close()
+
+
+def test_percentile_nearest_rank():
+    values = [i / 1000 for i in range(1, 101)]
+    assert loadtest.percentile(values, 50) == 0.05
+    assert loadtest.percentile(values, 99) == 0.099
+    assert loadtest.percentile(values, 100) == 0.1
+    assert loadtest.percentile([], 99) == 0.0
+
+
+def test_parse_mix_and_sizes():
+    assert loadtest.parse_mix('upload=3,suggest') == {'upload': 3.0, 'suggest': 1.0}
+    assert loadtest.parse_sizes('640x480, 10X20') == [(640, 480), (10, 20)]
+    try:
+        loadtest.parse_mix('nope=1')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError not raised')
+
+
+def test_upload_request_is_valid_multipart():
+    factory = loadtest.RequestFactory([(16, 16)], formats=['png'], items_per_upload=2, seed=1)
+    path, body, content_type = factory.build('upload')
+    assert path == '/upload'
+    message = email.message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+    names = [part.get_param('name', header='content-disposition') for part in message.get_payload()]
+    assert names == ['full_body_image', 'clothing_item_images', 'clothing_item_images']
+    assert message.get_payload()[0].get_payload(decode=True).startswith(b'\x89PNG')
+
+
+def test_standin_injects_latency_and_errors():
+    standin = loadtest.StandInOpenAI(chat_latency=0.02, image_latency=0.0, jitter=0.0, seed=0)
+    start = time.perf_counter()
+    chat = standin.ChatCompletion.create(messages=[{'role': 'user', 'content': 'hi'}], model='m')
+    assert time.perf_counter() - start >= 0.02
+    assert chat.choices[0].message.content == 'AI suggestion based on hi'
+
+    failing = loadtest.StandInOpenAI(chat_latency=0, image_latency=0, error_rate=1.0)
+    try:
+        failing.Image.create(prompt='x')
+    except openai_stub.error.OpenAIError:
+        pass
+    else:
+        raise AssertionError('OpenAIError not raised')
+
+
+def test_run_load_reports_per_endpoint(server_url):
+    factory = loadtest.RequestFactory([(16, 16)], formats=['jpeg'], seed=2)
+    stats, elapsed = loadtest.run_load(
+        server_url, {'analyze': 3, 'suggest': 1}, factory, concurrency=4, duration=10, requests=40, seed=3
+    )
+    report = stats.summary(elapsed)
+    assert report['total']['requests'] == 40
+    assert report['analyze']['error_rate'] == 0.0
+    assert report['suggest']['error_rate'] == 1.0
+    assert report['suggest']['statuses'] == {'502': report['suggest']['requests']}
+    assert report['analyze']['p50_ms'] >= 10
+    assert report['analyze']['p99_ms'] >= report['analyze']['p50_ms']
+    assert 'total' in loadtest.format_report(report).splitlines()[-1]
+
+
+def test_standin_honours_request_timeout():
+    standin = loadtest.StandInOpenAI(chat_latency=0.5, jitter=0.0)
+    start = time.monotonic()
+    try:
+        standin.ChatCompletion.create(messages=[{'role': 'user', 'content': 'hi'}], request_timeout=0.01)
+    except openai_stub.error.Timeout:
+        assert time.monotonic() - start < 0.4
+    else:
+        raise AssertionError('Timeout not raised')
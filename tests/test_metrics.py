@@ -0,0 +1,67 @@
+import os
+import json
+import tempfile
+
+import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    hist = metrics.Histogram('t_seconds', 'Test', ['route'], registry=registry, buckets=(0.1, 1.0))
+    hist.observe(0.05, route='/a')
+    hist.observe(0.5, route='/a')
+    hist.observe(5, route='/a')
+    text = registry.render()
+    assert '# TYPE t_seconds histogram' in text
+    assert 't_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 't_seconds_bucket{route="/a",le="1"} 2' in text
+    assert 't_seconds_bucket{route="/a",le="+Inf"} 3' in text
+    assert 't_seconds_count{route="/a"} 3' in text
+    assert 't_seconds_sum{route="/a"} 5.55' in text
+
+
+def test_counter_and_gauge_labels_are_escaped():
+    registry = metrics.Registry()
+    counter = metrics.Counter('c_total', 'Test', ['name'], registry=registry)
+    gauge = metrics.Gauge('g', 'Test', registry=registry)
+    counter.inc(name='a"b')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    text = registry.render()
+    assert 'c_total{name="a\\"b"} 1' in text
+    assert 'g 1' in text.splitlines()
+
+
+def test_stage_records_current_route():
+    @metrics.instrument_route('/stage-test')
+    def view():
+        with metrics.stage('work'):
+            pass
+        return 'ok', 201
+
+    assert view() == ('ok', 201)
+    assert metrics.STAGE_DURATION.count(route='/stage-test', stage='work') == 1
+    assert metrics.REQUESTS_TOTAL.value(route='/stage-test', status='201') == 1
+    assert metrics.REQUESTS_IN_FLIGHT.value(route='/stage-test') == 0
+
+
+def test_registry_merges_process_snapshots():
+    with tempfile.TemporaryDirectory() as directory:
+        registry = metrics.Registry(directory)
+        counter = metrics.Counter('m_total', 'Test', registry=registry)
+        gauge = metrics.Gauge('m_gauge', 'Test', registry=registry)
+        counter.inc(2)
+        gauge.set(3)
+        # A snapshot left behind by a worker that has exited
+        dead_pid = 2 ** 22 + 12345
+        with open(os.path.join(directory, f'metrics-{dead_pid}.json'), 'w') as f:
+            json.dump({
+                'm_total': {'type': 'counter', 'help': 'Test', 'labelnames': [], 'values': [[[], 5.0]]},
+                'm_gauge': {'type': 'gauge', 'help': 'Test', 'labelnames': [], 'values': [[[], 7.0]]},
+            }, f)
+        text = registry.render()
+        assert 'm_total 7' in text.splitlines()
+        assert 'm_gauge 3' in text.splitlines()
+        assert not os.path.exists(os.path.join(directory, f'metrics-{dead_pid}.json'))
+        assert 'm_total 7' in registry.render().splitlines()
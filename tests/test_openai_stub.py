@@ -17,3 +17,10 @@ def test_image_invalid_prompt():
         pass
     else:
         raise AssertionError("OpenAIError not raised")
+
+
+def test_responses_allow_attribute_access():
+    chat = openai_stub.ChatCompletion.create(messages=[{"role": "user", "content": "hi"}])
+    assert chat.choices[0].message.content == chat["choices"][0]["message"]["content"]
+    assert chat == {"choices": [{"message": {"content": "AI suggestion based on hi"}}]}
+    assert openai_stub.Image.create(prompt="a b").data[0].url == "https://example.com/a_b.png"
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+import outfits
+
+
+def test_rank_outfits_pairs_tops_with_bottoms():
+    items = [
+        {'category': 'shirt', 'color': 'blue'},
+        {'category': 'shirt', 'color': 'red'},
+        {'category': 'pants', 'color': 'black'},
+    ]
+    candidates = outfits.rank_outfits(items, limit=5)
+    assert [c['items'] for c in candidates] == [[0, 2], [1, 2]]
+    assert all(0 < c['score'] <= 1 for c in candidates)
+
+
+def test_rank_outfits_dress_stands_alone():
+    items = [
+        {'category': 'dress', 'color': 'green'},
+        {'category': 'shirt', 'color': 'white'},
+    ]
+    assert outfits.rank_outfits(items) == [{'items': [0], 'score': outfits.SINGLE_DRESS_SCORE}]
+
+
+def test_rank_outfits_limit_and_empty():
+    items = [{'category': 'shirt', 'color': 'white'}] * 10 + [{'category': 'pants', 'color': 'blue'}] * 10
+    assert len(outfits.rank_outfits(items, limit=3)) == 3
+    assert outfits.rank_outfits([]) == []
+    assert outfits.rank_outfits([{'category': 'shirt', 'color': 'red'}]) == []
+
+
+def test_rank_outfits_python_fallback_matches():
+    items = [
+        {'category': 'shirt', 'color': 'blue'},
+        {'category': 'pants', 'color': 'orange'},
+        {'category': 'pants', 'color': 'gray'},
+        {'category': 'dress', 'color': 'purple'},
+        {'category': 'unknown', 'color': 'unknown'},
+    ]
+    expected = outfits.rank_outfits(items, limit=10)
+    with patch.object(outfits, 'np', None):
+        fallback = outfits.rank_outfits(items, limit=10)
+    assert sorted(map(str, fallback)) == sorted(map(str, expected))
+
+
+def test_color_harmony_rules():
+    assert outfits.color_harmony('black', 'red') > outfits.color_harmony('red', 'green')
+    assert outfits.color_harmony('blue', 'orange') > outfits.color_harmony('blue', 'blue')
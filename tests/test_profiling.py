@@ -0,0 +1,96 @@
+import os
+import pstats
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import profiling
+
+
+def busy_work(seconds=0.05):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += 1
+    return total
+
+
+def test_rate_limiter_window():
+    limiter = profiling.RateLimiter(2, window=60)
+    assert limiter.allow()
+    assert limiter.allow()
+    assert not limiter.allow()
+    limiter.window = 0
+    assert limiter.allow()
+
+
+def test_check_requires_matching_token():
+    store = profiling.ProfileStore('/nonexistent', token='secret', limit=1)
+    assert store.check('wrong') == 'denied'
+    assert store.check(None) == 'denied'
+    assert store.check('secret') == 'ok'
+    assert store.check('secret') == 'rate_limited'
+    assert profiling.ProfileStore('/nonexistent').check('anything') == 'denied'
+
+
+def test_check_denies_non_ascii_tokens():
+    assert profiling.ProfileStore('/nonexistent', token='secret').check('é') == 'denied'
+    assert profiling.ProfileStore('/nonexistent', token='sécret').check('sécret') == 'ok'
+
+
+def test_resolve_format_avoids_sampling_greenlets():
+    assert profiling.resolve_format('pstats') == 'pstats'
+    assert profiling.resolve_format('bogus') == 'collapsed'
+    monkey = MagicMock()
+    monkey.is_module_patched.return_value = True
+    with patch.dict(sys.modules, {'gevent.monkey': monkey}):
+        assert profiling.resolve_format('collapsed') == 'pstats'
+        assert profiling.resolve_format(None) == 'pstats'
+
+
+def test_frame_label_without_qualname():
+    class Code:
+        co_name = 'parse'
+
+    class Frame:
+        f_globals = {'__name__': 'clothseg'}
+        f_code = Code()
+
+    assert profiling._frame_label(Frame()) == 'clothseg:parse'
+
+
+def test_collapsed_profile_samples_request_and_cpu_threads():
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def handler():
+        busy_work()
+        return executor.submit(profiling.track_thread(busy_work)).result()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = profiling.ProfileStore(directory, token='t', interval=0.001)
+        result, profile_id = store.run(handler, label='/parse')
+        executor.shutdown()
+        assert result > 0
+        with open(store.path_for(profile_id)) as f:
+            lines = f.read().splitlines()
+    assert lines[0].startswith('# /parse samples=')
+    stacks = dict(line.rsplit(' ', 1) for line in lines[1:])
+    # Request thread stacks start at the handler, cpu thread stacks at the task
+    roots = {stack.split(';')[0].split(':')[1] for stack in stacks}
+    assert roots == {'test_collapsed_profile_samples_request_and_cpu_threads.<locals>.handler', 'busy_work'}
+    assert profiling.track_thread(busy_work) is busy_work
+
+
+def test_pstats_profile_and_pruning():
+    with tempfile.TemporaryDirectory() as directory:
+        store = profiling.ProfileStore(directory, token='t', keep=2)
+        ids = []
+        for _ in range(3):
+            _, profile_id = store.run(lambda: busy_work(0.001), fmt='pstats')
+            ids.append(profile_id)
+            time.sleep(0.01)
+        assert sorted(os.listdir(directory)) == sorted(f'{i}.prof' for i in ids[1:])
+        stats = pstats.Stats(store.path_for(ids[-1], 'pstats'))
+        assert any(func[2] == 'busy_work' for func in stats.stats)
@@ -0,0 +1,66 @@
+import os
+import types
+from unittest.mock import patch
+
+import prompts
+from metrics import REGISTRY
+
+
+def test_items_keep_the_familiar_format_and_group_duplicates():
+    items = [
+        {'category': 'shirt', 'color': 'white'},
+        {'category': 'pants', 'color': 'unknown'},
+        {'category': 'shirt', 'color': 'white'},
+        {'color': 'red'},
+    ]
+    assert prompts.format_items(items[:2]) == 'Item 1: A white shirt\nItem 2: A pants'
+    assert prompts.format_items(items) == 'Items 1, 3: A white shirt\nItem 2: A pants\nItem 4: A red item'
+    assert prompts.format_items(items, [0, 3]) == 'Item 1: A white shirt\nItem 4: A red item'
+
+
+def test_long_item_lists_are_cut_to_the_budget():
+    items = [{'category': f'item{i}', 'color': 'blue'} for i in range(60)]
+    text = prompts.format_items(items, tokens=50)
+    assert text.startswith('Item 1: A blue item0\n')
+    assert text.endswith('more items')
+    assert prompts.estimate_tokens(text) < 70
+    assert 'section="items"' in REGISTRY.render()
+    assert prompts.format_items(items, tokens=10_000).count('\n') == 59
+
+
+def test_descriptions_and_text_are_deduplicated_and_clipped():
+    assert prompts.join_descriptions(['shirt', 'pants', 'shirt', '']) == 'shirt, pants'
+    assert prompts.join_descriptions([f'n{i}' for i in range(100)], tokens=20).endswith('more')
+    assert prompts.clip('casual outfit', 300) == 'casual outfit'
+    clipped = prompts.clip('word ' * 1000, 10)
+    assert len(clipped) <= 43 and clipped.endswith('...')
+
+
+def test_budgets_come_from_the_environment():
+    assert prompts.budget('compose') == prompts.DEFAULT_BUDGETS['compose']
+    with patch.dict(os.environ, {'PROMPT_BUDGET_COMPOSE': '42'}):
+        assert prompts.budget('compose') == 42
+
+
+def test_allocate_shares_what_small_sections_leave_over():
+    assert prompts.allocate(100, {'a': 10, 'b': 500, 'c': 500}) == {'a': 10, 'b': 45, 'c': 45}
+    assert prompts.allocate(100, {'a': 10, 'b': 20}) == {'a': 10, 'b': 20}
+    assert sum(prompts.allocate(7, {'a': 9, 'b': 9, 'c': 9}).values()) <= 7
+
+
+def test_history_keeps_newest_turns_within_budget():
+    turns = [types.SimpleNamespace(user_query=f'query {i}', response='answer ' * 20) for i in range(6)]
+    history = prompts.format_history(turns, tokens=60)
+    assert history.endswith('User: "query 5"\nYou: "' + 'answer ' * 20 + '"')
+    assert 'User: "query 4"' in history and 'answer' not in history.split('query 4')[1].split('query 5')[0]
+    assert history.startswith('(')
+    assert prompts.estimate_tokens(history) <= 60 + 10
+    assert prompts.format_history(turns, tokens=10_000).count('You:') == 6
+
+
+def test_prompt_sizes_are_recorded():
+    before = prompts.PROMPT_TOKENS.count(route='-', api='chat')
+    prompts.observe('chat', {'messages': [{'role': 'user', 'content': 'x' * 400}]})
+    prompts.observe('image', {'prompt': 'y' * 40})
+    assert prompts.PROMPT_TOKENS.count(route='-', api='chat') == before + 1
+    assert prompts.PROMPT_TOKENS.count(route='-', api='image') >= 1
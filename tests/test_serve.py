@@ -0,0 +1,49 @@
+import os
+import socket
+import threading
+import urllib.request
+from unittest.mock import patch
+
+import gevent_patch
+import serve
+
+
+def _hello_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'hello']
+
+
+def test_parser_reads_environment():
+    env = {'SERVER_WORKERS': '3', 'SERVER_THREADS': '2', 'SERVER_MAX_REQUESTS': '50', 'PORT': '9001'}
+    with patch.dict(os.environ, env):
+        args = serve.build_parser().parse_args([])
+    assert (args.workers, args.threads, args.max_requests, args.port) == (3, 2, 50, 9001)
+    args = serve.build_parser().parse_args(['--workers', '5'])
+    assert args.workers == 5
+
+
+def test_worker_server_recycles_after_max_requests():
+    sock = socket.create_server(('127.0.0.1', 0))
+    sock.setblocking(False)
+    server = serve.WorkerServer(sock, _hello_app, threads=2, max_requests=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = sock.getsockname()[1]
+    try:
+        for _ in range(2):
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=5) as response:
+                assert response.read() == b'hello'
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+        assert server.handled == 2
+    finally:
+        server.server_close()
+        sock.close()
+
+
+def test_gevent_is_selected_from_argv_or_environment():
+    assert gevent_patch.wants_gevent(['--worker-class', 'gevent'], env={})
+    assert gevent_patch.wants_gevent(['--workers', '2', '--worker-class=gevent'], env={})
+    assert not gevent_patch.wants_gevent(['--worker-class', 'sync'], env={'SERVER_WORKER_CLASS': 'gevent'})
+    assert gevent_patch.wants_gevent([], env={'SERVER_WORKER_CLASS': 'gevent'})
+    assert not gevent_patch.wants_gevent([], env={})
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import threading
+from unittest.mock import patch
+
+import similarity
+
+
+def _populate(index):
+    index.add(1, similarity.item_features({'category': 'shirt', 'color': 'red'}))
+    index.add(2, similarity.item_features({'category': 'shirt', 'color': 'orange'}))
+    index.add(3, similarity.item_features({'category': 'pants', 'color': 'blue'}))
+    index.add(4, similarity.item_features({'category': 'dress', 'color': 'white'}))
+
+
+def test_brute_force_nearest_neighbours():
+    index = similarity.BruteForceIndex()
+    _populate(index)
+    query = index.vector(1)
+    results = index.query(query, k=2, exclude=1)
+    assert results[0][0] == 2
+    assert len(results) == 2
+    assert results[0][1] < results[1][1]
+
+
+def test_brute_force_without_numpy():
+    with patch.object(similarity, 'np', None):
+        index = similarity.BruteForceIndex()
+        _populate(index)
+        results = index.query(index.vector(1), k=1, exclude=1)
+    assert results[0][0] == 2
+
+
+def test_add_replaces_existing_vector():
+    index = similarity.BruteForceIndex()
+    _populate(index)
+    index.add(1, similarity.item_features({'category': 'dress', 'color': 'white'}))
+    assert len(index) == 4
+    assert index.query(index.vector(4), k=1, exclude=4) == [(1, 0.0)]
+
+
+def test_store_persists_and_reloads():
+    with tempfile.TemporaryDirectory() as directory:
+        store = similarity.SimilarityIndexStore(directory)
+        store.add(7, 1, similarity.item_features({'category': 'shirt', 'color': 'red'}))
+        store.add(7, 2, similarity.item_features({'category': 'pants', 'color': 'black'}))
+        assert os.path.exists(os.path.join(directory, 'user_7.json'))
+
+        reloaded = similarity.SimilarityIndexStore(directory)
+        index = reloaded.get(7)
+        assert index.ids == [1, 2]
+
+
+def test_stores_sharing_a_directory_see_each_others_items():
+    # Two worker processes, each with its own cache
+    with tempfile.TemporaryDirectory() as directory:
+        first = similarity.SimilarityIndexStore(directory)
+        second = similarity.SimilarityIndexStore(directory)
+        first.add(7, 1, similarity.item_features({'category': 'shirt', 'color': 'red'}))
+        assert second.get(7).ids == [1]
+        second.add(7, 2, similarity.item_features({'category': 'pants', 'color': 'black'}))
+        first.add(7, 3, similarity.item_features({'category': 'dress', 'color': 'blue'}))
+        assert first.get(7).ids == [1, 2, 3]
+        assert second.get(7).ids == [1, 2, 3]
+
+
+def test_store_builds_from_loader():
+    store = similarity.SimilarityIndexStore()
+    loader = lambda: [(5, similarity.item_features({'category': 'shirt', 'color': 'blue'}))]
+    assert store.get(3, loader).ids == [5]
+
+
+def test_store_queries_while_items_are_added():
+    store = similarity.SimilarityIndexStore()
+    shirt = similarity.item_features({'category': 'shirt', 'color': 'red'})
+    store.add(3, 1, shirt)
+    errors = []
+
+    def add_items():
+        for item_id in range(2, 200):
+            store.add(3, item_id, similarity.item_features({'category': 'pants', 'color': 'black'}))
+
+    def query():
+        try:
+            for _ in range(200):
+                assert store.query(3, shirt, k=1) == [(1, 0.0)]
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=add_items), threading.Thread(target=query)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert store.query(3, shirt, k=300, exclude=1)[0][0] == 2
+
+def test_index_directory_for():
+    assert similarity.index_directory_for('sqlite:///:memory:') is None
+    assert similarity.index_directory_for('postgresql://db/x') is None
+    assert similarity.index_directory_for('sqlite:///data/app.db') == 'data/app.db.similarity'
+
+
+def test_make_index_backends():
+    assert similarity.make_index('brute').backend == 'brute'
+    if similarity.np is None:
+        assert similarity.make_index('lsh').backend == 'brute'
+    else:
+        index = similarity.make_index('lsh')
+        _populate(index)
+        assert index.query(index.vector(1), k=1, exclude=1)[0][0] == 2
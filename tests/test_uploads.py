@@ -0,0 +1,59 @@
+from flask_stub import File
+
+import app as app_module
+from metrics import REGISTRY
+from tests import bench
+from uploads import UploadSpool, spooling_request
+
+
+def _receive(spool, data, chunk=1000):
+    for start in range(0, len(data), chunk):
+        spool.write(data[start:start + chunk])
+    spool.seek(0)
+    return spool
+
+
+def test_spool_keeps_valid_images_and_moves_large_ones_to_disk():
+    png = bench.png_bytes(320, 240)
+    small = _receive(UploadSpool(limit=10 ** 6, formats={'png'}, max_size=10 ** 6), png)
+    assert small.rejected is None and small.size == len(png)
+    assert not small._rolled and small.read() == png
+    spilled = _receive(UploadSpool(limit=10 ** 6, formats={'png'}, max_size=100), png)
+    assert spilled._rolled and spilled.read() == png
+
+
+def test_spool_rejects_wrong_format_on_first_chunk():
+    spool = UploadSpool(limit=10 ** 6, formats={'png', 'jpeg'}, max_size=100)
+    spool.write(b'%PDF-1.7 ' + b'x' * 50)
+    assert spool.rejected == 'format'
+    _receive(spool, b'x' * 10000)
+    assert not spool._rolled and spool.read() == b''
+    assert 'wardrobe_upload_rejected_total{reason="format"}' in REGISTRY.render()
+
+
+def test_spool_stops_storing_past_the_limit():
+    jpeg = bench.jpeg_bytes(64, 48)
+    spool = _receive(UploadSpool(limit=len(jpeg) - 1, formats={'jpeg'}, max_size=100), jpeg + b'\x00' * 5000)
+    assert spool.rejected == 'too_large'
+    assert spool.size < len(jpeg) + 1000  # counting stopped at the chunk that crossed the limit
+    assert spool.read() == b''
+
+
+def test_rejected_spool_fails_validation():
+    spool = UploadSpool(limit=10, formats={'png'})
+    spool.write(bench.png_bytes(32, 32))
+    assert not app_module._is_allowed_image(File(spool, 'photo.png'))
+    accepted = _receive(UploadSpool(limit=10 ** 6, formats={'png'}), bench.png_bytes(32, 32))
+    assert app_module._is_allowed_image(File(accepted, 'photo.png'))
+
+
+def test_spooling_request_supplies_the_container():
+    class Base:
+        pass
+
+    request = spooling_request(Base, 1234, {'png'}, raw_paths={'/chunk'})()
+    request.path = '/parse'
+    spool = request._get_file_stream(None, 'image/png', 'a.png')
+    assert isinstance(spool, UploadSpool) and spool.limit == 1234 and spool.formats == {'png'}
+    request.path = '/chunk'
+    assert request._get_file_stream(None, 'application/octet-stream', 'blob').formats is None
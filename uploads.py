@@ -0,0 +1,90 @@
+"""Validate uploaded images while the request body is being received.
+
+Werkzeug writes every file part of a multipart body to a container as it
+parses the stream. :func:`spooling_request` swaps that container for an
+:class:`UploadSpool`. The spool checks the signature on the first chunk and
+counts bytes as they arrive. It keeps small files in memory and moves larger
+ones to a temporary file past :data:`UPLOAD_SPOOL_BYTES`. A part that is not
+an allowed image, or that grows past the size limit, is marked rejected, and
+the rest of it is read and discarded instead of being stored. Memory use
+therefore stays flat however large the upload is, and
+:func:`app._is_allowed_image` can refuse the file without reading it again.
+A request whose whole body is over ``MAX_CONTENT_LENGTH`` is refused by
+Werkzeug before any of it is read.
+"""
+
+import os
+import tempfile
+from typing import Optional
+
+import imageprobe
+from metrics import Counter
+
+#: Bytes of one uploaded file kept in memory before it spills to disk
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(512 * 1024)))
+
+UPLOAD_REJECTED = Counter(
+    "wardrobe_upload_rejected_total",
+    "Uploaded files refused while streaming, per reason (format or too_large)",
+    ["reason"],
+)
+
+
+class UploadSpool(tempfile.SpooledTemporaryFile):
+    """A spooled upload container that validates the data written to it.
+
+    Parameters
+    ----------
+    limit : int
+        Largest accepted file in bytes.
+    formats : set of str, optional
+        Formats, as named by :func:`imageprobe.sniff`, the file may have.
+        ``None`` accepts any content.
+    max_size : int
+        Bytes kept in memory before the data moves to a temporary file.
+    """
+
+    def __init__(self, limit: int, formats=None, max_size: int = UPLOAD_SPOOL_BYTES):
+        super().__init__(max_size=max_size)
+        self.limit = limit
+        self.formats = formats
+        self.size = 0
+        self.rejected: Optional[str] = None
+        self._head = b""
+
+    def _reject(self, reason: str) -> None:
+        self.rejected = reason
+        UPLOAD_REJECTED.inc(reason=reason)
+        # Drop what was stored so far; later writes are discarded
+        self.seek(0)
+        self.truncate()
+
+    def write(self, data) -> int:
+        if self.rejected is not None:
+            return len(data)
+        self.size += len(data)
+        if self.size > self.limit:
+            self._reject("too_large")
+            return len(data)
+        if self.formats is not None and len(self._head) < imageprobe.SNIFF_BYTES:
+            self._head += bytes(data[:imageprobe.SNIFF_BYTES - len(self._head)])
+            if len(self._head) >= imageprobe.SNIFF_BYTES and imageprobe.sniff(self._head) not in self.formats:
+                self._reject("format")
+                return len(data)
+        return super().write(data)
+
+
+def spooling_request(base, limit: int, formats=None, raw_paths=()):
+    """Return a subclass of the Flask request class ``base`` that spools uploads.
+
+    Every uploaded file is received into an :class:`UploadSpool` with the
+    given ``limit`` and ``formats``. Files sent to ``raw_paths`` may hold any
+    bytes, such as the chunks of a larger image, and only the limit applies.
+    """
+
+    class SpoolingRequest(base):
+        def _get_file_stream(self, total_content_length, content_type, filename=None,
+                             content_length=None):
+            return UploadSpool(limit, None if self.path in raw_paths else formats)
+
+    return SpoolingRequest